@@ -1,7 +1,6 @@
 import os # Import os
 from dotenv import load_dotenv # Keep load_dotenv import here
 import csv
-import difflib
 
 # Load environment variables from .env file FIRST
 # Construct path relative to this file (app.py)
@@ -18,14 +17,13 @@ import click # Import click for CLI commands
 from flask.cli import with_appcontext # Import for CLI commands
 from datetime import date, timedelta, datetime, timezone
 import pandas as pd # Placeholder for future data loading
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from werkzeug.utils import secure_filename # For file uploads
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from prophet import Prophet # Import Prophet
 from dateutil.parser import isoparse # For parsing ISO 8601 dates
 from collections import defaultdict
 from extensions import cache # Import cache object from extensions
+import memoize
 import logging
 from functools import wraps
 from flask_caching import Cache
@@ -33,7 +31,21 @@ from flask_caching import Cache
 # Import the boulevard client functions
 import boulevard_client
 from database import get_db
-from constants import BOULEVARD_CATEGORY_MAPPING
+from constants import BOULEVARD_CATEGORY_MAPPING, BOULEVARD_KEYWORD_RULES
+from location_registry import registry as location_registry
+from migrations import apply_migrations
+import order_store
+import order_aggregation
+import time_buckets
+import sales_rollup
+import forecast_models
+import forecasters
+import cost_index
+import transaction_import
+import import_jobs
+import categorizer
+import cache_keys
+import cache_tags
 
 app = Flask(__name__, instance_relative_config=True, static_folder='static', static_url_path='') # Serve static files at root
 CORS(app, 
@@ -77,10 +89,20 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1) # Session lifetime
 # --- End Session Configuration ---
 
 # --- Caching Configuration --- 
-app.config['CACHE_TYPE'] = 'SimpleCache'  # Use simple in-memory cache
+# Shared by every worker through a SQLite file in the instance folder (see shared_cache.py)
+app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'shared_cache.SQLiteCache')
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300 # Default cache timeout 5 minutes (300 seconds)
+app.config['CACHE_THRESHOLD'] = int(os.getenv('CACHE_THRESHOLD', '2000')) # Max entries before LRU eviction
 # cache = Cache(app) # REMOVE direct instantiation
 cache.init_app(app) # Initialize cache using the object from extensions
+_cache_backend = app.extensions['cache'][cache] # cache.cache needs an app context
+if hasattr(_cache_backend, 'get_or_set'):
+    memoize.configure_shared(_cache_backend) # Boulevard fetches are shared between workers too
+else:
+    print(f"[Cache] {type(_cache_backend).__name__} is per process; memoized fetches are not shared between workers")
+tagged_cache = cache_tags.TaggedCache(cache) # Responses invalidated by location/date/source (see cache_tags.py)
+with app.app_context():
+    tagged_cache.check() # Logs an error if the backend cannot keep tag tokens
 # --- End Caching Configuration ---
 
 # --- Logging Configuration ---
@@ -305,6 +327,13 @@ BOULEVARD_CATEGORY_MAPPING = {
     "DEFAULT_CATEGORY": "Uncategorized" # A default for items not in the map
 }
 
+# Compiled from the mapping (exact and normalized names) plus the fallback keyword rules
+boulevard_categorizer = categorizer.Categorizer(
+    {name: category for name, category in BOULEVARD_CATEGORY_MAPPING.items() if name != "DEFAULT_CATEGORY"},
+    BOULEVARD_KEYWORD_RULES,
+    default=BOULEVARD_CATEGORY_MAPPING.get("DEFAULT_CATEGORY", "Uncategorized")
+)
+
 # --- Database Configuration ---
 # Ensure instance folder exists
 try:
@@ -338,6 +367,10 @@ def init_db():
     # Execute schema first
     with app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+
+    # schema.sql recreates the base tables, so re-run every migration on top
+    db.execute('PRAGMA user_version = 0')
+    apply_migrations(db)
     
     # Generate proper password hash for admin user
     admin_password = 'password'
@@ -366,17 +399,160 @@ def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Apply pending schema migrations without clearing data."""
+    applied = apply_migrations(get_db())
+    click.echo(f'Applied {applied} migration(s).')
+
 app.teardown_appcontext(close_db) # Register close_db to be called when app context ends
 app.cli.add_command(init_db_command) # Register the init-db command
+app.cli.add_command(migrate_db_command)
+
+# Bring existing databases up to date on startup
+with app.app_context():
+    try:
+        apply_migrations(get_db())
+        # Only reported here; `flask check-query-plans` is the check that fails
+        query_plan_problems = sales_rollup.full_scans(get_db())
+    except sqlite3.Error as e:
+        print(f"Warning: Could not apply database migrations: {e}")
+    else:
+        if query_plan_problems:
+            print(
+                f"Warning: Date-range reads fall back to full table scans in {', '.join(query_plan_problems)}; "
+                "run 'flask check-query-plans' for the plans"
+            )
+
+location_registry.configure(DATABASE)
+forecast_models.registry.configure(os.path.join(app.instance_path, 'forecast_models'))
+# Hooks are looked up when a job runs (both are defined further down)
+import_jobs.runner.configure(
+    DATABASE, os.path.join(app.instance_path, 'uploads'),
+    before_commit=lambda db, days: _refresh_transaction_rollup(db, days),
+    after_commit=lambda days, locations, recosted: _after_transaction_import(days, locations, recosted)
+)
 
 # --- Other Endpoints --- 
 # ... (rest of your app.py file) ...
 
-def _make_cache_key(*args, **kwargs):
-    """Generate a cache key that includes query parameters."""
-    key = request.path
-    args = str(hash(frozenset(request.args.items())))
-    return f"{key}|{args}"
+def _load_orders_by_location(location_ids, start_date=None, end_date=None, days_history=None):
+    """Returns {location_id: [orders]} for the requested range.
+
+    Locations that have been synced with `flask sync-orders` are read from the
+    local order store; any others fall back to a live (concurrent) Boulevard fetch.
+    Dates are inclusive 'YYYY-MM-DD' strings; days_history instead means
+    "the last N days" (the forecast's history window).
+    """
+    if days_history is not None:
+        start_date = (datetime.now(timezone.utc) - timedelta(days=days_history)).strftime('%Y-%m-%d')
+        end_date = None
+
+    db = get_db()
+    synced_ids = order_store.synced_location_ids(db, location_ids)
+    orders_by_location = order_store.load_orders(db, [loc for loc in location_ids if loc in synced_ids], start_date, end_date)
+
+    live_ids = [loc for loc in location_ids if loc not in synced_ids]
+    if live_ids:
+        if days_history is not None:
+            live_orders = boulevard_client.fetch_for_locations(
+                boulevard_client.get_historical_orders, live_ids, days_history=days_history
+            )
+        else:
+            query_string = None
+            if start_date:
+                query_string = f"closedAt >= '{start_date}T00:00:00Z'"
+                if end_date:
+                    query_string += f" AND closedAt <= '{end_date}T23:59:59Z'"
+            live_orders = boulevard_client.fetch_for_locations(
+                boulevard_client.get_boulevard_kpi_data, live_ids, query_string=query_string
+            )
+        orders_by_location.update(live_orders)
+
+    # Keep the caller's location order
+    return {loc: orders_by_location.get(loc) for loc in location_ids}
+
+def _category_for(item_name):
+    """Maps a Boulevard service/product name to its category (memoized per distinct name)."""
+    return boulevard_categorizer(item_name)
+
+def _kpi_unit_cost_lookup(db):
+    """Returns unit_cost(name, item_type) -> (fixed_unit_cost, cost_ratio) backed by the cost index.
+
+    Names are resolved through item_cost_index (exact, normalized or fuzzy
+    match against the inventory costs, see cost_index.py), then by exact
+    inventory_costs name for items the index does not know. Items without an
+    inventory cost fall back to default cost percentages (40% of the line
+    for products, 30% for services).
+    """
+    indexed_costs = {}
+    inventory_costs = {}
+    try:
+        for row in db.execute("SELECT item_type, item_name, unit_cost FROM item_cost_index WHERE match_type != 'none'").fetchall():
+            indexed_costs[(row[0], row[1])] = float(row[2] or 0.0)
+        for row in db.execute('SELECT name, avg_unit_cost FROM inventory_costs').fetchall():
+            inventory_costs[row[0]] = float(row[1]) if row[1] else 0.0
+    except Exception as db_error:
+        print(f"Warning: Could not fetch inventory costs: {db_error}")
+
+    def unit_cost(item_name, item_type):
+        if (item_type, item_name) in indexed_costs:
+            return indexed_costs[(item_type, item_name)], 0.0
+        if item_name in inventory_costs:
+            return inventory_costs[item_name], 0.0
+        return None, (0.4 if item_type == 'product' else 0.3)
+
+    return unit_cost
+
+# Dashboard widgets for the same range request the same aggregate; keep it briefly
+ORDER_AGGREGATE_CACHE_TTL = int(os.getenv('ORDER_AGGREGATE_CACHE_TTL', '60'))
+
+def _get_order_aggregate(location_ids, start_date=None, end_date=None, days_history=None, hourly=False):
+    """Aggregates the orders of the range (see order_aggregation).
+
+    Synced locations are read from the daily sales rollups; the rest (and
+    every location when hourly resolution is needed) are aggregated from
+    their orders in one pass.
+    """
+    location_ids = list(location_ids)
+    first_day, last_day = start_date, end_date
+    if days_history is not None:
+        first_day = (datetime.now(timezone.utc) - timedelta(days=days_history)).strftime('%Y-%m-%d')
+        last_day = None
+    # Memoized under the tokens of the data's tags, so an invalidation in any
+    # process (e.g. the sync CLI) retires the entries of every worker
+    data_version = tagged_cache.version(
+        cache_tags.scope_tags(sales_rollup.SOURCE_ORDERS, location_ids, first_day, last_day)
+    )
+    return _memoized_order_aggregate(location_ids, start_date, end_date, days_history, hourly, data_version)
+
+@memoize.ttl_memoize(ttl=ORDER_AGGREGATE_CACHE_TTL, maxsize=32, name='order_aggregate')
+def _memoized_order_aggregate(location_ids, start_date, end_date, days_history, hourly, data_version):
+    """_get_order_aggregate() for one version of the data (data_version only keys the memo)."""
+    location_ids = list(location_ids)
+    db = get_db()
+    rollup_ids = set() if hourly else order_store.synced_location_ids(db, location_ids)
+
+    aggregates = []
+    if rollup_ids:
+        rollup_start, rollup_end = start_date, end_date
+        if days_history is not None:
+            rollup_start = (datetime.now(timezone.utc) - timedelta(days=days_history)).strftime('%Y-%m-%d')
+            rollup_end = None
+        # Categories are re-derived on read, so rollups built with older rules still match
+        aggregates.append(sales_rollup.load_aggregate(
+            db, [loc for loc in location_ids if loc in rollup_ids], rollup_start, rollup_end, categorize=_category_for
+        ))
+    order_ids = [loc for loc in location_ids if loc not in rollup_ids]
+    if order_ids or not aggregates:
+        orders_by_location = _load_orders_by_location(order_ids, start_date, end_date, days_history)
+        aggregates.append(order_aggregation.aggregate_orders(orders_by_location, _category_for, _kpi_unit_cost_lookup(db)))
+    return order_aggregation.merge_aggregates(aggregates)
+
+def _refresh_order_rollup(db, location_id, first_day, last_day):
+    """order_store.sync_location hook: keeps the daily sales rollups in step with synced orders."""
+    sales_rollup.refresh_orders(db, location_id, first_day, last_day, _category_for, _kpi_unit_cost_lookup(db))
 
 @app.route('/api/v1/sales/by_category', methods=['GET'])
 def get_sales_by_category():
@@ -390,66 +566,19 @@ def get_sales_by_category():
         # --- Step 1: Get Location IDs to query ---
         target_location_ids = []
         if location_id == 'all':
-            locations_response = boulevard_client.get_boulevard_locations()
-            if locations_response and 'data' in locations_response and 'locations' in locations_response['data']:
-                for edge in locations_response['data']['locations'].get('edges', []):
-                    if edge and 'node' in edge and 'id' in edge['node']:
-                        target_location_ids.append(edge['node']['id'])
+            target_location_ids = location_registry.get_location_ids()
             if not target_location_ids:
                 print("Warning: Could not fetch location IDs for category breakdown.")
                 return jsonify({"error": "Could not fetch location IDs."}), 500
         else:
             target_location_ids.append(location_id)
 
-        # --- Step 2: Fetch Sales Data and Aggregate by Category ---
-        sales_by_category = defaultdict(float)
-        
-        for loc_id in target_location_ids:
-            # Use the Boulevard client to get sales data
-            location_orders = boulevard_client.get_boulevard_kpi_data(
-                location_id=loc_id,
-                query_string=f"closedAt>={start_date_str}" if start_date_str else None
-            )
-            
-            if not location_orders:
-                continue
-
-            for order in location_orders:
-                if 'lineGroups' not in order:
-                    continue
-
-                for group in order['lineGroups']:
-                    if 'lines' not in group:
-                        continue
-
-                    for line in group['lines']:
-                        item_name = line.get('name')
-                        if not item_name:
-                            continue
-
-                        # Get category from mapping
-                        category = BOULEVARD_CATEGORY_MAPPING.get(
-                            item_name, 
-                            BOULEVARD_CATEGORY_MAPPING.get("DEFAULT_CATEGORY", "Uncategorized")
-                        )
-
-                        # Add sales amount to category
-                        subtotal_cents = line.get('currentSubtotal', 0)
-                        if isinstance(subtotal_cents, (int, float)):
-                            sale_amount = subtotal_cents / 100.0
-                            sales_by_category[category] += sale_amount
+        # --- Step 2: Aggregate Sales by Category (shared single-pass aggregate) ---
+        agg = _get_order_aggregate(target_location_ids, start_date_str, end_date_str)
 
         # --- Step 3: Prepare Output ---
-        # Get all possible categories from the mapping
-        all_categories = set(BOULEVARD_CATEGORY_MAPPING.values())
-        
-        # Create result array with all categories (including those with 0 sales)
-        result = []
-        for category in sorted(all_categories):
-            result.append({
-                "name": category,
-                "value": round(sales_by_category.get(category, 0.0), 2)
-            })
+        # All possible categories from the mapping (including those with 0 sales)
+        result = order_aggregation.project_category_sales(agg, set(BOULEVARD_CATEGORY_MAPPING.values()))
 
         return jsonify(result)
 
@@ -469,121 +598,39 @@ def get_sales_over_time():
         end_date_str = request.args.get('end_date', default=None, type=str)
         interval = request.args.get('interval', default='day', type=str)
 
-        if interval not in ['day', 'week', 'month']:
-            return jsonify({"error": "Invalid interval. Must be 'day', 'week', or 'month'."}), 400
+        if interval not in time_buckets.INTERVALS:
+            return jsonify({"error": f"Invalid interval. Must be one of: {', '.join(time_buckets.INTERVALS)}."}), 400
 
         # --- Step 1: Get Location IDs to query ---
         target_location_ids = []
         if location_id == 'all':
-            locations_response = boulevard_client.get_boulevard_locations()
-            if locations_response and 'data' in locations_response and 'locations' in locations_response['data']:
-                for edge in locations_response['data']['locations'].get('edges', []):
-                    if edge and 'node' in edge and 'id' in edge['node']:
-                        target_location_ids.append(edge['node']['id'])
+            target_location_ids = location_registry.get_location_ids()
             if not target_location_ids:
                 print("Warning: Could not fetch location IDs for time-series data.")
                 return jsonify({"error": "Could not fetch location IDs."}), 500
         else:
             target_location_ids.append(location_id)
 
-        # --- Step 2: Fetch Sales Data for Each Location ---
-        # Use defaultdict to aggregate sales by date
-        from collections import defaultdict
-        sales_by_date = defaultdict(float)
-        transaction_counts = defaultdict(int)
-
-        for loc_id in target_location_ids:
-            # Use the Boulevard client to get sales data
-            location_orders = boulevard_client.get_boulevard_kpi_data(
-                location_id=loc_id,
-                query_string=f"closedAt>={start_date_str}" if start_date_str else None
-            )
-            
-            if not location_orders:
-                continue
-
-            for order in location_orders:
-                if 'closedAt' not in order or 'summary' not in order:
-                    continue
-
-                try:
-                    # Parse the timestamp
-                    closed_dt = datetime.fromisoformat(order['closedAt'].replace('Z', '+00:00'))
-                    
-                    # Get the appropriate date key based on interval
-                    if interval == 'day':
-                        date_key = closed_dt.date().isoformat()
-                    elif interval == 'week':
-                        # Get the Monday of the week
-                        monday = closed_dt.date() - timedelta(days=closed_dt.weekday())
-                        date_key = monday.isoformat()
-                    else:  # month
-                        date_key = f"{closed_dt.year}-{closed_dt.month:02d}-01"
-
-                    # Add sales amount
-                    subtotal_cents = order['summary'].get('currentSubtotal', 0)
-                    if isinstance(subtotal_cents, (int, float)):
-                        sale_amount = subtotal_cents / 100.0
-                        sales_by_date[date_key] += sale_amount
-                        transaction_counts[date_key] += 1
-
-                except (ValueError, KeyError) as e:
-                    print(f"Error processing order date: {e}")
-                    continue
+        # --- Step 2: Bucket the shared aggregate's timeline by interval (gaps zero-filled) ---
+        agg = _get_order_aggregate(target_location_ids, start_date_str, end_date_str, hourly=(interval == 'hour'))
+        timeline = agg['timeline']
+        labels, sums = time_buckets.resample(
+            timeline['epoch'],
+            {'sales': timeline['sales'], 'transactions': timeline['transactions']},
+            interval
+        )
 
         # --- Step 3: Prepare Output ---
-        # Convert defaultdict to sorted list of dicts
         time_series_data = []
-        for date_key in sorted(sales_by_date.keys()):
+        for date_key, sales, transactions in zip(labels, sums['sales'].tolist(), sums['transactions'].tolist()):
+            transactions = int(transactions)
             time_series_data.append({
                 'date': date_key,
-                'sales': round(sales_by_date[date_key], 2),
-                'transactions': transaction_counts[date_key],
-                'average_transaction': round(
-                    sales_by_date[date_key] / transaction_counts[date_key]
-                    if transaction_counts[date_key] > 0 else 0,
-                    2
-                )
+                'sales': round(sales, 2),
+                'transactions': transactions,
+                'average_transaction': round(sales / transactions if transactions > 0 else 0, 2)
             })
 
-        # Fill in gaps in the time series if needed
-        if time_series_data and interval in ['day', 'week', 'month']:
-            start_date = datetime.fromisoformat(time_series_data[0]['date'])
-            end_date = datetime.fromisoformat(time_series_data[-1]['date'])
-            
-            current_date = start_date
-            filled_data = []
-            
-            while current_date <= end_date:
-                date_key = current_date.date().isoformat()
-                existing_data = next(
-                    (item for item in time_series_data if item['date'] == date_key),
-                    None
-                )
-                
-                if existing_data:
-                    filled_data.append(existing_data)
-                else:
-                    filled_data.append({
-                        'date': date_key,
-                        'sales': 0.0,
-                        'transactions': 0,
-                        'average_transaction': 0.0
-                    })
-                
-                # Increment date based on interval
-                if interval == 'day':
-                    current_date += timedelta(days=1)
-                elif interval == 'week':
-                    current_date += timedelta(weeks=1)
-                else:  # month
-                    if current_date.month == 12:
-                        current_date = current_date.replace(year=current_date.year + 1, month=1)
-                    else:
-                        current_date = current_date.replace(month=current_date.month + 1)
-
-            time_series_data = filled_data
-
         return jsonify({
             'interval': interval,
             'data': time_series_data
@@ -595,114 +642,122 @@ def get_sales_over_time():
         traceback.print_exc()
         return jsonify({"error": f"Failed to generate time-series data: {str(e)}"}), 500
 
+def _forecast_records(forecast_frame):
+    """Formats a predictions frame (ds, yhat, yhat_lower, yhat_upper) as JSON-ready rows."""
+    records = forecast_frame[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].rename(columns={
+        'ds': 'date', 
+        'yhat': 'mean', 
+        'yhat_lower': 'mean_ci_lower', 
+        'yhat_upper': 'mean_ci_upper'
+    }).to_dict('records')
+    for row in records:
+        if isinstance(row['date'], (date, datetime, pd.Timestamp)): # Check if it's a date object
+            row['date'] = row['date'].strftime('%Y-%m-%d')
+        # Ensure forecast values are rounded reasonably
+        for col in ['mean', 'mean_ci_lower', 'mean_ci_upper']:
+            row[col] = round(row[col], 2) if col in row else None
+    return records
+
 @app.route('/api/v1/sales/forecast', methods=['GET'])
 def get_sales_forecast():
-    """Generates a sales forecast using Prophet based on historical Boulevard orders."""
+    """Generates a sales forecast (see forecasters.py for the models) based on historical Boulevard orders."""
     # Get filters and forecast days from request
     requested_location_id = request.args.get('location_id', default='all', type=str)
     forecast_days = request.args.get('days', default=30, type=int)
     history_days = request.args.get('history', default=365, type=int) # How many days back to fetch
+    # Also fit one model per location (concurrently) and reconcile them with the total
+    per_location = request.args.get('per_location', default='false', type=str).lower() in ('1', 'true', 'yes')
+    try:
+        forecaster = forecasters.get_forecaster(request.args.get('model', default=None, type=str))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         # --- Step 1: Get Location IDs to query --- 
         target_location_ids = []
         if requested_location_id == 'all':
-            locations_response = boulevard_client.get_boulevard_locations()
-            if locations_response and 'data' in locations_response and 'locations' in locations_response['data']:
-                for edge in locations_response['data']['locations'].get('edges', []):
-                    if edge and 'node' in edge and 'id' in edge['node']:
-                        target_location_ids.append(edge['node']['id'])
+            target_location_ids = location_registry.get_location_ids()
             if not target_location_ids:
                  print("Warning: Could not fetch location IDs for forecast.")
                  return jsonify({"error": "Could not fetch location IDs for forecast."}), 500
         else:
             target_location_ids.append(requested_location_id)
         
-        # --- Step 2: Fetch Historical Orders for each location --- 
-        all_historical_orders = []
-        for loc_id in target_location_ids:
-            orders_for_location = boulevard_client.get_historical_orders(location_id=loc_id, days_history=history_days)
-            if orders_for_location:
-                all_historical_orders.extend(orders_for_location)
+        # --- Step 2: Aggregate daily sales from the historical orders --- 
+        agg = _get_order_aggregate(target_location_ids, days_history=history_days)
         
-        if not all_historical_orders:
+        if not agg['order_count']:
             return jsonify({"error": "No historical order data found for the selected scope.", "historical": [], "forecast": []}), 404
             
-        # --- Step 3: Process data and aggregate daily sales --- 
-        daily_sales = {}
-        for order in all_historical_orders:
-            try:
-                # Parse the ISO 8601 closedAt timestamp
-                closed_dt = isoparse(order.get('closedAt'))
-                # Ensure timezone-aware comparison or convert to consistent timezone (e.g., UTC)
-                # For simplicity, we use the date part only
-                day = closed_dt.date() # Group by date
-                
-                summary = order.get('summary')
-                sale_amount = 0.0
-                if summary and isinstance(summary, dict):
-                    subtotal_cents = summary.get('currentSubtotal')
-                    if isinstance(subtotal_cents, int):
-                        sale_amount = subtotal_cents / 100.0
-                
-                # Aggregate sales per day
-                daily_sales[day] = daily_sales.get(day, 0.0) + sale_amount
-            except Exception as parse_ex:
-                print(f"Warning: Could not process order {order.get('id')}: {parse_ex}")
-                continue # Skip orders with processing errors
+        # --- Step 3: Daily sales come straight from the shared aggregate --- 
+        daily_sales = {day: metrics['sales'] for day, metrics in agg['daily'].items()}
 
         if not daily_sales:
             return jsonify({"error": "Could not aggregate daily sales data.", "historical": [], "forecast": []}), 500
             
-        # --- Step 4: Prepare DataFrame for Prophet --- 
+        # --- Step 4: Prepare DataFrame for the forecaster --- 
         df = pd.DataFrame(list(daily_sales.items()), columns=['ds', 'y'])
         df = df.sort_values(by='ds')
         
         if len(df) < 2:
             return jsonify({"error": "Insufficient historical data points for forecasting (need at least 2 days).", "historical": df.to_dict('records'), "forecast": []}), 400
 
-        # --- Step 5: Fit Prophet Model --- 
-        model = Prophet() # Default settings are often quite good
-        model.fit(df)
-        
-        # --- Step 6: Generate Forecast --- 
-        future = model.make_future_dataframe(periods=forecast_days)
-        forecast_result = model.predict(future)
+        # --- Step 5/6: Forecast from the model registry --- 
+        # Fitted models are cached per scope/history window and retrained in the
+        # background when the data changes; only the first request fits inline.
+        model_key = forecast_models.registry.make_key(target_location_ids, history_days, forecaster.name)
+        location_forecasts = []
+        skipped_locations = []
+        if per_location and len(target_location_ids) > 1:
+            # Fit the total and per-location models together on a process pool
+            frames = {model_key: df}
+            location_keys = {}
+            for loc_id in target_location_ids:
+                loc_daily = _get_order_aggregate([loc_id], days_history=history_days)['daily']
+                if len(loc_daily) < 2:
+                    skipped_locations.append(loc_id) # Too little history to fit; forecast as zero
+                    continue
+                location_keys[loc_id] = forecast_models.registry.make_key([loc_id], history_days, forecaster.name)
+                frames[location_keys[loc_id]] = pd.DataFrame(
+                    sorted((day, metrics['sales']) for day, metrics in loc_daily.items()), columns=['ds', 'y']
+                )
+            results = forecast_models.registry.forecast_many(frames, forecast_days)
+            forecast_result, model_status = results[model_key]
+            forecast_result, reconciled = forecast_models.reconcile(
+                forecast_result, {loc_id: results[key][0] for loc_id, key in location_keys.items()}
+            )
+            for loc_id, frame in reconciled.items():
+                location = location_registry.get_by_id(loc_id) or {}
+                location_forecasts.append({
+                    "location_id": loc_id,
+                    "name": location.get('name'),
+                    "model_status": results[location_keys[loc_id]][1],
+                    "forecast": _forecast_records(frame)
+                })
+        else:
+            forecast_result, model_status = forecast_models.registry.forecast(model_key, df, forecast_days)
         
         # --- Step 7: Prepare Output --- 
         # Prepare historical data output (original daily aggregated data)
-        historical_output_df = df.copy()
-        historical_output_df = historical_output_df.rename(columns={'ds': 'date', 'y': 'sales'}) # RENAME COLUMNS
-        
-        # Select relevant columns from forecast and RENAME
-        forecast_output_df = forecast_result[['ds', 'yhat', 'yhat_lower', 'yhat_upper']] 
-        forecast_output_df = forecast_output_df.rename(columns={
-            'ds': 'date', 
-            'yhat': 'mean', 
-            'yhat_lower': 'mean_ci_lower', 
-            'yhat_upper': 'mean_ci_upper'
-        }) 
-        
-        # Convert DataFrames to list of dicts for JSON
-        historical_output = historical_output_df.to_dict('records')
-        forecast_output = forecast_output_df.to_dict('records')
+        historical_output = df.rename(columns={'ds': 'date', 'y': 'sales'}).to_dict('records') # RENAME COLUMNS
 
         # Ensure date format is string YYYY-MM-DD for JSON
         for row in historical_output:
-            if isinstance(row['date'], (datetime, pd.Timestamp)): # Check if it's a date object
+            if isinstance(row['date'], (date, datetime, pd.Timestamp)): # Check if it's a date object
                 row['date'] = row['date'].strftime('%Y-%m-%d')
-        for row in forecast_output:
-            if isinstance(row['date'], (datetime, pd.Timestamp)): # Check if it's a date object
-                row['date'] = row['date'].strftime('%Y-%m-%d')
-            # Ensure forecast values are rounded reasonably
-            for col in ['mean', 'mean_ci_lower', 'mean_ci_upper']:
-                row[col] = round(row[col], 2) if col in row else None
-            
-        return jsonify({
+
+        response = {
             "historical": historical_output,
-            "forecast": forecast_output,
-            "note": f"Forecast generated using Prophet based on {len(df)} days of historical data from Boulevard API."
-        })
+            "forecast": _forecast_records(forecast_result),
+            "note": f"Forecast generated using {forecaster.name} based on {len(df)} days of historical data from Boulevard API.",
+            "model": forecaster.name,
+            "model_status": model_status
+        }
+        if per_location and len(target_location_ids) > 1:
+            response["locations"] = location_forecasts
+            response["skipped_locations"] = skipped_locations
+            response["reconciliation"] = "ols" # "forecast" is the reconciled total
+        return jsonify(response)
 
     except Exception as e:
         print(f"Error during forecasting: {e}") # Log the error server-side
@@ -710,37 +765,86 @@ def get_sales_forecast():
         traceback.print_exc() # Print full traceback for debugging
         return jsonify({"error": f"An unexpected error occurred during forecasting: {e}"}), 500
 
+@app.route('/api/v1/sales/forecast/backtest', methods=['GET'])
+def get_forecast_backtest():
+    """Compares forecast models (accuracy vs. fit time) on the selected history with a rolling-origin backtest."""
+    requested_location_id = request.args.get('location_id', default='all', type=str)
+    history_days = request.args.get('history', default=365, type=int)
+    horizon = request.args.get('horizon', default=14, type=int)
+    folds = request.args.get('folds', default=3, type=int)
+    models = request.args.get('models', default=None, type=str)
+    model_names = [name.strip() for name in models.split(',') if name.strip()] if models else None
+
+    try:
+        for name in model_names or []:
+            forecasters.get_forecaster(name)
+
+        target_location_ids = location_registry.get_location_ids() if requested_location_id == 'all' else [requested_location_id]
+        if not target_location_ids:
+            return jsonify({"error": "Could not fetch location IDs for backtest."}), 500
+
+        agg = _get_order_aggregate(target_location_ids, days_history=history_days)
+        df = pd.DataFrame(sorted((day, metrics['sales']) for day, metrics in agg['daily'].items()), columns=['ds', 'y'])
+        if df.empty:
+            return jsonify({"error": "No historical order data found for the selected scope."}), 404
+
+        results = forecasters.backtest(df, model_names, horizon=horizon, folds=folds)
+        return jsonify({"horizon": horizon, "history_days": len(df), "results": results})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error during forecast backtest: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"An unexpected error occurred during the backtest: {e}"}), 500
+
+@click.command('train-forecasts')
+@click.option('--model', 'model_name', default='prophet', show_default=True, help='Forecast model to train.')
+@click.option('--history', 'history_days', default=365, show_default=True, help='History window (days) the models are keyed on.')
+@click.option('--per-location', is_flag=True, help='Also train one model per location.')
+@with_appcontext
+def train_forecasts_command(model_name, history_days, per_location):
+    """Fit forecast models ahead of time (e.g. nightly) so requests are served from the model registry."""
+    location_ids = location_registry.get_location_ids()
+    if not location_ids:
+        click.echo("No locations to train (could not load Boulevard locations).")
+        return
+    scopes = [location_ids] + ([[loc_id] for loc_id in location_ids] if per_location else [])
+    frames = {}
+    for scope in scopes:
+        daily = _get_order_aggregate(scope, days_history=history_days)['daily']
+        if len(daily) < 2:
+            click.echo(f"{', '.join(scope)}: not enough history, skipped")
+            continue
+        key = forecast_models.registry.make_key(scope, history_days, model_name)
+        frames[key] = pd.DataFrame(sorted((day, metrics['sales']) for day, metrics in daily.items()), columns=['ds', 'y'])
+    for key, (_, status) in forecast_models.registry.forecast_many(frames, 30).items():
+        click.echo(f"{', '.join(key[0])}: {status}")
+
+app.cli.add_command(train_forecasts_command)
+
 # --- Utility Endpoints ---
 
 @app.route('/api/v1/locations', methods=['GET'])
 def get_locations():
     """Retrieves list of available locations from Boulevard API."""
     try:
-        # Call the Boulevard client function
-        boulevard_data = boulevard_client.get_boulevard_locations()
-        
-        # Check for errors from the API call
-        if boulevard_data is None or 'errors' in boulevard_data or 'data' not in boulevard_data:
-            error_detail = boulevard_data.get('errors', 'Unknown API error') if boulevard_data else 'No response'
-            print(f"Error fetching locations from Boulevard: {error_detail}")
-            return jsonify({"error": "Failed to fetch locations from source API.", "details": error_detail}), 502 # Bad Gateway
-        
-        # Extract location data from the nested structure
+        # Served from the location registry (refreshed from Boulevard in the background)
+        registry_locations = location_registry.get_locations()
+        if not registry_locations:
+            print("Error fetching locations from Boulevard: registry is empty")
+            return jsonify({"error": "Failed to fetch locations from source API.", "details": "No locations available"}), 502 # Bad Gateway
+
         locations = []
-        if boulevard_data['data'] and 'locations' in boulevard_data['data'] and boulevard_data['data']['locations'] and 'edges' in boulevard_data['data']['locations']:
-            for edge in boulevard_data['data']['locations']['edges']:
-                if edge and 'node' in edge:
-                    node = edge['node']
-                    # Adapt this structure based on actual fields available/needed
-                    locations.append({
-                        "location_id": node.get('id'), # Using Boulevard ID
-                        "name": node.get('name'),
-                        "address": node.get('address'), # Add other fields if needed/available
-                        "latitude": node.get('latitude'),
-                        "longitude": node.get('longitude'),
-                        # Add other fields as necessary, map to expected frontend keys
-                        # e.g., "total_sales" would need a separate calculation or call
-                    })
+        for loc in registry_locations:
+            # Adapt this structure based on actual fields available/needed
+            locations.append({
+                "location_id": loc['id'], # Using Boulevard ID
+                "name": loc['name'],
+                "address": loc['address'],
+                "latitude": loc.get('latitude'),
+                "longitude": loc.get('longitude'),
+            })
         
         return jsonify(locations)
 
@@ -839,15 +943,7 @@ def get_customer_locations():
 # Define allowed file extensions (optional but good practice)
 ALLOWED_EXTENSIONS = {'csv'}
 # Define required columns for transaction upload validation
-REQUIRED_TRANSACTION_COLUMNS = [
-    'transaction_time', 
-    'location_name', 
-    'item_type', 
-    'item_identifier', 
-    'quantity', 
-    'net_price'
-    # Add optional columns like 'customer_id', 'employee_id' if needed for validation stage
-]
+REQUIRED_TRANSACTION_COLUMNS = transaction_import.REQUIRED_COLUMNS
 
 # Helper function to check allowed extensions
 def allowed_file(filename):
@@ -858,7 +954,13 @@ def allowed_file(filename):
 
 @app.route('/api/v1/data/upload/validate_transactions', methods=['POST'])
 def validate_transaction_upload():
-    """Validates an uploaded transaction CSV file structure."""
+    """Validates an uploaded transaction CSV without loading it whole.
+
+    Checks the header, counts rows with a newline scan and runs the import's
+    type/format checks (timestamps, known locations and items, numbers) on
+    the first VALIDATION_SAMPLE_ROWS rows only; see transaction_import.validate_upload.
+    With mode=upsert the transaction_key column is required too.
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
     
@@ -868,32 +970,46 @@ def validate_transaction_upload():
         return jsonify({"error": "No selected file"}), 400
         
     if file and allowed_file(file.filename):
-        # filename = secure_filename(file.filename) # Use if saving file
+        mode = request.values.get('mode', transaction_import.MODE_REPLACE)
         try:
-            # Read CSV using pandas - handle potential parsing errors
-            df = pd.read_csv(file.stream)
-            
-            # Validate columns
-            missing_cols = [col for col in REQUIRED_TRANSACTION_COLUMNS if col not in df.columns]
-            extra_cols = [col for col in df.columns if col not in REQUIRED_TRANSACTION_COLUMNS] # Optional info
-            
-            if missing_cols:
+            result = transaction_import.validate_upload(file.stream, transaction_import.Lookups(get_db()), mode=mode)
+            response = {
+                "required_columns": transaction_import.missing_columns([], mode),
+                "found_columns": result["columns"],
+                "row_count": result["row_count"],
+                "sample_rows": result["sample_rows"],
+                "diagnostics": result["diagnostics"],
+            }
+
+            if not result["columns"]:
+                return jsonify({"validation_status": "error", "message": "Uploaded file is empty."}), 400
+            if result["missing_columns"]:
                 return jsonify({
+                    **response,
                     "validation_status": "error",
-                    "message": f"Missing required columns: {', '.join(missing_cols)}",
-                    "required_columns": REQUIRED_TRANSACTION_COLUMNS,
-                    "found_columns": list(df.columns)
+                    "message": f"Missing required columns: {', '.join(result['missing_columns'])}",
                 }), 400
-            else:
-                # Basic structure is valid
+
+            problems = [
+                f"{column} ({diagnostic['invalid']} invalid, e.g. {', '.join(repr(v) for v in diagnostic['examples'])})"
+                for column, diagnostic in result["diagnostics"].items() if diagnostic["invalid"]
+            ]
+            if problems:
                 return jsonify({
-                    "validation_status": "success",
-                    "message": f"File structure validated successfully. Found {len(df)} rows.",
-                    "required_columns": REQUIRED_TRANSACTION_COLUMNS,
-                    "found_columns": list(df.columns)
-                    # "extra_columns_found": extra_cols # Optional
-                }), 200
-                
+                    **response,
+                    "validation_status": "error",
+                    "message": f"Problems found in the first {result['sample_rows']} rows: {'; '.join(problems)}",
+                }), 400
+
+            # Basic structure is valid
+            return jsonify({
+                **response,
+                "validation_status": "success",
+                "message": f"File structure validated successfully. Found {result['row_count']} rows.",
+            }), 200
+
+        except UnicodeDecodeError:
+             return jsonify({"validation_status": "error", "message": "Uploaded file is not UTF-8 encoded. Re-export it as UTF-8 CSV."}), 400
         except pd.errors.EmptyDataError:
              return jsonify({"validation_status": "error", "message": "Uploaded file is empty."}), 400
         except pd.errors.ParserError:
@@ -907,7 +1023,14 @@ def validate_transaction_upload():
 
 @app.route('/api/v1/data/upload/process_transactions', methods=['POST'])
 def process_transaction_upload():
-    """Processes a validated transaction CSV: Clears old data and inserts new."""
+    """Queues a validated transaction CSV for import; returns 202 with the job.
+
+    mode (form field or query parameter): 'replace' (default) swaps all
+    transaction data for the file; 'upsert' only adds new and updates changed
+    rows, keyed on the transaction_key column, which it requires (see transaction_import).
+    The file is streamed to disk and imported by a background job (see
+    import_jobs); poll GET /api/v1/data/upload/jobs/<job_id> for progress.
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
     
@@ -915,153 +1038,84 @@ def process_transaction_upload():
     
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({"error": "Invalid or missing file"}), 400
-        
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        df = pd.read_csv(file.stream)
-        
-        # Re-validate columns just in case
-        missing_cols = [col for col in REQUIRED_TRANSACTION_COLUMNS if col not in df.columns]
-        if missing_cols:
-            return jsonify({"status": "error", "message": f"Processing failed: Missing required columns: {', '.join(missing_cols)}"}), 400
-
-        # --- Pre-fetch necessary data for mapping --- 
-        locations_map = {row['name']: row['location_id'] for row in cursor.execute("SELECT location_id, name FROM locations").fetchall()}
-        # Assuming item_identifier is SKU for product, Name for service
-        products_map = {row['sku']: {'id': row['product_id'], 'price': row['retail_price']} for row in cursor.execute("SELECT product_id, sku, retail_price FROM products WHERE sku IS NOT NULL").fetchall()}
-        services_map = {row['name']: {'id': row['service_id'], 'price': row['standard_price']} for row in cursor.execute("SELECT service_id, name, standard_price FROM services").fetchall()}
-        # Optional: Fetch customer/employee IDs if present in CSV for mapping
-        # customers_map = {str(row['customer_id']): row['customer_id'] for row in cursor.execute("SELECT customer_id FROM customers").fetchall()}
-        # employees_map = {str(row['employee_id']): row['employee_id'] for row in cursor.execute("SELECT employee_id FROM employees").fetchall()}
-
-        # --- Clear existing transaction data --- 
-        # ** CRITICAL & DESTRUCTIVE STEP **
-        print("Clearing existing transaction data...")
-        cursor.execute("DELETE FROM transaction_items")
-        cursor.execute("DELETE FROM transactions")
-        # Optionally clear bookings/customers if they are derived solely from transactions?
-        # For now, only clearing transaction data.
-        print("Existing transaction data cleared.")
-
-        # --- Process and Insert New Data --- 
-        inserted_transactions = 0
-        inserted_items = 0
-        errors = []
-
-        print(f"Processing {len(df)} rows from uploaded file...")
-        # Group by potential transaction (e.g., same time, location, customer?) - Difficult without a Transaction ID in source
-        # Assuming each row is a distinct line item belonging to a potentially new transaction for simplicity now.
-        # A more robust solution would require a transaction identifier in the CSV.
-        
-        # For now: Treat each row as a potential line item and create a transaction for it.
-        # This is NOT ideal but works as a basic import. 
-        for index, row in df.iterrows():
-            try:
-                # 1. Validate/Map required fields
-                loc_name = row['location_name']
-                loc_id = locations_map.get(loc_name)
-                if not loc_id:
-                    errors.append(f"Row {index+2}: Unknown location_name '{loc_name}'")
-                    continue
-                    
-                try:
-                    trans_time = pd.to_datetime(row['transaction_time']).to_pydatetime()
-                except Exception:
-                    errors.append(f"Row {index+2}: Invalid transaction_time format '{row['transaction_time']}'")
-                    continue
 
-                item_type = str(row['item_type']).lower()
-                item_id_str = str(row['item_identifier'])
-                product_id = None
-                service_id = None
-                unit_price_db = 0 # Get price from DB for consistency if needed
-                
-                if item_type == 'product':
-                    product_info = products_map.get(item_id_str)
-                    if not product_info:
-                        errors.append(f"Row {index+2}: Unknown product SKU '{item_id_str}'")
-                        continue
-                    product_id = product_info['id']
-                    unit_price_db = product_info['price']
-                elif item_type == 'service':
-                    service_info = services_map.get(item_id_str)
-                    if not service_info:
-                        # Try case-insensitive match as fallback?
-                         service_info = next((v for k, v in services_map.items() if k.lower() == item_id_str.lower()), None)
-                         if not service_info:
-                             errors.append(f"Row {index+2}: Unknown service name '{item_id_str}'")
-                             continue
-                    service_id = service_info['id']
-                    unit_price_db = service_info['price']
-                else:
-                    errors.append(f"Row {index+2}: Invalid item_type '{item_type}'")
-                    continue
-
-                try:
-                    quantity = int(row['quantity'])
-                    net_price = float(row['net_price'])
-                    # Optional: Validate net_price against unit_price * quantity?
-                except ValueError as ve:
-                     errors.append(f"Row {index+2}: Invalid quantity or net_price ({ve})")
-                     continue
-                     
-                # Optional: Map customer/employee IDs here if included
-                customer_id = None # Placeholder - Add logic if customer_id in CSV
-                employee_id = None # Placeholder - Add logic if employee_id in CSV
-
-                # 2. Create Transaction Header (Simplified: one per item)
-                # In reality, group items into transactions first.
-                # For this simple import, create transaction then item.
-                transaction_total = net_price # Since we treat each line as a transaction
-                cursor.execute(
-                    "INSERT INTO transactions (customer_id, employee_id, location_id, transaction_time, total_amount) VALUES (?, ?, ?, ?, ?)",
-                    (customer_id, employee_id, loc_id, trans_time, transaction_total)
-                )
-                transaction_id = cursor.lastrowid
-                inserted_transactions += 1
-                
-                # 3. Insert Transaction Item
-                cursor.execute(
-                    "INSERT INTO transaction_items (transaction_id, item_type, product_id, service_id, quantity, unit_price, net_price) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (transaction_id, item_type, product_id, service_id, quantity, round(unit_price_db, 2), round(net_price, 2)) # Corrected variable name
-                )
-                inserted_items += 1
-
-            except Exception as row_error:
-                errors.append(f"Row {index+2}: Unexpected error - {row_error}")
-                # Decide whether to continue or stop processing
-                # continue
-
-        # --- Finalize --- 
-        if errors:
-            # If there were errors, rollback changes and report
-            db.rollback()
-            print(f"Processing finished with {len(errors)} errors. Database rolled back.")
-            error_summary = "\n".join(errors[:20]) # Show first 20 errors
-            if len(errors) > 20:
-                 error_summary += f"\n... and {len(errors) - 20} more errors."
-            return jsonify({
-                "status": "error", 
-                "message": f"Processing failed due to {len(errors)} errors. Database changes rolled back.",
-                "errors": error_summary
-                }), 400
-        else:
-            # Commit changes if no errors
-            db.commit()
-            # Clear caches after successful upload
-            clear_sales_caches()
-            print(f"Processing successful. Inserted {inserted_transactions} transactions and {inserted_items} items.")
+    mode = request.values.get('mode', transaction_import.MODE_REPLACE)
+    if mode not in transaction_import.IMPORT_MODES:
+        return jsonify({"error": f"Invalid mode '{mode}'. Must be one of: {', '.join(transaction_import.IMPORT_MODES)}"}), 400
+    if mode == transaction_import.MODE_UPSERT:
+        try:
+            header = transaction_import.read_header(file.stream)
+        except UnicodeDecodeError:
+            return jsonify({"error": "Uploaded file is not UTF-8 encoded. Re-export it as UTF-8 CSV."}), 400
+        file.stream.seek(0)
+        if transaction_import.KEY_COLUMN not in header:
             return jsonify({
-                "status": "success", 
-                "message": f"Successfully processed file. Inserted {inserted_transactions} transactions and {inserted_items} items."
-                }), 200
+                "error": f"Upsert imports need a '{transaction_import.KEY_COLUMN}' column to match rows to stored "
+                         f"transactions. Add it, or import with mode '{transaction_import.MODE_REPLACE}'."
+            }), 400
 
+    db = get_db()
+    try:
+        job_id = import_jobs.runner.submit(db, file, secure_filename(file.filename), mode)
     except Exception as e:
-        db.rollback() # Rollback on any unexpected error during processing
-        print(f"Error processing uploaded file: {e}")
-        return jsonify({"status": "error", "message": f"An unexpected error occurred during processing: {e}"}), 500
+        db.rollback()
+        print(f"Error queueing uploaded file: {e}")
+        return jsonify({"status": "error", "message": f"Could not queue the file for processing: {e}"}), 500
+
+    print(f"Queued transaction import job {job_id} ({mode}) for {file.filename}")
+    return jsonify({
+        "status": import_jobs.STATUS_QUEUED,
+        "job_id": job_id,
+        "status_url": f"/api/v1/data/upload/jobs/{job_id}",
+        "message": "File uploaded. Processing in the background."
+        }), 202
+
+@app.route('/api/v1/data/upload/jobs/<int:job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Returns the status, progress and first row errors of a transaction import job."""
+    job = import_jobs.get_job(get_db(), job_id)
+    if job is None:
+        return jsonify({"error": f"Import job {job_id} not found."}), 404
+    return jsonify(job)
+
+def _rebuild_order_rollups(db):
+    """Rebuilds the order rollups of every synced location with the current categories and costs. Does not commit."""
+    unit_cost = _kpi_unit_cost_lookup(db)
+    synced = db.execute('SELECT location_id FROM order_sync_state').fetchall()
+    return {row[0]: sales_rollup.rebuild_orders(db, row[0], _category_for, unit_cost) for row in synced}
+
+def _recost_rollups_if_stale(db):
+    """Rebuilds the cost index if its inputs changed, then re-costs every rollup built from it.
+
+    Does not commit; returns True if anything was rebuilt. Runs where the
+    inputs change (imports, rebuild-cost-index, startup), never in a GET.
+    """
+    if not cost_index.ensure_current(db, INVENTORY_CSV_PATH, load_inventory_costs):
+        return False
+    sales_rollup.refresh_transactions(db)
+    _rebuild_order_rollups(db)
+    return True
+
+def _refresh_transaction_rollup(db, days=None):
+    """Import hook: rebuilds the transaction rollups (all days, or just `days`) inside the import transaction.
+
+    Returns True if the costs had changed and every rollup was re-costed.
+    """
+    if _recost_rollups_if_stale(db):
+        return True
+    if days is None:
+        sales_rollup.refresh_transactions(db)
+    else:
+        sales_rollup.refresh_transaction_days(db, days)
+    return False
+
+def _after_transaction_import(days, locations, recosted):
+    """Import hook: evicts the cached responses the committed import affected."""
+    if recosted:
+        invalidate_sales_caches(sales_rollup.SOURCE_ORDERS)
+        invalidate_sales_caches(sales_rollup.SOURCE_TRANSACTIONS)
+    else:
+        invalidate_sales_caches(sales_rollup.SOURCE_TRANSACTIONS, locations, days)
 
 # --- Helper function to get item name mapping ---
 def _get_item_name_map(db):
@@ -1162,6 +1216,11 @@ def auth_status():
 def get_category_mappings():
     """Returns the defined mapping from Boulevard service/product names to categories."""
     return jsonify(BOULEVARD_CATEGORY_MAPPING)
+
+@app.route('/api/v1/category-mappings/coverage', methods=['GET'])
+def get_category_coverage():
+    """Returns which mapping entries and keyword rules this worker's lookups hit, and the names that matched none."""
+    return jsonify(boulevard_categorizer.coverage())
 # --- END NEW Endpoint ---
 
 # --- NEW: Profit Calculation Endpoint ---
@@ -1170,14 +1229,12 @@ def get_profit_by_category():
     """
     Calculates total profit (revenue - cost) for each item category based on DB data.
     
-    *** LIMITATION ***: This endpoint currently calculates profit using placeholder costs 
-    defined in the MOCK_PRODUCTS and MOCK_SERVICES lists within this file. 
-    It uses the integer IDs stored in the database transaction_items table for lookup.
-    It does NOT use the real-time API-fetched product costs or the URN-based service 
-    cost mapping used by the /api/v1/kpis endpoint. This is due to the complexity 
-    of mapping database integer IDs back to Boulevard URNs needed for those more 
-    accurate cost sources without schema changes. 
-    The profit figures here are therefore estimates based on potentially outdated mock data.
+    Reads the 'transactions' daily sales rollup (see sales_rollup), which is
+    rebuilt whenever a transaction file is processed and re-costed whenever
+    the inventory costs change (imports, rebuild-cost-index, startup); this
+    endpoint only reads. Item costs come from the cost index (see cost_index.py: inventory_costs / inventory CSV matched by
+    exact, normalized, then fuzzy name); items without a match are treated as
+    zero cost, so the profit figures here are estimates.
     """
     db = get_db()
     location_id_str = request.args.get('location_id', default='all', type=str)
@@ -1185,112 +1242,43 @@ def get_profit_by_category():
     end_date_str = request.args.get('end_date', default=None, type=str)
 
     # --- Build Filters ---
-    params = []
-    where_clauses = ["1=1"] # Start with a clause that's always true
+    location_keys = None
 
     # Location Filter
     if location_id_str != 'all':
         # Assuming location_id_str is the integer ID from the locations table for DB filtering
         try:
-             loc_id_int = int(location_id_str)
-             where_clauses.append("t.location_id = ?")
-             params.append(loc_id_int)
+             location_keys = [int(location_id_str)]
         except ValueError:
              print(f"Warning: Invalid location_id received in get_profit_by_category: {location_id_str}")
              # Optionally return an error or just proceed without location filter
              # return jsonify({"error": "Invalid location ID format."}), 400
              pass 
 
-    # Date Filters (Using SQLite date functions)
+    # Date Filters
     if start_date_str:
         try:
             datetime.strptime(start_date_str, '%Y-%m-%d') # Validate format
-            where_clauses.append("DATE(t.transaction_time) >= ?")
-            params.append(start_date_str)
         except ValueError:
              print(f"Warning: Invalid start_date format in get_profit_by_category: {start_date_str}")
-             pass # Ignore invalid date
+             start_date_str = None # Ignore invalid date
              
     if end_date_str:
         try:
             datetime.strptime(end_date_str, '%Y-%m-%d') # Validate format
-            where_clauses.append("DATE(t.transaction_time) <= ?")
-            params.append(end_date_str)
         except ValueError:
              print(f"Warning: Invalid end_date format in get_profit_by_category: {end_date_str}")
-             pass # Ignore invalid date
-
-    where_sql = " AND ".join(where_clauses)
-
-    # --- Query Transaction Items and Join with Categories ---
-    query = f"""
-        SELECT 
-            ti.item_type,
-            ti.product_id,
-            ti.service_id,
-            ti.quantity,
-            ti.net_price,
-            tc.name as category_name,
-            tc.category_id -- Added category_id for grouping consistency
-        FROM transaction_items ti
-        JOIN transactions t ON ti.transaction_id = t.transaction_id
-        -- Join based on item type to get category
-        LEFT JOIN services s ON ti.service_id = s.service_id AND ti.item_type = 'service'
-        LEFT JOIN products p ON ti.product_id = p.product_id AND ti.item_type = 'product'
-        LEFT JOIN treatment_categories tc ON tc.category_id = COALESCE(s.category_id, p.category_id)
-        WHERE ({where_sql}) AND tc.category_id IS NOT NULL -- Only include items with a category
-    """
+             end_date_str = None # Ignore invalid date
 
     try:
-        cursor = db.execute(query, params)
-        items = cursor.fetchall()
-        
-        # --- Calculate Profit per Category using Real Inventory Costs (with fuzzy matching) ---
-        profit_by_category = defaultdict(float)
-        
-        # Pre-fetch product and service names for ID lookup
-        product_names = {row['product_id']: row['name'] for row in db.execute('SELECT product_id, name FROM products').fetchall()}
-        service_names = {row['service_id']: row['name'] for row in db.execute('SELECT service_id, name FROM services').fetchall()}
-        inventory_names = list(inventory_cost_map.keys())
-        
-        for item in items:
-            item_cost = 0.0
-            quantity = item['quantity'] if item['quantity'] else 0 # Handle null quantity? Default to 0
-            net_price = item['net_price'] if item['net_price'] else 0.0
-            category_name = item['category_name']
-            
-            def get_cost_by_name(name):
-                if not name:
-                    return 0.0
-                if name in inventory_cost_map:
-                    return inventory_cost_map[name]['avg_unit_cost']
-                # Fuzzy match if exact not found
-                close = difflib.get_close_matches(name, inventory_names, n=1, cutoff=0.8)
-                if close:
-                    print(f"[ProfitCalc] Fuzzy matched '{name}' to inventory '{close[0]}'")
-                    return inventory_cost_map[close[0]]['avg_unit_cost']
-                print(f"[ProfitCalc] No inventory cost found for '{name}' (even with fuzzy match)")
-                return 0.0
-            
-            if item['item_type'] == 'product' and item['product_id']:
-                prod_name = product_names.get(item['product_id'])
-                item_cost = get_cost_by_name(prod_name)
-            elif item['item_type'] == 'service' and item['service_id']:
-                serv_name = service_names.get(item['service_id'])
-                item_cost = get_cost_by_name(serv_name)
-                
-            item_profit = net_price - (quantity * item_cost)
-            profit_by_category[category_name] += item_profit
-
-        # --- Format Output ---
-        # Get all category names to ensure all are represented, even with 0 profit
-        all_categories_cursor = db.execute('SELECT name FROM treatment_categories ORDER BY name')
-        all_category_names = {row['name'] for row in all_categories_cursor.fetchall()}
-
-        # Build final result including categories with zero profit
+        # --- Profit per Category: one grouped query over the daily rollup ---
+        # (every category is returned, with 0 profit when it had no sales)
+        totals = sales_rollup.category_profit(
+            db, sales_rollup.SOURCE_TRANSACTIONS, location_keys, start_date_str, end_date_str
+        )
         result_data = [
-            {'name': cat_name, 'profit': round(profit_by_category.get(cat_name, 0.0), 2)}
-            for cat_name in sorted(list(all_category_names))
+            {'name': category, 'profit': round(sales - cost, 2)}
+            for category, sales, cost in totals
         ]
         
         return jsonify(result_data)
@@ -1332,6 +1320,104 @@ def test_boulevard_command():
 
 app.cli.add_command(test_boulevard_command)
 
+@click.command('sync-orders')
+@click.option('--location', 'location_ids', multiple=True, help='Boulevard location ID to sync (repeatable). Defaults to all locations.')
+@click.option('--full', is_flag=True, help='Ignore the stored high-water mark and re-pull the initial window.')
+@click.option('--days', default=order_store.ORDER_SYNC_INITIAL_DAYS, show_default=True, help='History to pull on a first or full sync.')
+@with_appcontext
+def sync_orders_command(location_ids, full, days):
+    """Incrementally sync Boulevard orders into the local order store."""
+    location_ids = list(location_ids) or location_registry.get_location_ids()
+    if not location_ids:
+        click.echo("No locations to sync (could not load Boulevard locations).")
+        return
+    db = get_db()
+    for loc_id in location_ids:
+        changed_days = set()
+
+        def on_orders_changed(db, location_id, first_day, last_day):
+            _refresh_order_rollup(db, location_id, first_day, last_day)
+            changed_days.update(pd.date_range(first_day, last_day).strftime('%Y-%m-%d'))
+
+        try:
+            stored = order_store.sync_location(
+                db, loc_id, full=full, initial_days=days, on_orders_changed=on_orders_changed
+            )
+            click.echo(f"{loc_id}: stored {stored} orders (high-water mark {order_store.get_high_water_mark(db, loc_id)})")
+        except Exception as e:
+            db.rollback()
+            click.echo(f"{loc_id}: sync failed - {e}")
+        finally:
+            # Pages are committed as they arrive, so evict what changed even if a later page failed
+            if changed_days:
+                invalidate_sales_caches(sales_rollup.SOURCE_ORDERS, [loc_id], changed_days)
+
+app.cli.add_command(sync_orders_command)
+
+@click.command('rebuild-sales-rollup')
+@with_appcontext
+def rebuild_sales_rollup_command():
+    """Rebuild the daily sales rollups from the order store and uploaded transactions."""
+    db = get_db()
+    cost_index.ensure_current(db, INVENTORY_CSV_PATH, load_inventory_costs) # Order rollups are costed through the index
+    for location_id, count in _rebuild_order_rollups(db).items():
+        click.echo(f"{location_id}: {count} order rollup rows")
+    count = sales_rollup.refresh_transactions(db)
+    click.echo(f"Uploaded transactions: {count} rollup rows")
+    db.commit()
+    invalidate_sales_caches(sales_rollup.SOURCE_ORDERS)
+    invalidate_sales_caches(sales_rollup.SOURCE_TRANSACTIONS)
+
+app.cli.add_command(rebuild_sales_rollup_command)
+
+@click.command('rebuild-cost-index')
+@with_appcontext
+def rebuild_cost_index_command():
+    """Re-resolve product/service unit costs from inventory_costs and the inventory CSV."""
+    db = get_db()
+    cost_index.rebuild(db, INVENTORY_CSV_PATH, load_inventory_costs)
+    sales_rollup.refresh_transactions(db)
+    _rebuild_order_rollups(db)
+    db.commit()
+    invalidate_sales_caches(sales_rollup.SOURCE_ORDERS)
+    invalidate_sales_caches(sales_rollup.SOURCE_TRANSACTIONS)
+    for match_type, count in sorted(cost_index.match_summary(db).items()):
+        click.echo(f"{match_type}: {count} items")
+
+app.cli.add_command(rebuild_cost_index_command)
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a date-range sales query would fully scan transactions or the rollups."""
+    problems = sales_rollup.full_scans(get_db())
+    if not problems:
+        click.echo(f"OK: {', '.join(sales_rollup.INDEXED_TABLES)} are read through indexes")
+        return
+    for name, plan in problems.items():
+        click.echo(f"{name} does a full scan:")
+        for line in plan:
+            click.echo(f"    {line}")
+    raise SystemExit(1)
+
+app.cli.add_command(check_query_plans_command)
+
+@click.command('check-category-coverage')
+@with_appcontext
+def check_category_coverage_command():
+    """Categorize every stored product/service name and list the ones no mapping entry or keyword matches."""
+    db = get_db()
+    names = [row['name'] for row in db.execute('SELECT name FROM products UNION SELECT name FROM services')]
+    for name in names:
+        _category_for(name)
+    coverage = boulevard_categorizer.coverage()
+    for match_type, count in coverage['by_match'].items():
+        click.echo(f"{match_type}: {count} names")
+    for entry in coverage['unmatched']:
+        click.echo(f"    unmatched: {entry['name']}")
+
+app.cli.add_command(check_category_coverage_command)
+
 # --- END NEW Endpoint ---
 
 # --- NEW: Categorized Boulevard Orders Endpoint ---
@@ -1355,11 +1441,7 @@ def get_categorized_orders():
         # --- Step 1: Get Location IDs to query ---
         target_location_ids = []
         if requested_location_id == 'all':
-            locations_response = boulevard_client.get_boulevard_locations()
-            if locations_response and 'data' in locations_response and 'locations' in locations_response['data']:
-                for edge in locations_response['data']['locations'].get('edges', []):
-                    if edge and 'node' in edge and 'id' in edge['node']:
-                        target_location_ids.append(edge['node']['id'])
+            target_location_ids = location_registry.get_location_ids()
             if not target_location_ids:
                  print("Warning: Could not fetch location IDs for categorized orders query.")
                  return jsonify({"error": "Could not fetch location IDs for aggregation."}), 500
@@ -1368,17 +1450,19 @@ def get_categorized_orders():
 
         # --- Step 2: Fetch Historical Orders for each location ---
         all_fetched_orders = []
-        for loc_id in target_location_ids:
-            orders_for_location = boulevard_client.get_historical_orders(location_id=loc_id, days_history=days_history)
+        orders_by_location = boulevard_client.fetch_for_locations(
+            boulevard_client.get_historical_orders,
+            target_location_ids,
+            days_history=days_history
+        )
+        for orders_for_location in orders_by_location.values():
             if orders_for_location:
                 all_fetched_orders.extend(orders_for_location)
 
         if not all_fetched_orders:
             return jsonify({"message": "No orders found for the specified scope and timeframe.", "orders": []}), 200
             
-        # --- Step 3: Get Category Mapping (using the global dictionary) ---
-        category_map = BOULEVARD_CATEGORY_MAPPING
-        default_category = category_map.get("DEFAULT_CATEGORY", "Uncategorized")
+        # --- Step 3: Categories come from the compiled categorizer (see _category_for) ---
         
         # --- Step 4: Process Orders - Add Category to Line Items --- 
         # It's safer to create a new list rather than modifying the original dicts in place
@@ -1389,6 +1473,8 @@ def get_categorized_orders():
             
             # Ensure lineGroups exists and is iterable
             if 'lineGroups' in processed_order and isinstance(processed_order['lineGroups'], list):
+                # Copy line groups too: the fetched orders are memoized and shared between requests
+                processed_order['lineGroups'] = [group.copy() for group in processed_order['lineGroups']]
                 # Iterate through line groups (can be multiple, e.g., different staff)
                 for line_group in processed_order['lineGroups']:
                     # Ensure lines exists and is iterable
@@ -1396,11 +1482,7 @@ def get_categorized_orders():
                         processed_lines = []
                         for line in line_group['lines']:
                              processed_line = line.copy()
-                             item_name = processed_line.get('name')
-                             category = default_category # Default if no name or not found
-                             if item_name:
-                                 category = category_map.get(item_name, default_category)
-                             processed_line['category'] = category
+                             processed_line['category'] = _category_for(processed_line.get('name'))
                              processed_lines.append(processed_line)
                         # Replace original lines with processed lines
                         line_group['lines'] = processed_lines
@@ -1461,35 +1543,55 @@ def load_inventory_costs(csv_path='inventory_on_hand_20250426.csv'):
         print(f"Error loading inventory CSV: {e}")
     return inventory_map
 
-# Load inventory data at startup (can be reloaded as needed)
-inventory_cost_map = load_inventory_costs('inventory_on_hand_20250426.csv')
+# Inventory export the cost index is built from (see cost_index.py)
+INVENTORY_CSV_PATH = os.getenv('INVENTORY_CSV_PATH', 'inventory_on_hand_20250426.csv')
+
+def _default_kpi_end_date(params):
+    return datetime.now().strftime('%Y-%m-%d')
+
+def _default_kpi_start_date(params):
+    return (datetime.strptime(params['end_date'], '%Y-%m-%d') - timedelta(days=30)).strftime('%Y-%m-%d')
+
+# Cache keys are canonical (sorted params, defaults filled in, YYYY-MM-DD dates) and equal in every worker
+_kpi_cache_key = cache_keys.for_request(
+    defaults={'end_date': _default_kpi_end_date, 'start_date': _default_kpi_start_date},
+    dates=('start_date', 'end_date')
+)
+_sales_summary_cache_key = cache_keys.for_request(defaults={'location_id': 'all'}, dates=('start_date', 'end_date'))
+
+def _kpi_cache_tags():
+    params = _kpi_cache_key.params()
+    return cache_tags.scope_tags(
+        sales_rollup.SOURCE_ORDERS, location_registry.get_location_ids(), params.get('start_date'), params.get('end_date')
+    )
 
-def _make_cache_key(*args, **kwargs):
-    """Generate a cache key that includes query parameters."""
-    key = request.path
-    args = str(hash(frozenset(request.args.items())))
-    return f"{key}|{args}"
+def _sales_summary_cache_tags():
+    params = _sales_summary_cache_key.params()
+    location_id = params.get('location_id', 'all')
+    location_ids = location_registry.get_location_ids() if location_id == 'all' else [location_id]
+    return cache_tags.scope_tags(sales_rollup.SOURCE_ORDERS, location_ids, params.get('start_date'), params.get('end_date'))
 
 @app.route('/api/v1/kpis', methods=['GET'])
-@cache.cached(timeout=300, key_prefix=_make_cache_key)  # Cache for 5 minutes
+@tagged_cache.cached(_kpi_cache_key, tags=_kpi_cache_tags, timeout=300)  # Cache for 5 minutes
 def get_kpis():
     """Retrieves KPI data including profitability metrics from Boulevard API."""
     try:
-        # Get date range from request
-        end_date = request.args.get('end_date')
-        start_date = request.args.get('start_date')
+        # Get date range from request (canonicalized the same way as the cache key)
+        end_date = cache_keys.canonical_date(request.args.get('end_date'))
+        start_date = cache_keys.canonical_date(request.args.get('start_date'))
         
         if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
+            end_date = _default_kpi_end_date({})
         if not start_date:
-            start_date = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=30)).strftime('%Y-%m-%d')
+            start_date = _default_kpi_start_date({'end_date': end_date})
 
-        print(f"[KPI] Fetching orders for date range: {start_date} to {end_date}")
-        # --- Step 1: Get Orders from Boulevard ---
-        all_orders = get_orders_for_date_range(start_date, end_date)
-        print(f"[KPI] Found {len(all_orders) if all_orders else 0} orders")
+        print(f"[KPI] Aggregating orders for date range: {start_date} to {end_date}")
+        # --- Step 1: Aggregate Orders (local order store, live fetch for unsynced locations) ---
+        target_location_ids = location_registry.get_location_ids()
+        agg = _get_order_aggregate(target_location_ids, start_date, end_date) if target_location_ids else None
+        print(f"[KPI] Found {agg['order_count'] if agg else 0} orders")
         
-        if not all_orders:
+        if not agg or not agg['order_count']:
             print("[KPI] No orders found, returning empty data")
             return jsonify({
                 "total_sales": 0,
@@ -1501,9 +1603,8 @@ def get_kpis():
             })
 
         # --- Step 2: Calculate KPIs ---
-        db = get_db()
         print("[KPI] Starting KPI calculation...")
-        kpi_data = calculate_kpis(all_orders, db)
+        kpi_data = kpis_from_aggregate(agg)
         
         if not kpi_data:
             print("[KPI] Failed to calculate KPI data")
@@ -1532,195 +1633,33 @@ def get_kpis():
         traceback.print_exc()
         return jsonify({"error": f"Failed to generate KPI data: {str(e)}"}), 500
 
-def get_orders_for_date_range(start_date, end_date):
-    """Fetches orders from Boulevard API for the specified date range."""
-    try:
-        print(f"[Orders] Getting orders for date range: {start_date} to {end_date}")
-        # Get all location IDs first
-        locations_response = boulevard_client.get_boulevard_locations()
-        if not locations_response or 'data' not in locations_response or 'locations' not in locations_response['data']:
-            print("[Orders] Could not fetch location IDs")
-            print(f"[Orders] Response: {locations_response}")
-            return []
-
-        target_location_ids = []
-        for edge in locations_response['data']['locations'].get('edges', []):
-            if edge and 'node' in edge and 'id' in edge['node']:
-                target_location_ids.append(edge['node']['id'])
-
-        if not target_location_ids:
-            print("[Orders] No location IDs found")
-            return []
-
-        print(f"[Orders] Found {len(target_location_ids)} locations")
-
-        # Fetch orders for each location
-        all_orders = []
-        for loc_id in target_location_ids:
-            try:
-                # Convert date strings to datetime objects if they're strings
-                if isinstance(start_date, str):
-                    start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-                else:
-                    start_dt = start_date
-                
-                if isinstance(end_date, str):
-                    end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-                else:
-                    end_dt = end_date
-
-                # Format dates for Boulevard API
-                query_string = f"closedAt >= '{start_dt.strftime('%Y-%m-%d')}T00:00:00Z'"
-                if end_dt:
-                    query_string += f" AND closedAt <= '{end_dt.strftime('%Y-%m-%d')}T23:59:59Z'"
-
-                print(f"[Orders] Fetching orders for location {loc_id} with query: {query_string}")
-                location_orders = boulevard_client.get_boulevard_kpi_data(
-                    location_id=loc_id,
-                    query_string=query_string
-                )
-                
-                if location_orders:
-                    print(f"[Orders] Found {len(location_orders)} orders for location {loc_id}")
-                    all_orders.extend(location_orders)
-                else:
-                    print(f"[Orders] No orders found for location {loc_id}")
-
-            except Exception as loc_error:
-                print(f"[Orders] Error fetching orders for location {loc_id}: {loc_error}")
-                continue
-
-        # Sort orders by date
-        if all_orders:
-            all_orders.sort(key=lambda x: x.get('closedAt', ''))
-            print(f"[Orders] Total orders found across all locations: {len(all_orders)}")
-            if all_orders:
-                print(f"[Orders] Date range of orders: {all_orders[0].get('closedAt')} to {all_orders[-1].get('closedAt')}")
-        else:
-            print("[Orders] No orders found across all locations")
-
-        return all_orders
-
-    except Exception as e:
-        print(f"[Orders] Error fetching orders: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
-
 @app.route('/api/v1/sales/summary', methods=['GET'])
-@cache.cached(timeout=300, key_prefix=_make_cache_key)  # Cache for 5 minutes
+@tagged_cache.cached(_sales_summary_cache_key, tags=_sales_summary_cache_tags, timeout=300)  # Cache for 5 minutes
 def get_sales_summary():
     """Retrieves aggregated sales summary data from Boulevard API."""
     try:
         # Get query parameters
-        location_id = request.args.get('location_id', default='all', type=str)
-        start_date_str = request.args.get('start_date', default=None, type=str)
-        end_date_str = request.args.get('end_date', default=None, type=str)
+        location_id = request.args.get('location_id', default='all', type=str).strip() or 'all'
+        start_date_str = cache_keys.canonical_date(request.args.get('start_date', default=None, type=str))
+        end_date_str = cache_keys.canonical_date(request.args.get('end_date', default=None, type=str))
 
         # --- Step 1: Get Location IDs to query ---
         target_location_ids = []
         if location_id == 'all':
-            locations_response = boulevard_client.get_boulevard_locations()
-            if locations_response and 'data' in locations_response and 'locations' in locations_response['data']:
-                for edge in locations_response['data']['locations'].get('edges', []):
-                    if edge and 'node' in edge and 'id' in edge['node']:
-                        target_location_ids.append(edge['node']['id'])
+            target_location_ids = location_registry.get_location_ids()
             if not target_location_ids:
                 print("Warning: Could not fetch location IDs for sales summary.")
                 return jsonify({"error": "Could not fetch location IDs."}), 500
         else:
             target_location_ids.append(location_id)
 
-        # --- Step 2: Fetch Sales Data for Each Location ---
-        summary_data = {
-            'total_sales': 0.0,
-            'total_transactions': 0,
-            'avg_transaction_value': 0.0,
-            'sales_by_type': {
-                'services': 0.0,
-                'products': 0.0,
-                'other': 0.0
-            },
-            'sales_by_location': {},
-            'top_items': []
+        # --- Step 2: Project the shared single-pass aggregate ---
+        agg = _get_order_aggregate(target_location_ids, start_date_str, end_date_str)
+        location_labels = {
+            loc_id: (location_registry.get_by_id(loc_id) or {}).get('name') or f"Location {loc_id}"
+            for loc_id in target_location_ids
         }
-
-        item_sales = {}  # Track sales by item for top items calculation
-
-        for loc_id in target_location_ids:
-            # Use the Boulevard client to get sales data
-            location_orders = boulevard_client.get_boulevard_kpi_data(
-                location_id=loc_id,
-                query_string=f"closedAt>={start_date_str}" if start_date_str else None
-            )
-            
-            if not location_orders:
-                continue
-
-            location_total = 0.0
-            
-            for order in location_orders:
-                if 'summary' in order and 'currentSubtotal' in order['summary']:
-                    subtotal_cents = order['summary']['currentSubtotal']
-                    if isinstance(subtotal_cents, (int, float)):
-                        sale_amount = subtotal_cents / 100.0
-                        summary_data['total_sales'] += sale_amount
-                        location_total += sale_amount
-                        summary_data['total_transactions'] += 1
-
-                # Process line items for type breakdown and top items
-                if 'lineGroups' in order:
-                    for group in order['lineGroups']:
-                        if 'lines' in group:
-                            for line in group['lines']:
-                                item_type = 'services' if line.get('__typename') == 'OrderServiceLine' else 'products'
-                                subtotal_cents = line.get('currentSubtotal', 0)
-                                line_amount = subtotal_cents / 100.0 if subtotal_cents else 0
-
-                                # Add to type totals
-                                summary_data['sales_by_type'][item_type] += line_amount
-
-                                # Track individual item sales
-                                item_name = line.get('name', 'Unknown Item')
-                                if item_name not in item_sales:
-                                    item_sales[item_name] = {
-                                        'name': item_name,
-                                        'type': item_type.rstrip('s'),  # Remove 's' for singular
-                                        'total_sales': 0.0,
-                                        'quantity': 0
-                                    }
-                                item_sales[item_name]['total_sales'] += line_amount
-                                item_sales[item_name]['quantity'] += line.get('quantity', 0)
-
-            # Add location total to summary
-            if location_total > 0:
-                location_name = "All Locations" if location_id == 'all' else f"Location {loc_id}"
-                summary_data['sales_by_location'][location_name] = round(location_total, 2)
-
-        # Calculate average transaction value
-        if summary_data['total_transactions'] > 0:
-            summary_data['avg_transaction_value'] = round(
-                summary_data['total_sales'] / summary_data['total_transactions'], 
-                2
-            )
-
-        # Get top 10 items by sales
-        top_items = sorted(
-            item_sales.values(), 
-            key=lambda x: x['total_sales'], 
-            reverse=True
-        )[:10]
-        
-        # Round values in top items
-        for item in top_items:
-            item['total_sales'] = round(item['total_sales'], 2)
-        
-        summary_data['top_items'] = top_items
-
-        # Round all monetary values
-        summary_data['total_sales'] = round(summary_data['total_sales'], 2)
-        for key in summary_data['sales_by_type']:
-            summary_data['sales_by_type'][key] = round(summary_data['sales_by_type'][key], 2)
+        summary_data = order_aggregation.project_summary(agg, location_labels)
 
         return jsonify(summary_data)
 
@@ -1736,29 +1675,61 @@ def clear_cache():
     try:
         # Clear all caches
         cache.clear()
+        memoize.clear_all() # Boulevard client results memoized in this worker
         return jsonify({"message": "Cache cleared successfully"}), 200
     except Exception as e:
         return jsonify({"error": f"Failed to clear cache: {str(e)}"}), 500
 
-def clear_sales_caches():
-    """Clear all sales-related caches."""
+@app.route('/api/v1/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Returns hit/miss/eviction stats for the memoized Boulevard client calls in this worker (and the shared cache)."""
+    stats = memoize.memoize_stats()
+    if hasattr(cache.cache, 'stats'):
+        stats['shared_cache'] = cache.cache.stats()
+    return jsonify(stats)
+
+def invalidate_sales_caches(source, location_ids=None, days=None):
+    """Evicts the cached responses built from `source` data of these locations and 'YYYY-MM-DD' days (None = all)."""
     try:
-        # Get all cache keys
         with app.app_context():
-            # Clear specific patterns
-            patterns = [
-                'view//api/v1/kpis',
-                'view//api/v1/sales/summary',
-                'view//api/v1/sales/over_time',
-                'view//api/v1/sales/by_category'
-            ]
-            for pattern in patterns:
-                keys = cache.cache._cache.keys()  # Access underlying cache storage
-                for key in keys:
-                    if isinstance(key, str) and key.startswith(pattern):
-                        cache.delete(key)
+            tagged_cache.invalidate(cache_tags.data_tags(source, location_ids, days))
+            if source == sales_rollup.SOURCE_ORDERS:
+                _memoized_order_aggregate.cache_clear() # Frees this process's stale entries early
     except Exception as e:
-        print(f"Error clearing sales caches: {e}")
+        print(f"Error invalidating sales caches: {e}")
+
+@app.route('/api/v1/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Invalidates cached responses by endpoint and/or data scope.
+
+    JSON body: {"endpoint": "/api/v1/kpis"} and/or {"source": "orders",
+    "location_ids": [...], "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}
+    (omitted locations or dates mean all of them).
+    """
+    body = request.get_json(silent=True) or {}
+    tags = set()
+    if body.get('endpoint'):
+        tags.add(cache_tags.endpoint_tag(body['endpoint']))
+    if body.get('source'):
+        if body['source'] not in (sales_rollup.SOURCE_ORDERS, sales_rollup.SOURCE_TRANSACTIONS):
+            return jsonify({"error": f"Invalid source. Must be one of: {sales_rollup.SOURCE_ORDERS}, {sales_rollup.SOURCE_TRANSACTIONS}"}), 400
+        days = None
+        if body.get('start_date') or body.get('end_date'):
+            try:
+                start = cache_keys.canonical_date(body.get('start_date')) or cache_keys.canonical_date(body.get('end_date'))
+                end = cache_keys.canonical_date(body.get('end_date')) or datetime.now().strftime('%Y-%m-%d')
+                days = set(pd.date_range(start, end).strftime('%Y-%m-%d'))
+            except ValueError:
+                return jsonify({"error": "Invalid start_date or end_date. Use YYYY-MM-DD."}), 400
+        location_ids = body.get('location_ids')
+        if isinstance(location_ids, (str, int)):
+            location_ids = [location_ids]
+        tags |= cache_tags.data_tags(body['source'], location_ids, days)
+        if body['source'] == sales_rollup.SOURCE_ORDERS:
+            _memoized_order_aggregate.cache_clear()
+    if not tags:
+        return jsonify({"error": "Provide an endpoint and/or a source to invalidate."}), 400
+    return jsonify({"tags_invalidated": tagged_cache.invalidate(tags)}), 200
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -1815,238 +1786,43 @@ def test_boulevard_connection():
         print(f"Connection error: {result}")
         return jsonify(result), 500
 
-def calculate_kpis(orders, db):
-    """Calculate KPIs from Boulevard orders data."""
-    try:
-        if not orders:
-            return {
-                "total_sales": 0.0,
-                "total_transactions": 0,
-                "avg_transaction_value": 0.0,
-                "total_profit": 0.0,
-                "profit_margin": 0.0,
-                "trends": [],
-                "discounts": [],
-                "items": []
-            }
-
-        # Initialize KPI tracking
-        total_sales = 0.0
-        total_profit = 0.0
-        daily_metrics = defaultdict(lambda: {"sales": 0.0, "profit": 0.0, "transactions": 0})
-        discount_tracking = defaultdict(lambda: {
-            "name": "",
-            "type": "",
-            "total_amount": 0.0,
-            "usage_count": 0,
-            "profit_impact": 0.0,
-            "average_discount": 0.0
-        })
+def kpis_from_aggregate(agg):
+    """Builds the KPI payload from an order aggregate (see order_aggregation.aggregate_orders)."""
+    timeline = agg["timeline"]
 
-        # Track items for profitability analysis
-        items_tracking = defaultdict(lambda: {
-            "name": "",
-            "type": "",
-            "quantity": 0,
-            "total_sales": 0.0,
-            "total_cost": 0.0,
-            "total_profit": 0.0,
-            "profit_margin": 0.0
+    # Daily trends between the first and last sale, gaps zero-filled
+    labels, sums = time_buckets.resample(
+        timeline["epoch"],
+        {"sales": timeline["sales"], "profit": timeline["profit"], "transactions": timeline["transactions"]},
+        'day'
+    )
+    trends = []
+    for day, daily_sales, daily_profit, transactions in zip(
+        labels, sums["sales"].tolist(), sums["profit"].tolist(), sums["transactions"].tolist()
+    ):
+        daily_margin = (daily_profit / daily_sales * 100) if daily_sales > 0 else 0
+        trends.append({
+            "date": day,
+            "sales": round(daily_sales, 2),
+            "profit": round(daily_profit, 2),
+            "profit_margin": round(daily_margin, 2),
+            "transactions": int(transactions)
         })
 
-        # Get inventory cost map from database
-        inventory_cost_map = {}
-        try:
-            cursor = db.cursor()
-            cursor.execute('SELECT name, avg_unit_cost FROM inventory_costs')
-            for row in cursor.fetchall():
-                inventory_cost_map[row[0]] = {
-                    'avg_unit_cost': float(row[1]) if row[1] else 0.0
-                }
-        except Exception as db_error:
-            print(f"Warning: Could not fetch inventory costs: {db_error}")
-
-        # Process each order
-        for order in orders:
-            try:
-                # Get order date for trends
-                if not order.get('closedAt'):
-                    print(f"Warning: Order missing closedAt timestamp: {order.get('id')}")
-                    continue
-
-                closed_at = datetime.fromisoformat(order['closedAt'].replace('Z', '+00:00'))
-                order_date = closed_at.date()
-
-                # Get order summary data
-                summary = order.get('summary', {})
-                subtotal_cents = summary.get('currentSubtotal', 0)
-                if not isinstance(subtotal_cents, (int, float)):
-                    print(f"Warning: Invalid subtotal for order {order.get('id')}: {subtotal_cents}")
-                    continue
-
-                # Calculate order total in dollars
-                order_total = subtotal_cents / 100.0
-                total_sales += order_total
-
-                # Track daily metrics
-                daily_metrics[order_date]["sales"] += order_total
-                daily_metrics[order_date]["transactions"] += 1
-
-                # Process line items for detailed analysis
-                order_cost = 0.0
-                if 'lineGroups' in order:
-                    for group in order['lineGroups']:
-                        if 'lines' not in group:
-                            continue
-
-                        for line in group['lines']:
-                            line_subtotal_cents = line.get('currentSubtotal', 0)
-                            line_amount = line_subtotal_cents / 100.0 if line_subtotal_cents else 0.0
-                            
-                            # Get item name and type
-                            item_name = line.get('name', 'Unknown Item')
-                            item_type = 'service' if line.get('__typename') == 'OrderServiceLine' else 'product'
-
-                            # Calculate line item cost
-                            # First try to get cost from inventory map
-                            unit_cost = 0.0
-                            if item_name in inventory_cost_map:
-                                unit_cost = inventory_cost_map[item_name]['avg_unit_cost']
-                            else:
-                                # Fallback to default cost percentages
-                                if item_type == 'product':
-                                    unit_cost = line_amount * 0.4  # 40% cost for products
-                                else:
-                                    unit_cost = line_amount * 0.3  # 30% cost for services
-
-                            quantity = line.get('quantity', 1)
-                            line_cost = unit_cost * quantity
-                            order_cost += line_cost
-
-                            # Track item metrics
-                            items_tracking[item_name].update({
-                                "name": item_name,
-                                "type": item_type,
-                                "quantity": items_tracking[item_name]["quantity"] + quantity,
-                                "total_sales": items_tracking[item_name]["total_sales"] + line_amount,
-                                "total_cost": items_tracking[item_name]["total_cost"] + line_cost
-                            })
-                            # Calculate and update profit metrics for the item
-                            item_profit = line_amount - line_cost
-                            items_tracking[item_name]["total_profit"] = items_tracking[item_name]["total_sales"] - items_tracking[item_name]["total_cost"]
-                            items_tracking[item_name]["profit_margin"] = (
-                                (items_tracking[item_name]["total_profit"] / items_tracking[item_name]["total_sales"] * 100)
-                                if items_tracking[item_name]["total_sales"] > 0 else 0
-                            )
-
-                            # Track discounts if present
-                            discount_amount_cents = line.get('currentDiscountAmount', 0)
-                            if discount_amount_cents:
-                                discount_amount = discount_amount_cents / 100.0
-                                discount_name = "Line Item Discount"  # Generic name since we don't have specific discount info
-                                
-                                # Update discount tracking
-                                discount_tracking[discount_name].update({
-                                    "name": discount_name,
-                                    "type": item_type,
-                                    "total_amount": discount_tracking[discount_name]["total_amount"] + discount_amount,
-                                    "usage_count": discount_tracking[discount_name]["usage_count"] + 1,
-                                    # Estimate profit impact (assuming discount directly reduces profit)
-                                    "profit_impact": discount_tracking[discount_name]["profit_impact"] - (discount_amount * (0.6 if item_type == 'product' else 0.7))
-                                })
-
-                # Calculate order profit and add to totals
-                order_profit = order_total - order_cost
-                total_profit += order_profit
-                daily_metrics[order_date]["profit"] += order_profit
-
-            except Exception as order_error:
-                print(f"Error processing order {order.get('id')}: {order_error}")
-                continue
-
-        # Calculate final KPIs
-        total_transactions = len(orders)
-        avg_transaction = total_sales / total_transactions if total_transactions > 0 else 0
-        profit_margin = (total_profit / total_sales * 100) if total_sales > 0 else 0
-
-        # Prepare trends data (sort by date)
-        trends = []
-        if daily_metrics:  # Only process if we have data
-            # Get date range
-            start_date = min(daily_metrics.keys())
-            end_date = max(daily_metrics.keys())
-            current_date = start_date
-
-            # Fill in all dates in range
-            while current_date <= end_date:
-                metrics = daily_metrics[current_date]
-                daily_sales = metrics["sales"]
-                daily_profit = metrics["profit"]
-                daily_margin = (daily_profit / daily_sales * 100) if daily_sales > 0 else 0
-                
-                trends.append({
-                    "date": current_date.isoformat(),
-                    "sales": round(daily_sales, 2),
-                    "profit": round(daily_profit, 2),
-                    "profit_margin": round(daily_margin, 2),
-                    "transactions": metrics["transactions"]
-                })
-                current_date += timedelta(days=1)
-
-        # Prepare items data
-        items = []
-        for item_data in items_tracking.values():
-            items.append({
-                "name": item_data["name"],
-                "type": item_data["type"],
-                "quantity": item_data["quantity"],
-                "total_sales": round(item_data["total_sales"], 2),
-                "total_cost": round(item_data["total_cost"], 2),
-                "total_profit": round(item_data["total_profit"], 2),
-                "profit_margin": round(item_data["profit_margin"], 2)
-            })
-
-        # Sort items by profit
-        items.sort(key=lambda x: x["total_profit"], reverse=True)
-
-        # Prepare discount data
-        discounts = []
-        for discount_data in discount_tracking.values():
-            if discount_data["usage_count"] > 0:
-                discount_data["average_discount"] = (
-                    discount_data["total_amount"] / discount_data["usage_count"]
-                )
-                discounts.append({
-                    "name": discount_data["name"],
-                    "type": discount_data["type"],
-                    "total_amount": round(discount_data["total_amount"], 2),
-                    "usage_count": discount_data["usage_count"],
-                    "profit_impact": round(discount_data["profit_impact"], 2),
-                    "average_discount": round(discount_data["average_discount"], 2)
-                })
-
-        # Sort discounts by total amount
-        discounts.sort(key=lambda x: x["total_amount"], reverse=True)
-
-        return {
-            "total_sales": round(total_sales, 2),
-            "total_transactions": total_transactions,
-            "avg_transaction_value": round(avg_transaction, 2),
-            "total_profit": round(total_profit, 2),
-            "profit_margin": round(profit_margin, 2),
-            "trends": trends,
-            "discounts": discounts,
-            "items": items
-        }
-
-    except Exception as e:
-        print(f"Error calculating KPIs: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+    return order_aggregation.project_kpis(agg, trends)
 
 # --- End KPI Calculation Function ---
 
+# Inventory costs or item names may have changed while the app was down (e.g. a new inventory CSV)
+with app.app_context():
+    try:
+        if _recost_rollups_if_stale(get_db()):
+            get_db().commit()
+            invalidate_sales_caches(sales_rollup.SOURCE_ORDERS)
+            invalidate_sales_caches(sales_rollup.SOURCE_TRANSACTIONS)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not refresh the cost index: {e}")
+
 if __name__ == '__main__':
     # Note: Use a production WSGI server like Gunicorn or Waitress for deployment
     # app.run(debug=True, host='0.0.0.0', port=5001) # Ensure correct port if running directly
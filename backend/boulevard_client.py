@@ -6,57 +6,198 @@ import hashlib
 import base64
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from requests.adapters import HTTPAdapter
 
-# Import cache object from the new extensions module
-from extensions import cache
+# Argument-aware memoization for client calls
+from flask import current_app, has_app_context
+from memoize import ttl_memoize
 from boulevard_queries import ORDER_DETAILS_QUERY, LOCATIONS_QUERY
 
 BOULEVARD_API_URL = "https://dashboard.boulevard.io/api/2020-01/admin"
 
-def _generate_http_basic_auth():
-    # Fetch environment variables INSIDE the function
-    print("Fetching Boulevard API credentials...")
-    BOULEVARD_API_KEY = os.getenv('BOULEVARD_API_KEY')
-    BOULEVARD_API_SECRET = os.getenv('BOULEVARD_SECRET')
-    BOULEVARD_BUSINESS_ID = os.getenv('BOULEVARD_BUSINESS_ID')
+# --- Shared HTTP Connection Pool ---
+# All Boulevard calls go through one requests.Session so TCP+TLS connections to
+# dashboard.boulevard.io stay warm across pages and locations.
+# BOULEVARD_POOL_CONNECTIONS: number of per-host pools kept by the adapter
+# BOULEVARD_POOL_MAXSIZE: max open connections per host (upper bound for concurrent requests)
+# BOULEVARD_POOL_BLOCK: if true, callers wait for a free connection instead of opening extra ones
+# BOULEVARD_KEEPALIVE_SECONDS: idle time after which the pool is rebuilt (0 disables keep-alive)
+BOULEVARD_POOL_CONNECTIONS = int(os.getenv('BOULEVARD_POOL_CONNECTIONS', '4'))
+BOULEVARD_POOL_MAXSIZE = int(os.getenv('BOULEVARD_POOL_MAXSIZE', '10'))
+BOULEVARD_POOL_BLOCK = os.getenv('BOULEVARD_POOL_BLOCK', 'true').lower() in ('1', 'true', 'yes')
+BOULEVARD_KEEPALIVE_SECONDS = float(os.getenv('BOULEVARD_KEEPALIVE_SECONDS', '60'))
+BOULEVARD_REQUEST_TIMEOUT = float(os.getenv('BOULEVARD_REQUEST_TIMEOUT', '30'))
+
+_session = None
+_session_last_used = 0.0
+_session_lock = threading.Lock()
+
+def _build_http_session():
+    """Creates a requests.Session with a bounded, keep-alive connection pool."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=BOULEVARD_POOL_CONNECTIONS,
+        pool_maxsize=BOULEVARD_POOL_MAXSIZE,
+        pool_block=BOULEVARD_POOL_BLOCK,
+        max_retries=0 # Retries are handled in make_boulevard_request
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if BOULEVARD_KEEPALIVE_SECONDS <= 0:
+        session.headers['Connection'] = 'close'
+    return session
+
+def get_http_session():
+    """Returns the process-wide Boulevard HTTP session, creating it on first use.
+
+    The session is shared by every client function and is safe to use from
+    multiple threads (urllib3's pool hands out one connection per request).
+    If the pool has been idle longer than BOULEVARD_KEEPALIVE_SECONDS it is
+    rebuilt, since the server will have dropped the idle sockets anyway.
+    """
+    global _session, _session_last_used
+    with _session_lock:
+        now = time.monotonic()
+        idle_for = now - _session_last_used
+        if _session is not None and BOULEVARD_KEEPALIVE_SECONDS > 0 and idle_for > BOULEVARD_KEEPALIVE_SECONDS:
+            _session.close()
+            _session = None
+        if _session is None:
+            _session = _build_http_session()
+        _session_last_used = now
+        return _session
+
+def close_http_session():
+    """Closes the shared session and all pooled connections (e.g. on shutdown or after fork)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+# --- Global Rate Limit Budget ---
+# Boulevard rate-limits per API key, not per connection, so every thread in the
+# process draws from one token bucket before it sends a request.
+# BOULEVARD_RATE_LIMIT_RPS: sustained requests per second (0 disables the limiter)
+# BOULEVARD_RATE_LIMIT_BURST: requests allowed back-to-back before throttling kicks in
+BOULEVARD_RATE_LIMIT_RPS = float(os.getenv('BOULEVARD_RATE_LIMIT_RPS', '5'))
+BOULEVARD_RATE_LIMIT_BURST = int(os.getenv('BOULEVARD_RATE_LIMIT_BURST', '5'))
+
+class RateLimiter:
+    """Thread-safe token bucket shared by all Boulevard requests in the process."""
+
+    def __init__(self, rate_per_second, burst):
+        self.rate = rate_per_second
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Holds back every worker for `seconds` (used when the API answers 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+rate_limiter = RateLimiter(BOULEVARD_RATE_LIMIT_RPS, BOULEVARD_RATE_LIMIT_BURST)
+
+# --- Cached Auth Credentials ---
+# Boulevard tokens embed a timestamp, so a Basic header stays valid for a while
+# after it is signed. Re-signing on every call is wasted CPU, so the header is
+# built once and reused until it reaches BOULEVARD_AUTH_TTL_SECONDS minus the
+# BOULEVARD_AUTH_SKEW_SECONDS safety window for clock drift.
+BOULEVARD_AUTH_TTL_SECONDS = float(os.getenv('BOULEVARD_AUTH_TTL_SECONDS', '300'))
+BOULEVARD_AUTH_SKEW_SECONDS = float(os.getenv('BOULEVARD_AUTH_SKEW_SECONDS', '30'))
+
+class BoulevardCredentialProvider:
+    """Builds and caches the HTTP Basic header used for Boulevard Admin API calls.
+
+    Thread-safe: concurrent callers share one cached header, and only one of
+    them re-signs when it expires. Nothing is printed on the hot path.
+    """
+    prefix = "blvd-admin-v1"
 
-    print(f"API Key exists: {bool(BOULEVARD_API_KEY)}")
-    print(f"API Secret exists: {bool(BOULEVARD_API_SECRET)}")
-    print(f"Business ID exists: {bool(BOULEVARD_BUSINESS_ID)}")
+    def __init__(self, ttl_seconds=BOULEVARD_AUTH_TTL_SECONDS, skew_seconds=BOULEVARD_AUTH_SKEW_SECONDS, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.skew_seconds = skew_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = None # (api_key, raw_secret, business_id), read from env once
+        self._header = None
+        self._expires_at = 0.0
 
-    if not all([BOULEVARD_API_KEY, BOULEVARD_API_SECRET, BOULEVARD_BUSINESS_ID]):
-        raise ValueError("Missing Boulevard API Key, Secret, or Business ID in environment variables.")
+    def _load_keys(self):
+        api_key = os.getenv('BOULEVARD_API_KEY')
+        api_secret = os.getenv('BOULEVARD_SECRET')
+        business_id = os.getenv('BOULEVARD_BUSINESS_ID')
 
-    prefix = "blvd-admin-v1"
-    timestamp = str(int(time.time()))
-    token_payload = f"{prefix}{BOULEVARD_BUSINESS_ID}{timestamp}"
-    print("Generated token payload")
-    
-    try:
-        raw_key = base64.b64decode(BOULEVARD_API_SECRET)
-        print("Successfully decoded API secret")
-    except Exception as e:
-        print(f"Failed to decode API secret: {e}")
-        raise ValueError(f"Failed to Base64 decode BOULEVARD_SECRET: {e}")
-    
-    raw_mac = hmac.new(
-        raw_key,
-        token_payload.encode('utf-8'),
-        hashlib.sha256
-    ).digest()
-    signature = base64.b64encode(raw_mac).decode('utf-8')
-    print("Generated signature")
-
-    token = f"{signature}{token_payload}"
-    print("Generated final token")
-    
-    http_basic_payload = f"{BOULEVARD_API_KEY}:{token}"
-    http_basic_credentials_bytes = http_basic_payload.encode('utf-8')
-    http_basic_credentials = base64.b64encode(http_basic_credentials_bytes).decode('utf-8')
-    print("Generated HTTP basic auth credentials")
-    
-    return f"Basic {http_basic_credentials}"
+        if not all([api_key, api_secret, business_id]):
+            raise ValueError("Missing Boulevard API Key, Secret, or Business ID in environment variables.")
+
+        try:
+            raw_key = base64.b64decode(api_secret)
+        except Exception as e:
+            raise ValueError(f"Failed to Base64 decode BOULEVARD_SECRET: {e}")
+
+        return api_key, raw_key, business_id
+
+    def _sign(self, now):
+        api_key, raw_key, business_id = self._keys
+        token_payload = f"{self.prefix}{business_id}{int(now)}"
+        raw_mac = hmac.new(raw_key, token_payload.encode('utf-8'), hashlib.sha256).digest()
+        signature = base64.b64encode(raw_mac).decode('utf-8')
+        token = f"{signature}{token_payload}"
+        http_basic_credentials = base64.b64encode(f"{api_key}:{token}".encode('utf-8')).decode('utf-8')
+        return f"Basic {http_basic_credentials}"
+
+    def get_header(self):
+        """Returns a valid Authorization header, re-signing only when the cached one is about to expire."""
+        now = self._clock()
+        header = self._header
+        if header is not None and now < self._expires_at:
+            return header
+
+        with self._lock:
+            now = self._clock()
+            if self._header is None or now >= self._expires_at:
+                if self._keys is None:
+                    self._keys = self._load_keys() # Raises ValueError if keys are missing
+                self._header = self._sign(now)
+                self._expires_at = now + max(self.ttl_seconds - self.skew_seconds, 0)
+            return self._header
+
+    def invalidate(self, reload_keys=False):
+        """Drops the cached header (e.g. after a 401) so the next call signs a fresh token."""
+        with self._lock:
+            self._header = None
+            self._expires_at = 0.0
+            if reload_keys:
+                self._keys = None
+
+credential_provider = BoulevardCredentialProvider()
+
+def _generate_http_basic_auth():
+    """Returns the cached Boulevard Basic auth header (see BoulevardCredentialProvider)."""
+    return credential_provider.get_header()
 
 def make_boulevard_request(query, variables=None, max_retries=4, initial_delay=1.5):
     """Makes a request to the Boulevard API with retry logic for rate limiting."""
@@ -64,9 +205,7 @@ def make_boulevard_request(query, variables=None, max_retries=4, initial_delay=1
     # if not BOULEVARD_API_KEY or not BOULEVARD_API_SECRET or not BOULEVARD_BUSINESS_ID:
     #     raise ValueError("API Key, Secret, or Business ID not configured in environment variables.")
         
-    auth_header = _generate_http_basic_auth() # This will raise ValueError if keys are missing
     headers = {
-        'Authorization': auth_header,
         'Content-Type': 'application/json',
         'Accept': 'application/json'
     }
@@ -80,13 +219,18 @@ def make_boulevard_request(query, variables=None, max_retries=4, initial_delay=1
     delay = initial_delay
     last_exception = None
 
+    session = get_http_session()
+    auth_refreshed = False
+
     while retries < max_retries:
         try:
-            response = requests.post(
+            headers['Authorization'] = _generate_http_basic_auth() # Raises ValueError if keys are missing
+            rate_limiter.acquire()
+            response = session.post(
                 url=BOULEVARD_API_URL,
                 headers=headers,
                 data=request_body_str,
-                timeout=30 # Add a timeout
+                timeout=BOULEVARD_REQUEST_TIMEOUT
             )
             response.raise_for_status() # Raises HTTPError for 4xx/5xx responses
 
@@ -105,6 +249,11 @@ def make_boulevard_request(query, variables=None, max_retries=4, initial_delay=1
 
         except requests.exceptions.HTTPError as e:
             last_exception = e
+            if e.response.status_code == 401 and not auth_refreshed:
+                # Cached token may have been rejected (e.g. server clock drift); sign a new one once
+                auth_refreshed = True
+                credential_provider.invalidate(reload_keys=True)
+                continue
             if e.response.status_code == 429:
                 retries += 1
                 wait_time = delay # Default wait time
@@ -122,6 +271,7 @@ def make_boulevard_request(query, variables=None, max_retries=4, initial_delay=1
                 except Exception as parse_error:
                     print(f"Rate limit hit (429), error parsing wait time ({parse_error}). Retrying in {delay:.2f} seconds... (Attempt {retries}/{max_retries})")
                 
+                rate_limiter.pause(wait_time) # Back off every worker, not just this one
                 time.sleep(wait_time)
                 delay = min(delay * 2, 30) # Exponential backoff, cap at 30 seconds
             else:
@@ -149,6 +299,53 @@ def make_boulevard_request(query, variables=None, max_retries=4, initial_delay=1
          # Should not happen if logic is correct, but as a fallback
          raise Exception("API request failed after multiple retries for an unknown reason.") 
 
+# --- Concurrent Multi-Location Fetching ---
+# BOULEVARD_MAX_WORKERS bounds how many locations are fetched at once; the shared
+# rate limiter above keeps the combined request rate within Boulevard's budget.
+BOULEVARD_MAX_WORKERS = int(os.getenv('BOULEVARD_MAX_WORKERS', '4'))
+
+# --- Memoization Settings ---
+# Results are cached per normalized (location_id, query_string/days_history) so
+# repeated dashboard loads skip the API without mixing up locations.
+KPI_DATA_CACHE_TTL = int(os.getenv('BOULEVARD_KPI_CACHE_TTL', '300'))
+KPI_DATA_CACHE_MAXSIZE = int(os.getenv('BOULEVARD_KPI_CACHE_MAXSIZE', '256'))
+HISTORICAL_ORDERS_CACHE_TTL = int(os.getenv('BOULEVARD_HISTORY_CACHE_TTL', '900'))
+HISTORICAL_ORDERS_CACHE_MAXSIZE = int(os.getenv('BOULEVARD_HISTORY_CACHE_MAXSIZE', '64'))
+PRODUCT_COSTS_CACHE_TTL = int(os.getenv('BOULEVARD_PRODUCT_COSTS_CACHE_TTL', '3600'))
+PRODUCT_COSTS_CACHE_MAXSIZE = int(os.getenv('BOULEVARD_PRODUCT_COSTS_CACHE_MAXSIZE', '64'))
+
+def fetch_for_locations(fetch_fn, location_ids, max_workers=None, **kwargs):
+    """Calls fetch_fn(location_id=..., **kwargs) for every location concurrently.
+
+    Returns a dict of location_id -> result in the same order as location_ids.
+    A location whose fetch raises maps to None so one bad location does not
+    fail the whole dashboard. Workers run inside the caller's Flask app context
+    when there is one, so fetch functions may still use current_app.
+    """
+    location_ids = list(location_ids)
+    if not location_ids:
+        return {}
+
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def _run(loc_id):
+        try:
+            if app is not None:
+                with app.app_context():
+                    return fetch_fn(location_id=loc_id, **kwargs)
+            return fetch_fn(location_id=loc_id, **kwargs)
+        except Exception as e:
+            print(f"Error fetching data for location {loc_id}: {e}")
+            return None
+
+    workers = min(max_workers or BOULEVARD_MAX_WORKERS, len(location_ids))
+    if workers <= 1:
+        return {loc_id: _run(loc_id) for loc_id in location_ids}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='boulevard-fetch') as executor:
+        results = executor.map(_run, location_ids)
+        return dict(zip(location_ids, results))
+
 def get_boulevard_locations():
     """Fetches all locations from Boulevard API."""
     response = make_boulevard_request(LOCATIONS_QUERY)
@@ -222,8 +419,33 @@ def _fetch_all_pages(query, variables):
 
     return all_nodes
 
+# --- Page iterator used by the local order sync ---
+def iter_order_pages(location_id, query_string):
+    """Yields lists of ORDER_DETAILS_QUERY order nodes one page at a time.
+
+    Unlike _fetch_all_pages this raises on API errors instead of silently
+    stopping, so a sync never mistakes a failed page for the end of the data.
+    """
+    after_cursor = None
+    while True:
+        variables = {"locationId": location_id, "query": query_string}
+        if after_cursor:
+            variables['after'] = after_cursor
+        response = make_boulevard_request(query=ORDER_DETAILS_QUERY, variables=variables)
+        if response is None or 'errors' in response or 'data' not in response:
+            error_detail = response.get('errors', 'Unknown API error') if response else 'No response'
+            raise RuntimeError(f"Order sync page failed for location {location_id}: {error_detail}")
+
+        orders_data = response['data'].get('orders') or {}
+        yield [edge['node'] for edge in orders_data.get('edges', []) if edge and 'node' in edge]
+
+        page_info = orders_data.get('pageInfo') or {}
+        after_cursor = page_info.get('endCursor')
+        if not page_info.get('hasNextPage') or not after_cursor:
+            return
+
 # --- Updated Function for KPI Data (Fetches Order Details for Profitability) ---
-@cache.cached(key_prefix='kpi_data') 
+@ttl_memoize(ttl=KPI_DATA_CACHE_TTL, maxsize=KPI_DATA_CACHE_MAXSIZE, name='kpi_data')
 def get_boulevard_kpi_data(location_id, query_string=None): 
     """Fetches order details with cost information from Boulevard API using the top-level orders query."""
     if not query_string:
@@ -297,7 +519,7 @@ def get_boulevard_kpi_data(location_id, query_string=None):
         print(f"Failed order details query (with cost) for location {location_id}: {e}")
         return None
 
-@cache.cached(key_prefix='historical_orders')
+@ttl_memoize(ttl=HISTORICAL_ORDERS_CACHE_TTL, maxsize=HISTORICAL_ORDERS_CACHE_MAXSIZE, name='historical_orders')
 def get_historical_orders(location_id, days_history=365):
     """Fetches all orders for a location going back a specified number of days."""
     
@@ -378,7 +600,7 @@ def get_historical_orders(location_id, days_history=365):
         return None
 
 # --- NEW: Function to fetch costs for multiple products --- 
-@cache.cached(key_prefix='product_costs', make_cache_key=lambda *args, **kwargs: tuple(sorted(args[0])) if args else ()) 
+@ttl_memoize(ttl=PRODUCT_COSTS_CACHE_TTL, maxsize=PRODUCT_COSTS_CACHE_MAXSIZE, name='product_costs')
 def get_boulevard_product_costs(product_ids):
     """Fetches unitCost for a list of product IDs using a single batch query."""
     if not product_ids:
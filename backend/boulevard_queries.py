@@ -1,8 +1,8 @@
 """GraphQL queries for the Boulevard API."""
 
 ORDER_DETAILS_QUERY = """
-query OrderDetails($locationId: ID!, $query: QueryString) {
-  orders(locationId: $locationId, query: $query, first: 100) {
+query OrderDetails($locationId: ID!, $query: QueryString, $after: String) {
+  orders(locationId: $locationId, query: $query, first: 100, after: $after) {
     edges {
       node {
         id
@@ -0,0 +1,87 @@
+"""Canonical cache keys, identical in every process.
+
+Keys used to embed hash(frozenset(request.args.items())), and str hashes are
+randomized per process, so the same request got a different key in each
+worker and after every restart. Keys built here only depend on the request:
+
+    <path>|<sha1 of the canonical parameters>
+
+where the canonical parameters are the query string with values stripped,
+empty values dropped, repeated parameters sorted, declared defaults filled in
+and declared date parameters rewritten as YYYY-MM-DD, serialized as JSON with
+sorted keys. With location_id defaulting to 'all', ?start_date=2025-1-5 and
+?location_id=all&start_date=2025-01-05 therefore share one entry.
+"""
+import hashlib
+import json
+from datetime import date, datetime
+
+from dateutil.parser import isoparse
+from flask import request
+
+def canonical_date(value):
+    """'YYYY-MM-DD' for a parseable date or ISO datetime; anything else is returned stripped (or None)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').date().isoformat() # Also accepts 2025-1-5
+    except ValueError:
+        pass
+    try:
+        return isoparse(text).date().isoformat()
+    except (ValueError, OverflowError):
+        return text
+
+def digest(value):
+    """Stable hex digest of a JSON-serializable value (tuples count as lists, other objects as str())."""
+    payload = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def canonical_params(args, defaults=None, dates=()):
+    """{name: value or sorted [values]} for a query string MultiDict (or a plain dict).
+
+    defaults: {name: value or callable(params) -> value} filled in (in order)
+    for parameters that are missing; callables see the parameters filled so
+    far and may return None to leave the parameter out.
+    dates: parameter names normalized with canonical_date().
+    """
+    params = {}
+    names = args.keys() if hasattr(args, 'getlist') else list(args)
+    for name in names:
+        values = args.getlist(name) if hasattr(args, 'getlist') else [args[name]]
+        values = sorted(str(value).strip() for value in values if value is not None and str(value).strip())
+        if name in dates:
+            values = sorted(canonical_date(value) for value in values)
+        if values:
+            params[name] = values[0] if len(values) == 1 else values
+
+    for name, default in (defaults or {}).items():
+        if name in params:
+            continue
+        try:
+            value = default(params) if callable(default) else default
+        except (ValueError, TypeError, KeyError):
+            value = None # Let the endpoint report the bad input; the key just omits it
+        if value is not None:
+            params[name] = canonical_date(value) if name in dates else str(value)
+    return params
+
+def make_key(path, args, defaults=None, dates=()):
+    return f"{path}|{digest(canonical_params(args, defaults, dates))}"
+
+def for_request(defaults=None, dates=()):
+    """A key_prefix callable for cache.cached() that keys on the current request (see make_key).
+
+    Its params() returns the canonical parameters the key is built from.
+    """
+    def key_prefix():
+        return make_key(request.path, request.args, defaults, dates)
+    key_prefix.params = lambda: canonical_params(request.args, defaults, dates)
+    return key_prefix
@@ -0,0 +1,191 @@
+"""Tagged response caching with targeted invalidation.
+
+Cached responses are tagged with the endpoint and the data they were built
+from, as (source, location, month) scopes:
+
+    endpoint:/api/v1/kpis
+    source:orders                                   everything from a source
+    source:orders|location:<id>                     one location
+    source:orders|location:<id>|month:2025-04       one location and month
+    source:orders|location:<id>|month:*             open-ended date ranges
+
+invalidate() takes the same dimensions (data_tags() builds the tags a sync or
+upload of some locations and days affects), so an upload for one location
+only evicts the entries that include that location and one of its months.
+
+Tags are versioned rather than indexed: every tag has a token in the cache
+(tag/<tag>), an entry stores the tokens its tags had when it was computed,
+and invalidating a tag replaces its token. A read compares the entry's
+tokens with the current ones (one get_many) and deletes the entry if any
+changed. Only get/set/add/delete are used, so this works on every
+Flask-Caching backend, and a tag token that gets evicted simply invalidates
+the entries that carry it. A backend that keeps no tokens at all (the null
+cache) is reported by check() and logged on first use; every tag then gets a
+new token on each read, so nothing is ever served as current. version() exposes the tokens of a set of tags, so
+caches outside TaggedCache (e.g. memoized aggregates) can key on them.
+"""
+import uuid
+from datetime import date
+from functools import wraps
+
+from flask import make_response, request
+
+import cache_keys
+
+# Date ranges longer than this are tagged month:* instead of month by month
+MAX_MONTH_TAGS = 36
+OPEN_RANGE = '*'
+
+def endpoint_tag(path):
+    return f"endpoint:{path}"
+
+def source_tag(source, location_id=None, month=None):
+    tag = f"source:{source}"
+    if location_id is not None:
+        tag += f"|location:{location_id}"
+        if month is not None:
+            tag += f"|month:{month}"
+    return tag
+
+def _month(day):
+    """'YYYY-MM' for a 'YYYY-MM-DD' day, or None if it does not parse."""
+    try:
+        return date.fromisoformat(str(day)[:10]).strftime('%Y-%m')
+    except ValueError:
+        return None
+
+def _months_between(first_day, last_day):
+    first, last = _month(first_day), _month(last_day)
+    if first is None or last is None or first > last:
+        return None
+    year, month = map(int, first.split('-'))
+    months = []
+    while f"{year:04d}-{month:02d}" <= last:
+        months.append(f"{year:04d}-{month:02d}")
+        if len(months) > MAX_MONTH_TAGS:
+            return None
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def scope_tags(source, location_ids, start_date=None, end_date=None):
+    """Tags for an entry built from `source` data of the locations between two days (None = open-ended)."""
+    # An open end date reaches today: later syncs land in the current month
+    months = _months_between(start_date, end_date or date.today().isoformat()) if start_date else None
+    tags = {source_tag(source)}
+    for location_id in location_ids:
+        tags.add(source_tag(source, location_id))
+        for month in months or [OPEN_RANGE]:
+            tags.add(source_tag(source, location_id, month))
+    return tags
+
+def data_tags(source, location_ids=None, days=None):
+    """Tags to invalidate after `source` data of some locations (None = all) and days (None = all) changed."""
+    if location_ids is None:
+        return {source_tag(source)}
+    if days is None:
+        return {source_tag(source, location_id) for location_id in location_ids}
+    months = {_month(day) for day in days}
+    if None in months:
+        return {source_tag(source, location_id) for location_id in location_ids}
+    tags = set()
+    for location_id in location_ids:
+        # Entries with an open-ended range may include any of these days
+        tags.add(source_tag(source, location_id, OPEN_RANGE))
+        tags.update(source_tag(source, location_id, month) for month in months)
+    return tags
+
+class TaggedCache:
+    """Stores tagged entries in a Flask-Caching Cache and invalidates them by tag."""
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._reported_lost_tokens = False
+
+    @staticmethod
+    def _tag_key(tag):
+        return f"tag/{tag}"
+
+    def _tokens(self, tags):
+        """{tag: current token}, creating tokens for tags that have none."""
+        tags = sorted(tags)
+        tokens = dict(zip(tags, self._cache.get_many(*map(self._tag_key, tags))))
+        missing = [tag for tag, token in tokens.items() if token is None]
+        for tag in missing:
+            self._cache.add(self._tag_key(tag), uuid.uuid4().hex, timeout=0)
+        if missing:
+            # Another worker may have created the same tag first; use whichever token won
+            tokens.update(zip(missing, self._cache.get_many(*map(self._tag_key, missing))))
+            lost = [tag for tag in missing if tokens[tag] is None]
+            if lost:
+                self._report_lost_tokens(lost)
+                # Tokens that never match again: entries are recomputed instead of served stale
+                tokens.update((tag, uuid.uuid4().hex) for tag in lost)
+        return tokens
+
+    def _report_lost_tokens(self, tags):
+        if not self._reported_lost_tokens:
+            self._reported_lost_tokens = True
+            print(
+                f"[Cache] ERROR: the cache backend did not keep the tokens of {len(tags)} tag(s) (e.g. {tags[0]}); "
+                "tagged entries cannot be invalidated and are recomputed on every request. Use a persistent CACHE_TYPE."
+            )
+
+    def check(self):
+        """True if the backend keeps tag tokens (writes and reads back a probe token); logs an error if not."""
+        key = self._tag_key('probe')
+        token = uuid.uuid4().hex
+        self._cache.set(key, token, timeout=0)
+        if self._cache.get(key) == token:
+            return True
+        self._report_lost_tokens(['probe'])
+        return False
+
+    def get(self, key):
+        """(found, value) for a tagged entry; an entry with an invalidated tag is deleted and missed."""
+        entry = self._cache.get(key)
+        if not isinstance(entry, dict) or 'tags' not in entry:
+            return False, None
+        tags = sorted(entry['tags'])
+        current = self._cache.get_many(*map(self._tag_key, tags))
+        if any(token is None or token != entry['tags'][tag] for tag, token in zip(tags, current)):
+            self._cache.delete(key)
+            return False, None
+        return True, entry['value']
+
+    def set(self, key, value, tokens, timeout=None):
+        """Stores value with the tag tokens read (via _tokens) before it was computed."""
+        return self._cache.set(key, {'tags': tokens, 'value': value}, timeout=timeout)
+
+    def version(self, tags):
+        """A digest of the tags' current tokens; it changes whenever one of them is invalidated."""
+        return cache_keys.digest(self._tokens(tags))
+
+    def invalidate(self, tags):
+        """Invalidates every entry carrying one of the tags; returns the number of tags bumped."""
+        tags = set(tags)
+        if tags:
+            self._cache.set_many({self._tag_key(tag): uuid.uuid4().hex for tag in tags}, timeout=0)
+        return len(tags)
+
+    def cached(self, key_prefix, tags=None, timeout=None):
+        """Like cache.cached() for GET views, but tagged.
+
+        key_prefix() -> cache key for the current request (cache_keys.for_request)
+        tags() -> data tags for the current request (scope_tags); the endpoint
+        tag is added automatically. Only 200 responses are cached.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = key_prefix()
+                found, response = self.get(key)
+                if found:
+                    return response
+                # Read before computing, so an invalidation during the computation wins
+                tokens = self._tokens({endpoint_tag(request.path)} | set(tags() if tags else ()))
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    self.set(key, response, tokens, timeout)
+                return response
+            return wrapper
+        return decorator
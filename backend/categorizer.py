@@ -0,0 +1,167 @@
+"""Compiled service/product name -> category classification.
+
+A Categorizer combines two kinds of rules, tried in order:
+
+    exact       mapping entries ({name: category}); the name as-is, then
+                case-, punctuation- and whitespace-insensitive
+    keyword     (category, keywords) rules in priority order; the first
+                category with a keyword anywhere in the normalized name wins
+    default     nothing matched
+
+Mapping entries are a dict lookup on the normalized name and all keywords are
+compiled into one regex (a lookahead alternation ordered by priority, so one
+pass over the name finds the best keyword at every position). Results are
+memoized per distinct name, so a name is only classified the first time it is
+seen; coverage() reports which rules are hit and which names fall through.
+Coverage is counted per thread and merged by coverage(), so a memo hit never
+takes a lock.
+"""
+import re
+import threading
+from collections import Counter
+
+import pandas as pd
+
+# Distinct names memoized per categorizer (the memo is cleared when full)
+CATEGORIZER_CACHE_SIZE = 50000
+# Unmatched names listed by coverage()
+COVERAGE_UNMATCHED_LIMIT = 50
+
+MATCH_EXACT = 'exact'
+MATCH_NORMALIZED = 'normalized'
+MATCH_KEYWORD = 'keyword'
+MATCH_DEFAULT = 'default'
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+def normalize_name(name):
+    """Lowercase with punctuation and runs of whitespace collapsed to single spaces."""
+    if name is None or name != name: # None or NaN
+        return ''
+    return _NON_WORD.sub(' ', str(name).casefold()).strip()
+
+class Categorizer:
+    """Classifies names by exact mapping entries, then keyword rules, then a default."""
+
+    def __init__(self, mapping=None, keyword_rules=(), default='Uncategorized', cache_size=CATEGORIZER_CACHE_SIZE):
+        self.default = default
+        self._cache_size = cache_size
+        self._exact = dict(mapping or {})
+        self._normalized = {}
+        for name, category in self._exact.items():
+            self._normalized.setdefault(normalize_name(name), (name, category))
+
+        # keyword -> (priority, category); a keyword listed twice keeps its first rule
+        self._keywords = {}
+        for priority, (category, keywords) in enumerate(keyword_rules):
+            for keyword in keywords:
+                normalized = normalize_name(keyword)
+                if normalized:
+                    self._keywords.setdefault(normalized, (priority, category))
+        # At each position the alternation tries higher-priority (then longer) keywords first
+        ordered = sorted(self._keywords, key=lambda keyword: (self._keywords[keyword][0], -len(keyword)))
+        self._pattern = re.compile('(?=(' + '|'.join(map(re.escape, ordered)) + '))') if ordered else None
+
+        self._lock = threading.Lock() # Guards memo writes and the counter registry
+        self._memo = {} # name -> (category, match_type, rule)
+        self._local = threading.local()
+        self._counters = [] # (rule_hits, unmatched) of every thread that classified a name
+
+    def _thread_counters(self):
+        """This thread's (rule_hits, unmatched) Counters: (match_type, rule) -> lookups, name -> lookups."""
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = (Counter(), Counter())
+            with self._lock:
+                self._counters.append(counters)
+        return counters
+
+    def _classify(self, name):
+        """(category, match_type, rule) for one name, without the memo."""
+        if name in self._exact:
+            return self._exact[name], MATCH_EXACT, name
+        normalized = normalize_name(name)
+        if normalized in self._normalized:
+            matched_name, category = self._normalized[normalized]
+            return category, MATCH_NORMALIZED, matched_name
+        if self._pattern is not None and normalized:
+            best = min((self._keywords[match.group(1)] + (match.group(1),) for match in self._pattern.finditer(normalized)), default=None)
+            if best is not None:
+                _, category, keyword = best
+                return category, MATCH_KEYWORD, keyword
+        return self.default, MATCH_DEFAULT, None
+
+    def classify(self, name):
+        """(category, match_type, rule) for a name; rule is the mapping entry or keyword that matched."""
+        key = name if isinstance(name, str) else normalize_name(name)
+        result = self._memo.get(key)
+        if result is None:
+            result = self._classify(key)
+            with self._lock:
+                if len(self._memo) >= self._cache_size:
+                    self._memo.clear()
+                self._memo[key] = result
+        rule_hits, unmatched = self._thread_counters()
+        rule_hits[result[1:]] += 1
+        if result[1] == MATCH_DEFAULT and (key in unmatched or len(unmatched) < self._cache_size):
+            unmatched[key] += 1
+        return result
+
+    def __call__(self, name):
+        """The category for a name (usable wherever a categorize(name) callback is expected)."""
+        return self.classify(name)[0]
+
+    def categorize_series(self, names):
+        """Categories for a whole Series of names; each distinct name is classified once."""
+        codes, uniques = pd.factorize(names.fillna('').astype(str))
+        categories = [self(name) for name in uniques]
+        return pd.Series(pd.Index(categories).take(codes).to_numpy(), index=names.index)
+
+    # --- Coverage ---
+
+    def coverage(self):
+        """Lookup counts by match type and rule, rules never hit and the most frequent unmatched names."""
+        with self._lock:
+            counters = list(self._counters)
+            distinct = len(self._memo)
+        rule_hits = Counter()
+        unmatched = Counter()
+        for thread_rule_hits, thread_unmatched in counters:
+            # dict() copies in one step, while the owning thread may keep counting
+            rule_hits.update(dict(thread_rule_hits))
+            unmatched.update(dict(thread_unmatched))
+        lookups = sum(rule_hits.values())
+        unmatched = unmatched.most_common(COVERAGE_UNMATCHED_LIMIT)
+
+        by_match = Counter()
+        mapping_hits = Counter()
+        keyword_hits = Counter()
+        for (match_type, rule), count in rule_hits.items():
+            by_match[match_type] += count
+            if match_type in (MATCH_EXACT, MATCH_NORMALIZED):
+                mapping_hits[rule] += count
+            elif match_type == MATCH_KEYWORD:
+                keyword_hits[rule] += count
+        matched = lookups - by_match[MATCH_DEFAULT]
+        return {
+            "lookups": lookups,
+            "distinct_names": distinct,
+            "matched_percent": round(100.0 * matched / lookups, 2) if lookups else None,
+            "by_match": {match_type: by_match[match_type] for match_type in (MATCH_EXACT, MATCH_NORMALIZED, MATCH_KEYWORD, MATCH_DEFAULT)},
+            "mapping_hits": dict(mapping_hits.most_common()),
+            "keyword_hits": {
+                keyword: {"category": self._keywords[keyword][1], "lookups": count}
+                for keyword, count in keyword_hits.most_common()
+            },
+            "unused_mapping_entries": sorted(name for name in self._exact if name not in mapping_hits),
+            "unused_keywords": sorted(keyword for keyword in self._keywords if keyword not in keyword_hits),
+            "unmatched": [{"name": name, "lookups": count} for name, count in unmatched],
+        }
+
+    def reset_coverage(self):
+        """Clears the memo and the coverage counters."""
+        with self._lock:
+            self._memo.clear()
+            # Threads register fresh counters on their next lookup
+            self._local = threading.local()
+            self._counters = []
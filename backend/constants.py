@@ -163,4 +163,15 @@ BOULEVARD_CATEGORY_MAPPING = {
     "Account Credit Adjustment": "Membership/Account Adjustment",
     # Default/Uncategorized
     "DEFAULT_CATEGORY": "Uncategorized" # A default for items not in the map
-} 
\ No newline at end of file
+} 
+
+# Fallback keyword rules for names missing from the mapping, as (category, keywords)
+# in priority order (see categorizer.py); matched case-, punctuation- and whitespace-insensitively
+BOULEVARD_KEYWORD_RULES = [
+    ("Retail/Membership", ["membership"]),
+    ("Wellness/Weight Loss", ["semaglutide", "tirzepatide", "weight loss"]),
+    ("Injectables", ["botox", "dysport", "filler", "juvederm", "restylane", "sculptra", "kybella"]),
+    ("Facials", ["hydrafacial", "facial", "peel"]),
+    ("Laser", ["laser", "hair removal", "resurfacing"]),
+    ("IV Therapy", ["iv drip", "iv therapy"]),
+]
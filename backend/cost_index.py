@@ -0,0 +1,122 @@
+"""Persisted product/service -> unit cost resolution.
+
+Profit needs a unit cost for every product and service, but inventory costs
+are keyed by free-text names (the inventory CSV and the `inventory_costs`
+table). Names are resolved once, in order of preference:
+
+    exact       the name as-is
+    normalized  case-, quote- and whitespace-insensitive
+    fuzzy       difflib close match on the normalized name (cutoff 0.8)
+    none        no match; unit cost 0
+
+and stored in `item_cost_index` keyed by (item_type, item_id), so profit
+queries join against it. The index remembers a fingerprint of its inputs
+(the CSV file, `inventory_costs` and the product/service names) and is
+rebuilt only when that fingerprint changes.
+"""
+import difflib
+import hashlib
+import os
+
+FUZZY_MATCH_CUTOFF = 0.8
+
+def normalize_name(name):
+    return ' '.join(str(name).replace('"', ' ').replace("'", ' ').split()).casefold() if name else ''
+
+def _table_exists(db, name):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def _inventory_costs_rows(db):
+    if not _table_exists(db, 'inventory_costs'):
+        return []
+    return db.execute('SELECT name, avg_unit_cost FROM inventory_costs ORDER BY name').fetchall()
+
+def _items(db):
+    """[(item_type, item_id, name)] for every product and service."""
+    products = db.execute("SELECT 'product', product_id, name FROM products ORDER BY product_id").fetchall()
+    services = db.execute("SELECT 'service', service_id, name FROM services ORDER BY service_id").fetchall()
+    return [tuple(row) for row in products] + [tuple(row) for row in services]
+
+def source_fingerprint(db, csv_path):
+    """Hash of everything the index is derived from."""
+    digest = hashlib.sha1()
+    try:
+        stat = os.stat(csv_path)
+        digest.update(f"{os.path.abspath(csv_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    except OSError:
+        digest.update(b'no-csv')
+    for name, cost in _inventory_costs_rows(db):
+        digest.update(f"c|{name}|{cost}".encode())
+    for item_type, item_id, name in _items(db):
+        digest.update(f"i|{item_type}|{item_id}|{name}".encode())
+    return digest.hexdigest()
+
+def _stored_fingerprint(db):
+    row = db.execute('SELECT source_fingerprint FROM cost_index_state WHERE id = 1').fetchone()
+    return row[0] if row else None
+
+def resolve(name, costs, normalized_costs, normalized_names):
+    """Returns (unit_cost, match_type, matched_name) for one item name."""
+    if not name:
+        return 0.0, 'none', None
+    if name in costs:
+        return costs[name], 'exact', name
+    normalized = normalize_name(name)
+    if normalized in normalized_costs:
+        matched_name, cost = normalized_costs[normalized]
+        return cost, 'normalized', matched_name
+    close = difflib.get_close_matches(normalized, normalized_names, n=1, cutoff=FUZZY_MATCH_CUTOFF)
+    if close:
+        matched_name, cost = normalized_costs[close[0]]
+        return cost, 'fuzzy', matched_name
+    return 0.0, 'none', None
+
+def rebuild(db, csv_path, load_csv_costs):
+    """Re-resolves every product/service cost. Does not commit; returns the number of items indexed.
+
+    load_csv_costs(csv_path) -> {name: {'avg_unit_cost': float, ...}} (app.load_inventory_costs).
+    """
+    costs = {name: info['avg_unit_cost'] for name, info in load_csv_costs(csv_path).items()}
+    # inventory_costs (maintained in the database) takes precedence over the CSV
+    for name, cost in _inventory_costs_rows(db):
+        costs[name] = float(cost) if cost else 0.0
+    normalized_costs = {}
+    for name, cost in costs.items():
+        normalized_costs.setdefault(normalize_name(name), (name, cost))
+    normalized_names = list(normalized_costs)
+
+    rows = []
+    for item_type, item_id, name in _items(db):
+        unit_cost, match_type, matched_name = resolve(name, costs, normalized_costs, normalized_names)
+        rows.append((item_type, item_id, name, unit_cost, match_type, matched_name))
+
+    db.execute('DELETE FROM item_cost_index')
+    db.executemany(
+        """
+        INSERT INTO item_cost_index (item_type, item_id, item_name, unit_cost, match_type, matched_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        rows
+    )
+    db.execute(
+        """
+        INSERT INTO cost_index_state (id, source_fingerprint, built_at) VALUES (1, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(id) DO UPDATE SET source_fingerprint = excluded.source_fingerprint, built_at = excluded.built_at
+        """,
+        (source_fingerprint(db, csv_path),)
+    )
+    unmatched = [row[2] for row in rows if row[4] == 'none']
+    print(f"[CostIndex] Indexed {len(rows)} items ({len(unmatched)} without an inventory cost)")
+    return len(rows)
+
+def ensure_current(db, csv_path, load_csv_costs):
+    """Rebuilds the index if its inputs changed. Does not commit; returns True if it was rebuilt."""
+    if _stored_fingerprint(db) == source_fingerprint(db, csv_path):
+        return False
+    rebuild(db, csv_path, load_csv_costs)
+    return True
+
+def match_summary(db):
+    """{match_type: count} for the current index (useful to spot unmatched items)."""
+    rows = db.execute('SELECT match_type, COUNT(*) FROM item_cost_index GROUP BY match_type').fetchall()
+    return {row[0]: row[1] for row in rows}
@@ -1,23 +1,88 @@
-import pandas as pd
 import uuid
-from datetime import datetime
+
+import pandas as pd
 from sqlalchemy import create_engine
 from models.analytics_schema import Base, Transaction, Client, Staff, Appointment, MarketingMetrics, FinancialMetrics
+from categorizer import Categorizer
+
+# (category, keywords) in priority order; the first category with a keyword in the name wins
+SERVICE_CATEGORIES = [
+    ('tox', ['botox', 'dysport', 'tox']),
+    ('filler', ['filler', 'juvederm', 'voluma', 'vollure']),
+    ('facials', ['facial', 'hydrafacial']),
+    ('lasers', ['laser', 'hair removal']),
+    ('weight_loss', ['weight', 'semaglutide', 'tirzepatide']),
+]
+DEFAULT_SERVICE_CATEGORY = 'retail'
+
+SALE_DATE_FORMAT = '%m/%d/%Y'
+NEW_PATIENT_SERVICE = 'NEW PATIENT BOTOX/DYSPORT'
+
+SERVICE_CATEGORIZER = Categorizer(keyword_rules=SERVICE_CATEGORIES, default=DEFAULT_SERVICE_CATEGORY)
 
 def categorize_service(service_name):
-    service_name = service_name.lower()
-    if any(x in service_name for x in ['botox', 'dysport', 'tox']):
-        return 'tox'
-    elif any(x in service_name for x in ['filler', 'juvederm', 'voluma', 'vollure']):
-        return 'filler'
-    elif any(x in service_name for x in ['facial', 'hydrafacial']):
-        return 'facials'
-    elif any(x in service_name for x in ['laser', 'hair removal']):
-        return 'lasers'
-    elif any(x in service_name for x in ['weight', 'semaglutide', 'tirzepatide']):
-        return 'weight_loss'
-    else:
-        return 'retail'
+    return SERVICE_CATEGORIZER(service_name)
+
+def categorize_services(names):
+    """categorize_service() for a whole Series of names at once (NaN counts as '')."""
+    return SERVICE_CATEGORIZER.categorize_series(names)
+
+def _new_ids(count):
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+def _money(column):
+    return pd.to_numeric(column).fillna(0).astype(float)
+
+def _records(frame):
+    """DataFrame -> list of dicts with None for missing values (for executemany inserts)."""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+def build_records(df):
+    """Builds the client, staff and transaction rows of a Detailed Line Item export.
+
+    Returns (clients, staff, transactions) DataFrames shaped like their tables.
+    Everything is computed column-wise: sale dates are parsed once, clients
+    come from one group-by (first/last visit, line count), staff from the
+    unique names and categories from categorize_services().
+    """
+    sale_dates = pd.to_datetime(df['Sale Date'], format=SALE_DATE_FORMAT)
+
+    # Clients: one row per name with first/last visit and number of sale lines
+    named = df['Client Name'].notna()
+    visits = pd.DataFrame({'name': df.loc[named, 'Client Name'], 'date': sale_dates[named]})
+    clients = visits.groupby('name', sort=False).agg(
+        first_visit_date=('date', 'min'),
+        last_visit_date=('date', 'max'),
+        total_visits=('date', 'size'),
+    ).reset_index()
+    clients.insert(0, 'id', _new_ids(len(clients)))
+
+    # Staff: one row per name
+    staff = pd.DataFrame({'name': df['Staff Name'].dropna().unique()})
+    staff.insert(0, 'id', _new_ids(len(staff)))
+    staff['role'] = 'provider' # Default role
+
+    # Transactions: every line with a sale id except the 'All' summary row
+    sales = df['Sale id'].notna() & (df['Sale id'] != 'All')
+    lines = df[sales]
+    item_names = lines['Service Name'].fillna(lines['Product Name'])
+    client_ids = dict(zip(clients['name'], clients['id']))
+    staff_ids = dict(zip(staff['name'], staff['id']))
+    transactions = pd.DataFrame({
+        'id': lines['Sale id'],
+        'date': sale_dates[sales],
+        'location_name': lines['Location Name'],
+        'client_id': lines['Client Name'].map(client_ids),
+        'staff_id': lines['Staff Name'].map(staff_ids),
+        'gross_sales': _money(lines['Gross Sales']),
+        'discount_amount': _money(lines['Discount Amount']),
+        'refund_amount': _money(lines['Refunds']),
+        'net_sales': _money(lines['Net Sales']),
+        'sales_tax': _money(lines['Sales Tax']),
+        'service_category': categorize_services(item_names),
+        'is_new_patient': (lines['Service Name'] == NEW_PATIENT_SERVICE),
+    })
+    return clients, staff, transactions
 
 def process_sales_data(csv_path, db_url):
     # Create database engine and tables
@@ -26,69 +91,16 @@ def process_sales_data(csv_path, db_url):
     
     # Read CSV file
     df = pd.read_csv(csv_path)
+    clients, staff, transactions = build_records(df)
     
-    # Process clients
-    clients = {}
-    for _, row in df.iterrows():
-        if pd.notna(row['Client Name']) and row['Client Name'] not in clients:
-            client_id = str(uuid.uuid4())
-            clients[row['Client Name']] = {
-                'id': client_id,
-                'name': row['Client Name'],
-                'first_visit_date': row['Sale Date'],
-                'last_visit_date': row['Sale Date'],
-                'total_visits': 1
-            }
-        elif pd.notna(row['Client Name']):
-            clients[row['Client Name']]['total_visits'] += 1
-            if row['Sale Date'] > clients[row['Client Name']]['last_visit_date']:
-                clients[row['Client Name']]['last_visit_date'] = row['Sale Date']
-    
-    # Process staff
-    staff = {}
-    for _, row in df.iterrows():
-        if pd.notna(row['Staff Name']) and row['Staff Name'] not in staff:
-            staff_id = str(uuid.uuid4())
-            staff[row['Staff Name']] = {
-                'id': staff_id,
-                'name': row['Staff Name'],
-                'role': 'provider'  # Default role
-            }
-    
-    # Process transactions
-    transactions = []
-    for _, row in df.iterrows():
-        if pd.notna(row['Sale id']) and row['Sale id'] != 'All':
-            service_category = categorize_service(row['Service Name'] if pd.notna(row['Service Name']) else row['Product Name'] if pd.notna(row['Product Name']) else '')
-            
-            transaction = {
-                'id': row['Sale id'],
-                'date': datetime.strptime(row['Sale Date'], '%m/%d/%Y'),
-                'location_name': row['Location Name'],
-                'client_id': clients[row['Client Name']]['id'] if pd.notna(row['Client Name']) else None,
-                'staff_id': staff[row['Staff Name']]['id'] if pd.notna(row['Staff Name']) else None,
-                'gross_sales': float(row['Gross Sales']) if pd.notna(row['Gross Sales']) else 0,
-                'discount_amount': float(row['Discount Amount']) if pd.notna(row['Discount Amount']) else 0,
-                'refund_amount': float(row['Refunds']) if pd.notna(row['Refunds']) else 0,
-                'net_sales': float(row['Net Sales']) if pd.notna(row['Net Sales']) else 0,
-                'sales_tax': float(row['Sales Tax']) if pd.notna(row['Sales Tax']) else 0,
-                'service_category': service_category,
-                'is_new_patient': row['Service Name'] == 'NEW PATIENT BOTOX/DYSPORT' if pd.notna(row['Service Name']) else False
-            }
-            transactions.append(transaction)
-    
-    # Insert data into database
-    with engine.connect() as conn:
-        # Insert clients
-        conn.execute(Client.__table__.insert(), [client for client in clients.values()])
-        
-        # Insert staff
-        conn.execute(Staff.__table__.insert(), [s for s in staff.values()])
-        
-        # Insert transactions
-        conn.execute(Transaction.__table__.insert(), transactions)
-        
-        conn.commit()
+    # Bulk insert (one executemany per table) in a single transaction
+    with engine.begin() as conn:
+        if len(clients):
+            conn.execute(Client.__table__.insert(), _records(clients))
+        if len(staff):
+            conn.execute(Staff.__table__.insert(), _records(staff))
+        if len(transactions):
+            conn.execute(Transaction.__table__.insert(), _records(transactions))
 
 def process_appointments(csv_path, db_url):
     """
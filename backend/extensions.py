@@ -1,4 +1,5 @@
 from flask_caching import Cache
 
-# Initialize the cache object here with disabled caching
-cache = Cache(config={'CACHE_TYPE': 'null'})  # Disable caching temporarily to ensure we're not using stale queries 
\ No newline at end of file
+# Configured only from app.config by cache.init_app(app) (see the caching section of app.py);
+# a config passed here would override app.config
+cache = Cache()
@@ -0,0 +1,343 @@
+"""Registry of fitted forecast models.
+
+Fitting a model (Prophet especially) costs far more than predicting from one,
+so the forecast endpoint no longer fits a model per request. Models are keyed
+by scope (the set of locations), history window and forecaster (see
+forecasters.py), and remember a fingerprint of the daily series they were
+fitted on:
+
+- same fingerprint: cached predictions are served; the future horizon is only
+  extended (one predict call, no refit) when a longer one is requested
+- new data (fingerprint changed): the previous predictions keep being served
+  while the model is retrained on a background worker
+- no model yet: the first request fits synchronously
+
+Fitted models are also serialized to disk, so a restarted worker picks them up
+without refitting.
+"""
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from forecasters import get_forecaster
+
+# Background retraining threads (Prophet fits are CPU-bound; keep this small)
+FORECAST_TRAINING_WORKERS = int(os.getenv('FORECAST_TRAINING_WORKERS', '1'))
+# Fitted models kept in memory
+FORECAST_MODEL_CACHE_SIZE = int(os.getenv('FORECAST_MODEL_CACHE_SIZE', '32'))
+# Processes used to fit several models at once (per-location forecasts)
+FORECAST_PROCESS_WORKERS = int(os.getenv('FORECAST_PROCESS_WORKERS', str(os.cpu_count() or 1)))
+
+def fingerprint(df):
+    """Stable hash of a ds/y frame; changes whenever the training data does."""
+    digest = hashlib.sha1()
+    digest.update(pd.to_datetime(df['ds']).dt.strftime('%Y-%m-%d').str.cat(sep=',').encode())
+    digest.update(df['y'].round(2).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _fit_serialized(model_name, df):
+    """Process-pool entry point: fits a model and ships it back serialized."""
+    forecaster = get_forecaster(model_name)
+    return forecaster.dumps(forecaster.fit(df))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool():
+    """The shared fitting pool, started on first use.
+
+    Workers are spawned rather than forked: a gunicorn worker runs several
+    threads (location refresh, import jobs, background training) and holds
+    SQLite connections, and forking it can deadlock the child.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=FORECAST_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+            atexit.register(_process_pool.shutdown, wait=False, cancel_futures=True)
+        return _process_pool
+
+def fit_in_processes(model_name, frames, processes=None):
+    """Fits one model per {key: ds/y frame} concurrently; returns {key: model}.
+
+    Prophet/Stan and SARIMAX fitting is CPU-bound, so those models are fitted
+    on a process pool shared by all requests (at most FORECAST_PROCESS_WORKERS
+    processes) rather than on threads. The NumPy forecasters fit in
+    milliseconds and are fitted inline.
+    """
+    forecaster = get_forecaster(model_name)
+    processes = min(processes or FORECAST_PROCESS_WORKERS, FORECAST_PROCESS_WORKERS, len(frames))
+    if processes <= 1 or not forecaster.parallel:
+        return {key: forecaster.fit(df) for key, df in frames.items()}
+    pool = _get_process_pool()
+    futures = {key: pool.submit(_fit_serialized, model_name, df) for key, df in frames.items()}
+    return {key: forecaster.loads(future.result()) for key, future in futures.items()}
+
+class _Entry:
+    __slots__ = ('fingerprint', 'model_name', 'model', 'predictions', 'horizon', 'trained_at')
+
+    def __init__(self, fingerprint, model_name, model):
+        self.fingerprint = fingerprint
+        self.model_name = model_name
+        self.model = model
+        self.predictions = None
+        self.horizon = 0
+        self.trained_at = time.time()
+
+class ForecastModelRegistry:
+    """Thread-safe cache of fitted models with background retraining."""
+
+    def __init__(self, max_workers=FORECAST_TRAINING_WORKERS, maxsize=FORECAST_MODEL_CACHE_SIZE):
+        self._max_workers = max_workers
+        self._maxsize = maxsize
+        self._model_dir = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._training = set()
+        self._executor = None
+
+    def configure(self, model_dir):
+        """Sets the directory fitted models are serialized to."""
+        os.makedirs(model_dir, exist_ok=True)
+        self._model_dir = model_dir
+
+    @staticmethod
+    def make_key(location_ids, history_days, model_name):
+        return (tuple(sorted(location_ids)), int(history_days), get_forecaster(model_name).name)
+
+    # --- Serving ---
+
+    def forecast(self, key, df, periods):
+        """Returns (predictions, status) for the ds/y frame, extending the horizon as needed.
+
+        predictions has ds, yhat, yhat_lower, yhat_upper for the history plus
+        `periods` future days. status is 'cached', 'stale' (served from the
+        previous model while a retrain runs) or 'trained'.
+        """
+        data_fingerprint = fingerprint(df)
+        entry = self._get(key)
+        status = 'cached'
+        if entry is None:
+            entry = self._train(key, df, data_fingerprint)
+            status = 'trained'
+        elif entry.fingerprint != data_fingerprint:
+            self._train_in_background(key, df, data_fingerprint)
+            status = 'stale'
+
+        return self._predictions(entry, periods), status
+
+    def forecast_many(self, frames, periods, processes=None):
+        """forecast() for several {key: ds/y frame} at once; returns {key: (predictions, status)}.
+
+        Models that have to be fitted inline are fitted concurrently on a
+        process pool instead of one after another.
+        """
+        fingerprints = {key: fingerprint(df) for key, df in frames.items()}
+        entries = {}
+        statuses = {}
+        to_fit = {}
+        for key, df in frames.items():
+            entry = self._get(key)
+            if entry is None:
+                to_fit[key] = df
+                continue
+            entries[key] = entry
+            statuses[key] = 'cached'
+            if entry.fingerprint != fingerprints[key]:
+                self._train_in_background(key, df, fingerprints[key])
+                statuses[key] = 'stale'
+
+        # Group by forecaster so each group can share one process pool
+        by_model = {}
+        for key, df in to_fit.items():
+            by_model.setdefault(key[2], {})[key] = df
+        for model_name, model_frames in by_model.items():
+            for key, model in fit_in_processes(model_name, model_frames, processes).items():
+                entries[key] = self._store(key, _Entry(fingerprints[key], key[2], model))
+                statuses[key] = 'trained'
+
+        return {key: (self._predictions(entries[key], periods), statuses[key]) for key in frames}
+
+    def _predictions(self, entry, periods):
+        with self._lock:
+            if entry.predictions is not None and entry.horizon >= periods:
+                return entry.predictions.iloc[:len(entry.predictions) - (entry.horizon - periods)]
+        # Only the horizon grew: one predict call on the fitted model, no refit
+        predictions = get_forecaster(entry.model_name).predict(entry.model, periods)
+        with self._lock:
+            if periods > entry.horizon:
+                entry.predictions = predictions
+                entry.horizon = periods
+        return predictions
+
+    # --- Training ---
+
+    def _train(self, key, df, data_fingerprint):
+        model = get_forecaster(key[2]).fit(df)
+        return self._store(key, _Entry(data_fingerprint, key[2], model))
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self._maxsize:
+                self._entries.pop(next(iter(self._entries)))
+        self._save(key, entry)
+        return entry
+
+    def _train_in_background(self, key, df, data_fingerprint):
+        with self._lock:
+            if (key, data_fingerprint) in self._training:
+                return
+            self._training.add((key, data_fingerprint))
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='forecast-train')
+
+        def _run():
+            try:
+                self._train(key, df.copy(), data_fingerprint)
+            except Exception as e:
+                print(f"[Forecast] Background training failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._training.discard((key, data_fingerprint))
+
+        self._executor.submit(_run)
+
+    def invalidate(self, key=None):
+        """Drops one cached model (or all) from memory and disk."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if not self._model_dir:
+            return
+        if key is None:
+            paths = [os.path.join(self._model_dir, name) for name in os.listdir(self._model_dir) if name.endswith('.json')]
+        else:
+            paths = [self._path(key)]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": len(self._entries),
+                "training": len(self._training),
+                "entries": [
+                    {"locations": list(k[0]), "history_days": k[1], "model": k[2], "horizon": e.horizon, "trained_at": e.trained_at}
+                    for k, e in self._entries.items()
+                ],
+            }
+
+    # --- Persistence ---
+
+    def _path(self, key):
+        if not self._model_dir:
+            return None
+        name = hashlib.sha1(json.dumps([list(key[0]), key[1], key[2]]).encode()).hexdigest()
+        return os.path.join(self._model_dir, f"{name}.json")
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = self._entries.pop(key) # Mark most recently used
+                return entry
+        entry = self._load(key)
+        if entry is not None:
+            with self._lock:
+                self._entries.setdefault(key, entry)
+        return entry
+
+    def _save(self, key, entry):
+        path = self._path(key)
+        if not path:
+            return
+        try:
+            payload = {
+                "fingerprint": entry.fingerprint,
+                "model_name": entry.model_name,
+                "trained_at": entry.trained_at,
+                "model": get_forecaster(entry.model_name).dumps(entry.model),
+            }
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[Forecast] Could not save model for {key}: {e}")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                payload = json.load(f)
+            entry = _Entry(payload["fingerprint"], key[2], get_forecaster(key[2]).loads(payload["model"]))
+            entry.trained_at = payload.get("trained_at", entry.trained_at)
+            return entry
+        except Exception as e:
+            print(f"[Forecast] Could not load model for {key}: {e}")
+            return None
+
+registry = ForecastModelRegistry()
+
+# --- Reconciliation ---
+
+_FORECAST_COLUMNS = ['yhat', 'yhat_lower', 'yhat_upper']
+
+def reconcile(total, parts):
+    """OLS-reconciles a total forecast with its per-location parts so the parts sum to the total.
+
+    total: predictions frame (ds, yhat, yhat_lower, yhat_upper) of the aggregate model
+    parts: {name: predictions frame} of the per-location models
+
+    For a two-level hierarchy (total = sum of n parts) the OLS reconciled
+    parts are b_i + (total - sum(b)) / (n + 1), and the reconciled total is
+    their sum. Intervals are shifted by the same adjustment. Dates a part has
+    no prediction for (before its history starts) count as zero.
+
+    Returns (reconciled_total, {name: reconciled_part}).
+    """
+    dates = pd.Index(pd.to_datetime(total['ds']))
+    for frame in parts.values():
+        dates = dates.union(pd.to_datetime(frame['ds']))
+
+    def align(frame):
+        return frame.assign(ds=pd.to_datetime(frame['ds'])).set_index('ds')[_FORECAST_COLUMNS].reindex(dates)
+
+    total_aligned = align(total)
+    part_aligned = {name: align(frame) for name, frame in parts.items()}
+    present = {name: frame['yhat'].notna() for name, frame in part_aligned.items()}
+    part_count = sum((mask.astype(int) for mask in present.values()), pd.Series(0, index=dates))
+    bottom_up = sum((frame['yhat'].fillna(0.0) for frame in part_aligned.values()), pd.Series(0.0, index=dates))
+    # Where the aggregate model has no prediction, fall back to the bottom-up sum
+    total_yhat = total_aligned['yhat'].fillna(bottom_up)
+    adjustment = (total_yhat - bottom_up) / (part_count + 1)
+
+    reconciled_parts = {}
+    for name, frame in part_aligned.items():
+        part_adjustment = adjustment.where(present[name], 0.0)
+        reconciled_parts[name] = frame.fillna(0.0).add(part_adjustment, axis=0).rename_axis('ds').reset_index()
+
+    reconciled_yhat = bottom_up + adjustment * part_count
+    shift = reconciled_yhat - total_yhat
+    reconciled_total = pd.DataFrame({
+        'yhat': reconciled_yhat,
+        'yhat_lower': total_aligned['yhat_lower'].fillna(total_yhat) + shift,
+        'yhat_upper': total_aligned['yhat_upper'].fillna(total_yhat) + shift,
+    }, index=dates).rename_axis('ds').reset_index()
+    return reconciled_total, reconciled_parts
@@ -0,0 +1,284 @@
+"""Pluggable daily sales forecasters.
+
+Every forecaster fits a ds/y frame of daily sales and predicts the history
+plus `periods` future days as a frame of ds, yhat, yhat_lower, yhat_upper:
+
+    ets             additive Holt-Winters (damped trend, weekly seasonality);
+                    the smoothing parameters are chosen by running the
+                    recursion for a whole parameter grid at once in NumPy
+    seasonal_naive  each future day repeats the same weekday of the last week
+    prophet         Facebook Prophet (imported on first use; seconds per fit)
+    sarimax         statsmodels SARIMAX(1,0,1)x(1,0,1,7) (imported on first use)
+
+The NumPy engines fit in milliseconds and are meant for interactive requests;
+Prophet and SARIMAX are better suited to scheduled `flask train-forecasts`
+runs. backtest() compares accuracy against fit time.
+"""
+import abc
+import base64
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+# Model used when a request does not name one
+FORECAST_DEFAULT_MODEL = os.getenv('FORECAST_DEFAULT_MODEL', 'ets')
+
+_SEASON = 7 # Weekly seasonality of daily sales
+_Z_95 = 1.96
+
+def _regular_series(df):
+    """Returns (dates, values) with every day between the first and last present (missing days are 0)."""
+    series = pd.Series(df['y'].to_numpy(dtype=float), index=pd.to_datetime(df['ds'])).groupby(level=0).sum()
+    series = series.asfreq('D', fill_value=0.0)
+    return series.index, series.to_numpy(dtype=float)
+
+def _frame(dates, yhat, lower, upper):
+    return pd.DataFrame({'ds': dates, 'yhat': yhat, 'yhat_lower': lower, 'yhat_upper': upper})
+
+def _future_dates(last_date, periods):
+    return pd.date_range(pd.Timestamp(last_date) + pd.Timedelta(days=1), periods=periods, freq='D')
+
+class Forecaster(abc.ABC):
+    """Interface: fit(df) -> model, predict(model, periods) -> frame, dumps/loads for the registry."""
+
+    name = None
+    # Fits are CPU-heavy enough to be worth a process pool when several run together
+    parallel = False
+
+    @abc.abstractmethod
+    def fit(self, df):
+        """Fits a ds/y frame; returns the model (JSON-serializable unless dumps/loads are overridden)."""
+
+    @abc.abstractmethod
+    def predict(self, model, periods):
+        """Returns ds, yhat, yhat_lower, yhat_upper for the history plus `periods` future days."""
+
+    def dumps(self, model):
+        return json.dumps(model)
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+class SeasonalNaiveForecaster(Forecaster):
+    name = 'seasonal_naive'
+
+    def fit(self, df):
+        dates, y = _regular_series(df)
+        season = min(_SEASON, len(y))
+        fitted = np.concatenate([np.full(season, np.nan), y[:-season]]) if len(y) > season else np.full(len(y), np.nan)
+        residuals = (y - fitted)[~np.isnan(fitted)]
+        return {
+            "start": dates[0].strftime('%Y-%m-%d'),
+            "y": y.tolist(),
+            "fitted": [None if np.isnan(v) else float(v) for v in fitted],
+            "sigma": float(residuals.std()) if len(residuals) > 1 else float(y.std()),
+            "season": season,
+        }
+
+    def predict(self, model, periods):
+        y = np.asarray(model["y"], dtype=float)
+        season = model["season"]
+        dates = pd.date_range(model["start"], periods=len(y), freq='D')
+        fitted = np.array([np.nan if v is None else v for v in model["fitted"]], dtype=float)
+        fitted = np.where(np.isnan(fitted), y, fitted)
+
+        steps = np.arange(periods)
+        future = y[len(y) - season + steps % season]
+        # Each further week repeats an older observation, widening the interval
+        spread = _Z_95 * model["sigma"] * np.sqrt(steps // season + 1)
+
+        all_dates = dates.append(_future_dates(dates[-1], periods))
+        yhat = np.concatenate([fitted, future])
+        band = np.concatenate([np.full(len(y), _Z_95 * model["sigma"]), spread])
+        return _frame(all_dates, yhat, yhat - band, yhat + band)
+
+class HoltWintersForecaster(Forecaster):
+    """Additive Holt-Winters with a damped trend, fitted by a vectorized grid search."""
+
+    name = 'ets'
+    PHI = 0.98
+    ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7)
+    BETAS = (0.0, 0.01, 0.05, 0.1)
+    GAMMAS = (0.0, 0.05, 0.1, 0.3)
+
+    def fit(self, df):
+        dates, y = _regular_series(df)
+        n = len(y)
+        m = _SEASON if n >= 2 * _SEASON else 1
+
+        # Initial states from the first one/two seasons
+        level0 = y[:m].mean()
+        trend0 = (y[m:2 * m].mean() - level0) / m if n >= 2 * m and m > 1 else 0.0
+        season0 = y[:m] - level0 if m > 1 else np.zeros(1)
+
+        alpha, beta, gamma = (g.ravel() for g in np.meshgrid(self.ALPHAS, self.BETAS, self.GAMMAS, indexing='ij'))
+        if m == 1:
+            gamma = np.zeros_like(gamma)
+        grid = len(alpha)
+        phi = self.PHI
+
+        # Run the recursion for every parameter combination at once
+        level = np.full(grid, level0)
+        trend = np.full(grid, trend0)
+        seasonal = np.tile(season0, (grid, 1))
+        fitted = np.empty((grid, n))
+        for t in range(n):
+            s = seasonal[:, t % m]
+            forecast = level + phi * trend + s
+            fitted[:, t] = forecast
+            error = y[t] - forecast
+            new_level = level + phi * trend + alpha * error
+            trend = phi * trend + alpha * beta * error
+            seasonal[:, t % m] = s + gamma * error
+            level = new_level
+
+        sse = ((y - fitted) ** 2).sum(axis=1)
+        best = int(np.argmin(sse))
+        residuals = y - fitted[best]
+        return {
+            "start": dates[0].strftime('%Y-%m-%d'),
+            "n": n,
+            "m": m,
+            "alpha": float(alpha[best]),
+            "beta": float(beta[best]),
+            "gamma": float(gamma[best]),
+            "phi": phi,
+            "level": float(level[best]),
+            "trend": float(trend[best]),
+            "seasonal": seasonal[best].tolist(),
+            "fitted": fitted[best].tolist(),
+            "sigma": float(residuals.std()) if n > 1 else 0.0,
+        }
+
+    def predict(self, model, periods):
+        n, m, phi = model["n"], model["m"], model["phi"]
+        dates = pd.date_range(model["start"], periods=n, freq='D')
+        steps = np.arange(1, periods + 1)
+        damped = np.cumsum(phi ** steps) # phi + phi^2 + ... + phi^h
+        seasonal = np.asarray(model["seasonal"], dtype=float)
+        future = model["level"] + damped * model["trend"] + seasonal[(n + steps - 1) % m]
+        # Approximate h-step variance of additive ETS: sigma^2 * (1 + (h - 1) * alpha^2)
+        spread = _Z_95 * model["sigma"] * np.sqrt(1 + (steps - 1) * model["alpha"] ** 2)
+
+        fitted = np.asarray(model["fitted"], dtype=float)
+        all_dates = dates.append(_future_dates(dates[-1], periods))
+        yhat = np.concatenate([fitted, future])
+        band = np.concatenate([np.full(n, _Z_95 * model["sigma"]), spread])
+        return _frame(all_dates, yhat, yhat - band, yhat + band)
+
+class ProphetForecaster(Forecaster):
+    name = 'prophet'
+    parallel = True
+
+    def fit(self, df):
+        from prophet import Prophet
+        model = Prophet() # Default settings are often quite good
+        model.fit(df)
+        return model
+
+    def predict(self, model, periods):
+        future = model.make_future_dataframe(periods=periods)
+        return model.predict(future)[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+
+    def dumps(self, model):
+        from prophet.serialize import model_to_json
+        return model_to_json(model)
+
+    def loads(self, payload):
+        from prophet.serialize import model_from_json
+        return model_from_json(payload)
+
+class SarimaxForecaster(Forecaster):
+    name = 'sarimax'
+    parallel = True
+
+    def fit(self, df):
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+        dates, y = _regular_series(df)
+        seasonal_order = (1, 0, 1, _SEASON) if len(y) >= 2 * _SEASON else (0, 0, 0, 0)
+        results = SARIMAX(y, order=(1, 0, 1), seasonal_order=seasonal_order).fit(disp=False)
+        return {"start": dates[0].strftime('%Y-%m-%d'), "results": results}
+
+    def predict(self, model, periods):
+        results = model["results"]
+        n = results.nobs
+        summary = results.get_prediction(start=0, end=int(n) + periods - 1).summary_frame(alpha=0.05)
+        dates = pd.date_range(model["start"], periods=len(summary), freq='D')
+        return _frame(dates, summary['mean'].to_numpy(), summary['mean_ci_lower'].to_numpy(), summary['mean_ci_upper'].to_numpy())
+
+    def dumps(self, model):
+        return base64.b64encode(pickle.dumps(model)).decode('ascii')
+
+    def loads(self, payload):
+        return pickle.loads(base64.b64decode(payload))
+
+FORECASTERS = {
+    forecaster.name: forecaster
+    for forecaster in (HoltWintersForecaster(), SeasonalNaiveForecaster(), ProphetForecaster(), SarimaxForecaster())
+}
+
+def get_forecaster(name=None):
+    """Returns the forecaster for a model name (default FORECAST_DEFAULT_MODEL); ValueError if unknown."""
+    name = name or FORECAST_DEFAULT_MODEL
+    forecaster = FORECASTERS.get(name)
+    if forecaster is None:
+        raise ValueError(f"Unknown forecast model '{name}'. Must be one of: {', '.join(FORECASTERS)}")
+    return forecaster
+
+# --- Backtesting ---
+
+def backtest(df, model_names=None, horizon=14, folds=3):
+    """Rolling-origin backtest of each model on a ds/y frame.
+
+    The last `folds` windows of `horizon` days are each forecast from the
+    history before them. Returns one row per model with MAE, RMSE, sMAPE (%)
+    and the mean fit time in seconds, sorted by MAE; models that fail report
+    the error instead.
+    """
+    model_names = list(model_names or FORECASTERS)
+    dates, y = _regular_series(df)
+    history = pd.DataFrame({'ds': dates, 'y': y})
+    min_train = 2 * _SEASON
+    origins = [len(y) - horizon * (fold + 1) for fold in range(folds)]
+    origins = sorted(origin for origin in origins if origin >= min_train)
+    if not origins:
+        raise ValueError(f"Need at least {min_train + horizon} days of history to backtest a {horizon}-day horizon.")
+
+    results = []
+    for name in model_names:
+        forecaster = get_forecaster(name)
+        errors = []
+        fit_seconds = []
+        try:
+            for origin in origins:
+                train = history.iloc[:origin]
+                actual = y[origin:origin + horizon]
+                started = time.perf_counter()
+                model = forecaster.fit(train)
+                fit_seconds.append(time.perf_counter() - started)
+                predicted = forecaster.predict(model, horizon)['yhat'].to_numpy()[-horizon:][:len(actual)]
+                errors.append((actual, predicted))
+        except Exception as e:
+            results.append({"model": name, "error": str(e)})
+            continue
+
+        actual = np.concatenate([a for a, _ in errors])
+        predicted = np.concatenate([p for _, p in errors])
+        diff = predicted - actual
+        denominator = np.abs(actual) + np.abs(predicted)
+        smape = np.where(denominator > 0, 2 * np.abs(diff) / np.where(denominator > 0, denominator, 1), 0.0)
+        results.append({
+            "model": name,
+            "mae": round(float(np.abs(diff).mean()), 2),
+            "rmse": round(float(np.sqrt((diff ** 2).mean())), 2),
+            "smape": round(float(smape.mean() * 100), 2),
+            "fit_seconds": round(float(np.mean(fit_seconds)), 4),
+            "folds": len(origins),
+        })
+
+    results.sort(key=lambda row: row.get("mae", float('inf')))
+    return results
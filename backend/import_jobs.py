@@ -0,0 +1,326 @@
+"""Background import jobs for uploaded transaction CSVs.
+
+The upload request only streams the file to disk and records a job; a
+background thread then imports it in bounded-memory chunks (IMPORT_CHUNK_ROWS
+rows at a time, see transaction_import) in two passes:
+
+    validating  every chunk is validated and mapped; row errors are stored in
+                import_job_errors and progress is committed after each chunk
+    importing   only if no row failed, inside one database transaction (readers
+                see either the old data or the complete import):
+                replace  the existing transactions are replaced chunk by chunk
+                upsert   new and changed rows are written chunk by chunk and
+                         only the rollup days they touch are rebuilt
+
+Progress, counts and errors are kept in import_jobs, so any worker can serve
+GET /api/v1/data/upload/jobs/<id>. rows_imported is written after every chunk
+of the importing pass too, but inside its transaction, so until the commit
+only the worker running the job reports it (get_job overlays its live count).
+
+The runner holds an advisory lock on a job's spooled file from submit until
+the job ends; on startup configure() fails the unfinished jobs whose file is
+no longer locked (their worker died or restarted) and deletes the file.
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError: # Windows development server: one process runs every job
+    fcntl = None
+
+import transaction_import
+
+# Rows read, validated and inserted at a time
+IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', '50000'))
+# Imports run one at a time by default (each one holds the write lock while importing)
+IMPORT_JOB_WORKERS = int(os.getenv('IMPORT_JOB_WORKERS', '1'))
+# Row errors stored per job (all of them are counted)
+IMPORT_MAX_STORED_ERRORS = int(os.getenv('IMPORT_MAX_STORED_ERRORS', '1000'))
+
+STATUS_QUEUED = 'queued'
+STATUS_VALIDATING = 'validating'
+STATUS_IMPORTING = 'importing'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED)
+
+def get_job(db, job_id, error_limit=100):
+    """Returns the job as a dict with its first `error_limit` row errors, or None."""
+    row = db.execute('SELECT * FROM import_jobs WHERE job_id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    errors = db.execute(
+        'SELECT row_number, message FROM import_job_errors WHERE job_id = ? ORDER BY row_number LIMIT ?',
+        (job_id, error_limit)
+    ).fetchall()
+    job['errors'] = [{"row": error['row_number'], "message": error['message']} for error in errors]
+    job['finished'] = job['status'] in FINISHED_STATUSES
+    if job['status'] == STATUS_IMPORTING:
+        job['rows_imported'] = max(job['rows_imported'], runner.rows_imported(job_id))
+    return job
+
+class ImportJobRunner:
+    """Queues uploaded files and imports them on background threads."""
+
+    def __init__(self, max_workers=IMPORT_JOB_WORKERS, chunk_rows=IMPORT_CHUNK_ROWS):
+        self._max_workers = max_workers
+        self._chunk_rows = chunk_rows
+        self._db_path = None
+        self._upload_dir = None
+        self._before_commit = None
+        self._after_commit = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._held = {} # job_id -> open (locked) spooled file
+        self._rows_imported = {} # job_id -> rows written so far by the importing pass
+
+    def configure(self, db_path, upload_dir, before_commit=None, after_commit=None):
+        """Sets the database, the directory uploads are spooled to and the import hooks.
+
+        before_commit(db, days) runs inside the import transaction after the
+        rows are written (e.g. to refresh rollups); days is the set of
+        'YYYY-MM-DD' days an upsert touched, or None after a full replace. It
+        returns True if it also re-derived data beyond those days (e.g.
+        re-costed every rollup).
+        after_commit(days, locations, rebuilt_all) runs once the import is
+        committed (e.g. to invalidate caches), unless an upsert changed
+        nothing; days and locations are sets after an upsert and None after
+        a full replace, rebuilt_all is what before_commit returned.
+
+        Unfinished jobs no live runner holds are marked failed (see _recover).
+        """
+        os.makedirs(upload_dir, exist_ok=True)
+        self._db_path = db_path
+        self._upload_dir = upload_dir
+        self._before_commit = before_commit
+        self._after_commit = after_commit
+        self._recover()
+
+    def rows_imported(self, job_id):
+        """Rows this process has written for a job that is importing (0 if it runs elsewhere)."""
+        return self._rows_imported.get(job_id, 0)
+
+    def _spool_path(self, job_id):
+        return os.path.join(self._upload_dir, f"import_{job_id}.csv")
+
+    def submit(self, db, file, filename, mode=transaction_import.MODE_REPLACE):
+        """Streams an uploaded file (werkzeug FileStorage) to disk and queues its import; returns the job id."""
+        if mode not in transaction_import.IMPORT_MODES:
+            raise ValueError(f"Invalid import mode '{mode}'. Must be one of: {', '.join(transaction_import.IMPORT_MODES)}")
+        cursor = db.execute(
+            'INSERT INTO import_jobs (filename, status, mode) VALUES (?, ?, ?)', (filename, STATUS_QUEUED, mode)
+        )
+        job_id = cursor.lastrowid
+        path = self._spool_path(job_id)
+        file.save(path) # Copied in buffered blocks, never read into memory whole
+        self._hold(job_id, path) # Before the job is committed, so no other worker sees it unlocked
+        db.execute('UPDATE import_jobs SET file_bytes = ? WHERE job_id = ?', (os.path.getsize(path), job_id))
+        db.commit()
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='import-job')
+        self._executor.submit(self._run, job_id, path)
+        return job_id
+
+    # --- Ownership ---
+
+    def _hold(self, job_id, path):
+        """Locks a job's spooled file for as long as this process owns the job (the OS drops it if we die)."""
+        handle = open(path, 'rb')
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._held[job_id] = handle
+
+    def _release(self, job_id):
+        handle = self._held.pop(job_id, None)
+        if handle is not None:
+            handle.close() # Also drops the lock
+
+    @staticmethod
+    def _is_held(path):
+        """True if some runner still holds the spooled file."""
+        if fcntl is None or not os.path.exists(path):
+            return False
+        with open(path, 'rb') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        return False
+
+    def _recover(self):
+        """Fails the queued/validating/importing jobs no live runner holds and deletes their spooled files.
+
+        Such a job's worker died or restarted, so it will never finish; its
+        import transaction was rolled back, so no data was changed.
+        """
+        db = self._connect()
+        try:
+            placeholders = ', '.join('?' for _ in FINISHED_STATUSES)
+            job_ids = [
+                row[0] for row in
+                db.execute(f'SELECT job_id FROM import_jobs WHERE status NOT IN ({placeholders})', FINISHED_STATUSES)
+            ]
+            for job_id in job_ids:
+                path = self._spool_path(job_id)
+                if job_id in self._held or self._is_held(path):
+                    continue
+                self._finish(
+                    db, job_id, STATUS_FAILED,
+                    "Processing was interrupted because the server restarted. No data was changed; please upload the file again."
+                )
+                if os.path.exists(path):
+                    os.remove(path)
+                print(f"[Import] Job {job_id} was interrupted; marked as failed")
+        except sqlite3.Error as e:
+            print(f"[Import] Could not check for interrupted jobs: {e}")
+        finally:
+            db.close()
+
+    # --- Running ---
+
+    def _connect(self):
+        db = sqlite3.connect(self._db_path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _chunks(self, path):
+        return pd.read_csv(path, chunksize=self._chunk_rows)
+
+    def _run(self, job_id, path):
+        db = self._connect()
+        try:
+            db.execute(
+                'UPDATE import_jobs SET status = ?, started_at = CURRENT_TIMESTAMP WHERE job_id = ?',
+                (STATUS_VALIDATING, job_id)
+            )
+            db.commit()
+            mode = db.execute('SELECT mode FROM import_jobs WHERE job_id = ?', (job_id,)).fetchone()[0]
+            if self._validate(db, job_id, path, mode):
+                if mode == transaction_import.MODE_UPSERT:
+                    days, locations, rebuilt_all = self._upsert(db, job_id, path)
+                    changed = bool(days)
+                else:
+                    days, locations, rebuilt_all = self._replace(db, job_id, path)
+                    changed = True
+                if changed and self._after_commit:
+                    self._after_commit(days, locations, rebuilt_all)
+        except Exception as e:
+            db.rollback()
+            print(f"[Import] Job {job_id} failed: {e}")
+            self._finish(db, job_id, STATUS_FAILED, f"An unexpected error occurred during processing: {e}")
+        finally:
+            db.close()
+            self._rows_imported.pop(job_id, None)
+            if os.path.exists(path):
+                os.remove(path)
+            self._release(job_id)
+
+    def _validate(self, db, job_id, path, mode):
+        """First pass: validates every chunk and records row errors. Returns True if the file is clean."""
+        header = pd.read_csv(path, nrows=0).columns
+        missing = transaction_import.missing_columns(header, mode)
+        if missing:
+            self._finish(db, job_id, STATUS_FAILED, f"Processing failed: Missing required columns: {', '.join(missing)}")
+            return False
+
+        lookups = transaction_import.Lookups(db)
+        validated = 0
+        error_count = 0
+        for chunk in self._chunks(path):
+            _, errors = transaction_import.prepare(chunk, lookups, transaction_import.FIRST_DATA_ROW + validated, seen={}, mode=mode)
+            stored = max(0, min(len(errors), IMPORT_MAX_STORED_ERRORS - error_count))
+            db.executemany(
+                'INSERT INTO import_job_errors (job_id, row_number, message) VALUES (?, ?, ?)',
+                [(job_id, row_number, message) for row_number, message in errors[:stored]]
+            )
+            validated += len(chunk)
+            error_count += len(errors)
+            self._update(db, job_id, rows_validated=validated, error_count=error_count)
+            db.commit()
+        print(f"[Import] Job {job_id}: validated {validated} rows, {error_count} errors")
+
+        if error_count:
+            self._finish(db, job_id, STATUS_FAILED, f"Processing failed due to {error_count} errors. No data was changed.")
+            return False
+        return True
+
+    def _replace(self, db, job_id, path):
+        """Second pass (replace): swaps the transaction data for the file in one database transaction.
+
+        Returns (None, None, rebuilt_all): every day and location may have changed.
+        """
+        self._update(db, job_id, status=STATUS_IMPORTING)
+        db.commit()
+
+        lookups = transaction_import.Lookups(db)
+        seen = {}
+        db.execute('DELETE FROM transaction_items')
+        db.execute('DELETE FROM transactions')
+        read = 0
+        imported = 0
+        for chunk in self._chunks(path):
+            rows, _ = transaction_import.prepare(chunk, lookups, transaction_import.FIRST_DATA_ROW + read, seen)
+            imported += transaction_import.insert(db, rows)
+            read += len(chunk)
+            self._progress(db, job_id, imported)
+        rebuilt_all = bool(self._before_commit(db, None)) if self._before_commit else False
+        self._update(db, job_id, rows_imported=imported)
+        self._finish(db, job_id, STATUS_SUCCEEDED, f"Successfully processed file. Inserted {imported} transactions and {imported} items.")
+        print(f"[Import] Job {job_id}: imported {imported} rows")
+        return None, None, rebuilt_all
+
+    def _upsert(self, db, job_id, path):
+        """Second pass (upsert): writes only new and changed rows; returns the (days, locations, rebuilt_all) it changed."""
+        self._update(db, job_id, status=STATUS_IMPORTING)
+        db.commit()
+
+        lookups = transaction_import.Lookups(db)
+        seen = {}
+        read = inserted = updated = unchanged = 0
+        days = set()
+        locations = set()
+        for chunk in self._chunks(path):
+            rows, _ = transaction_import.prepare(chunk, lookups, transaction_import.FIRST_DATA_ROW + read, seen, transaction_import.MODE_UPSERT)
+            chunk_inserted, chunk_updated, chunk_unchanged, chunk_days, chunk_locations = transaction_import.upsert(db, rows)
+            inserted += chunk_inserted
+            updated += chunk_updated
+            unchanged += chunk_unchanged
+            days |= chunk_days
+            locations |= chunk_locations
+            read += len(chunk)
+            self._progress(db, job_id, inserted + updated)
+        rebuilt_all = bool(self._before_commit(db, days)) if days and self._before_commit else False
+        self._update(db, job_id, rows_imported=inserted + updated, rows_updated=updated, rows_unchanged=unchanged)
+        self._finish(
+            db, job_id, STATUS_SUCCEEDED,
+            f"Successfully processed file. Inserted {inserted} new and updated {updated} changed transactions ({unchanged} unchanged)."
+        )
+        print(f"[Import] Job {job_id}: {inserted} inserted, {updated} updated, {unchanged} unchanged across {len(days)} days")
+        return days, locations, rebuilt_all
+
+    def _progress(self, db, job_id, rows_imported):
+        """Records importing progress; readers in other processes see it once the import commits."""
+        self._rows_imported[job_id] = rows_imported
+        self._update(db, job_id, rows_imported=rows_imported)
+
+    def _update(self, db, job_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        db.execute(f"UPDATE import_jobs SET {assignments} WHERE job_id = ?", list(fields.values()) + [job_id])
+
+    def _finish(self, db, job_id, status, message):
+        db.execute(
+            'UPDATE import_jobs SET status = ?, message = ?, finished_at = CURRENT_TIMESTAMP WHERE job_id = ?',
+            (status, message, job_id)
+        )
+        db.commit()
+
+runner = ImportJobRunner()
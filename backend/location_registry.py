@@ -0,0 +1,194 @@
+"""In-memory registry of Boulevard locations.
+
+Endpoints used to issue a LOCATIONS_QUERY round trip on every request just to
+enumerate location IDs. The registry keeps the locations in memory with a long
+TTL, refreshes them in a background thread once they go stale (callers keep
+getting the previous list meanwhile), and persists them to the SQLite
+`locations` table so a freshly started worker has them without an API call.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import boulevard_client
+
+# How long a fetched location list is considered fresh (seconds)
+LOCATION_REGISTRY_TTL = int(os.getenv('LOCATION_REGISTRY_TTL', str(6 * 60 * 60)))
+
+def _parse_locations_response(response):
+    """Extracts [{'id', 'name', 'address'}] from a LOCATIONS_QUERY response; None on API error."""
+    if response is None or 'errors' in response or not response.get('data'):
+        return None
+    connection = response['data'].get('locations') or {}
+    locations = []
+    for edge in connection.get('edges', []):
+        node = edge.get('node') if edge else None
+        if node and node.get('id'):
+            locations.append({
+                "id": node['id'],
+                "name": node.get('name'),
+                "address": node.get('address'),
+            })
+    return locations
+
+def _normalize_name(name):
+    return ' '.join(str(name).split()).casefold() if name else None
+
+class LocationRegistry:
+    """Thread-safe cache of Boulevard locations with O(1) lookup by ID and by name."""
+
+    def __init__(self, ttl=LOCATION_REGISTRY_TTL, fetch_fn=None):
+        self.ttl = ttl
+        self._fetch_fn = fetch_fn or boulevard_client.get_boulevard_locations
+        self._db_path = None
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_name = {}
+        self._loaded_at = None # monotonic time of the last successful API fetch
+        self._refreshing = False
+        self._tried_db = False
+
+    def configure(self, db_path):
+        """Sets the SQLite database used for cold-start loads and persistence."""
+        self._db_path = db_path
+
+    # --- Lookups ---
+
+    def get_locations(self):
+        """Returns all known locations as a list of {'id', 'name', 'address'} dicts."""
+        self._ensure_fresh()
+        return list(self._by_id.values())
+
+    def get_location_ids(self):
+        self._ensure_fresh()
+        return list(self._by_id.keys())
+
+    def get_by_id(self, location_id):
+        self._ensure_fresh()
+        return self._by_id.get(location_id)
+
+    def get_by_name(self, name):
+        """Case- and whitespace-insensitive lookup by location name."""
+        self._ensure_fresh()
+        return self._by_name.get(_normalize_name(name))
+
+    # --- Loading / Refreshing ---
+
+    def _install(self, locations, fetched):
+        by_id = {loc['id']: loc for loc in locations}
+        by_name = {_normalize_name(loc['name']): loc for loc in locations if loc.get('name')}
+        with self._lock:
+            self._by_id = by_id
+            self._by_name = by_name
+            if fetched:
+                self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if not self._by_id and not self._tried_db:
+            self._tried_db = True
+            self._load_from_db()
+        if not self._by_id:
+            # Nothing to serve yet: this one call has to block on the API
+            self.refresh()
+            return
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._refresh_in_background()
+
+    def refresh(self):
+        """Fetches locations from Boulevard, installs and persists them. Returns True on success."""
+        try:
+            locations = _parse_locations_response(self._fetch_fn())
+        except Exception as e:
+            print(f"[LocationRegistry] Failed to fetch locations: {e}")
+            return False
+        if not locations:
+            print("[LocationRegistry] Boulevard returned no locations; keeping previous list.")
+            return False
+        self._install(locations, fetched=True)
+        self._persist(locations)
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=_run, name='location-registry-refresh', daemon=True).start()
+
+    def invalidate(self):
+        """Marks the cached list stale so the next lookup triggers a refresh."""
+        with self._lock:
+            self._loaded_at = None
+
+    # --- Persistence ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self._db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _load_from_db(self):
+        if not self._db_path or not os.path.exists(self._db_path):
+            return
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT boulevard_id, name, address FROM locations WHERE boulevard_id IS NOT NULL ORDER BY location_id"
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[LocationRegistry] Could not load locations from database: {e}")
+            return
+        locations = []
+        for row in rows:
+            address = row['address']
+            try:
+                address = json.loads(address) if address else None
+            except (TypeError, ValueError):
+                pass # Free-text address entered by hand
+            locations.append({"id": row['boulevard_id'], "name": row['name'], "address": address})
+        if locations:
+            self._install(locations, fetched=False) # Served immediately, refreshed in the background
+
+    def _persist(self, locations):
+        if not self._db_path:
+            return
+        try:
+            conn = self._connect()
+            try:
+                # A location renamed in Boulevard keeps its ID; release it from the old row first
+                conn.executemany(
+                    "UPDATE locations SET boulevard_id = NULL WHERE boulevard_id = ? AND name != ?",
+                    [(loc['id'], loc['name'] or loc['id']) for loc in locations]
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO locations (name, address, boulevard_id) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        address = excluded.address,
+                        boulevard_id = excluded.boulevard_id
+                    """,
+                    [
+                        (loc['name'] or loc['id'], json.dumps(loc['address']) if loc['address'] else None, loc['id'])
+                        for loc in locations
+                    ]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[LocationRegistry] Could not persist locations: {e}")
+
+registry = LocationRegistry()
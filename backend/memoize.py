@@ -0,0 +1,151 @@
+"""In-process memoization keyed on normalized function arguments.
+
+Used for Boulevard client calls, where the result depends on location_id,
+query_string, days_history, etc. Unlike a static cache key_prefix, the key is
+built from the bound arguments (defaults applied), so f(loc) and
+f(location_id=loc, query_string=None) share one entry while different
+locations never collide.
+"""
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import cache_keys
+
+# Every memoized function registers itself here so stats/clear can reach them all
+_registry = {}
+# Optional store shared by all worker processes (see configure_shared)
+_shared = None
+
+def _normalize(value):
+    """Turns an argument into a hashable, order-insensitive-where-it-should-be key part."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_normalize(v) for v in value))
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+class _TTLCache:
+    """Thread-safe LRU mapping with per-entry expiry and hit/miss/eviction counters."""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "maxsize": self.maxsize,
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+def ttl_memoize(ttl=300, maxsize=128, name=None, cache_none=False):
+    """Memoizes a function on its normalized arguments.
+
+    ttl: seconds an entry stays valid
+    maxsize: max entries kept; least recently used entries are evicted first
+    cache_none: whether None results (usually failed fetches) are cached
+
+    The wrapped function gains cache_info() and cache_clear().
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        store = _TTLCache(ttl, maxsize)
+        cache_name = name or func.__qualname__
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple((k, _normalize(v)) for k, v in bound.arguments.items())
+
+        shared_prefix = f"memoize/{cache_name}/"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            found, value = store.get(key)
+            if found:
+                return value
+            if _shared is not None:
+                # Another worker may already have it; otherwise only one worker computes it
+                value = _shared.get_or_set(shared_prefix + cache_keys.digest(key), lambda: func(*args, **kwargs), timeout=ttl)
+            else:
+                value = func(*args, **kwargs)
+            if value is not None or cache_none:
+                store.set(key, value)
+            return value
+
+        def cache_clear():
+            store.clear()
+            if _shared is not None:
+                _shared.delete_prefix(shared_prefix)
+
+        wrapper.cache_info = store.info
+        wrapper.cache_clear = cache_clear
+        _registry[cache_name] = store
+        return wrapper
+    return decorator
+
+def configure_shared(shared_store):
+    """Backs every memoized function with a cross-worker store (shared_cache.SQLiteCache).
+
+    The in-process cache is still checked first; on a miss the value is read
+    from (or computed once into) the shared store, so a call another worker
+    already made is not repeated. None results are never shared.
+    """
+    global _shared
+    _shared = shared_store
+
+def memoize_stats():
+    """Returns hit/miss/eviction stats for every memoized function."""
+    return {name: store.info() for name, store in _registry.items()}
+
+def clear_all():
+    """Drops every memoized entry in this process."""
+    for store in _registry.values():
+        store.clear()
@@ -0,0 +1,187 @@
+"""Incremental schema migrations applied on top of schema.sql.
+
+schema.sql creates the base tables; each entry below upgrades an existing
+database one step. The applied version is tracked in SQLite's
+PRAGMA user_version, so running the migrations again is a no-op.
+"""
+import sqlite3
+
+# (version, description, [statements]) - append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, "Store Boulevard location IDs on locations", [
+        "ALTER TABLE locations ADD COLUMN boulevard_id TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_locations_boulevard_id ON locations (boulevard_id)",
+    ]),
+    (2, "Local Boulevard order store", [
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY, -- Boulevard order ID
+            location_id TEXT NOT NULL, -- Boulevard location ID
+            closed_at TEXT NOT NULL, -- UTC 'YYYY-MM-DDTHH:MM:SSZ', sortable as text
+            subtotal_cents INTEGER NOT NULL DEFAULT 0,
+            synced_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_location_closed_at ON orders (location_id, closed_at)",
+        """
+        CREATE TABLE IF NOT EXISTS order_lines (
+            order_id TEXT NOT NULL,
+            line_index INTEGER NOT NULL, -- Position within the order (line groups flattened)
+            line_id TEXT,
+            line_type TEXT NOT NULL, -- GraphQL __typename, e.g. 'OrderServiceLine'
+            item_id TEXT, -- productId / serviceId
+            name TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            subtotal_cents INTEGER NOT NULL DEFAULT 0,
+            discount_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (order_id, line_index),
+            FOREIGN KEY (order_id) REFERENCES orders (order_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS order_sync_state (
+            location_id TEXT PRIMARY KEY, -- Boulevard location ID
+            high_water_closed_at TEXT, -- Latest closed_at seen by a completed sync
+            last_synced_at TIMESTAMP,
+            orders_synced INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+    (3, "Daily sales rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS daily_sales_rollup (
+            source TEXT NOT NULL, -- 'orders' (Boulevard) or 'transactions' (uploaded)
+            location_key TEXT NOT NULL, -- Boulevard location ID / locations.location_id
+            day TEXT NOT NULL, -- 'YYYY-MM-DD'
+            category TEXT NOT NULL, -- '' when the item has no category
+            item_name TEXT NOT NULL,
+            item_type TEXT NOT NULL, -- 'service' or 'product'
+            sales REAL NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            discount REAL NOT NULL DEFAULT 0,
+            discount_count INTEGER NOT NULL DEFAULT 0, -- Discounted lines
+            cost REAL NOT NULL DEFAULT 0,
+            transactions INTEGER NOT NULL DEFAULT 0, -- Orders containing the item
+            PRIMARY KEY (source, location_key, day, category, item_name, item_type)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_order_totals (
+            source TEXT NOT NULL,
+            location_key TEXT NOT NULL,
+            day TEXT NOT NULL,
+            sales REAL NOT NULL DEFAULT 0, -- Sum of order subtotals
+            cost REAL NOT NULL DEFAULT 0,
+            transactions INTEGER NOT NULL DEFAULT 0, -- Orders closed that day
+            PRIMARY KEY (source, location_key, day)
+        )
+        """,
+    ]),
+    (4, "Product/service unit cost index", [
+        """
+        CREATE TABLE IF NOT EXISTS item_cost_index (
+            item_type TEXT NOT NULL, -- 'service' or 'product'
+            item_id INTEGER NOT NULL, -- services.service_id / products.product_id
+            item_name TEXT,
+            unit_cost REAL NOT NULL DEFAULT 0,
+            match_type TEXT NOT NULL, -- 'exact', 'normalized', 'fuzzy' or 'none'
+            matched_name TEXT, -- Inventory name the cost came from
+            PRIMARY KEY (item_type, item_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cost_index_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            source_fingerprint TEXT NOT NULL, -- Hash of the inputs the index was built from
+            built_at TIMESTAMP NOT NULL
+        )
+        """,
+    ]),
+    (5, "Indexes for date-range reads of transactions and rollups", [
+        # Range scans on transaction_time (half-open, see sales_rollup._transaction_range);
+        # covers the daily totals query without touching the table
+        "CREATE INDEX IF NOT EXISTS idx_transactions_time_location ON transactions (transaction_time, location_id, total_amount)",
+        # Line items of a transaction, covering the columns the rollup refresh reads
+        """
+        CREATE INDEX IF NOT EXISTS idx_transaction_items_transaction
+        ON transaction_items (transaction_id, item_type, service_id, product_id, quantity, net_price)
+        """,
+        # Profit by category (sales_rollup.category_profit) joins on category
+        """
+        CREATE INDEX IF NOT EXISTS idx_daily_sales_rollup_category
+        ON daily_sales_rollup (source, category, day, location_key, sales, cost)
+        """,
+    ]),
+    (6, "Background transaction import jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT,
+            status TEXT NOT NULL, -- queued, validating, importing, succeeded, failed
+            file_bytes INTEGER,
+            rows_validated INTEGER NOT NULL DEFAULT 0,
+            rows_imported INTEGER NOT NULL DEFAULT 0,
+            error_count INTEGER NOT NULL DEFAULT 0, -- All row errors (only the first few are stored)
+            message TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS import_job_errors (
+            job_id INTEGER NOT NULL,
+            row_number INTEGER NOT NULL, -- CSV line (1 is the header)
+            message TEXT NOT NULL,
+            PRIMARY KEY (job_id, row_number),
+            FOREIGN KEY (job_id) REFERENCES import_jobs (job_id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (7, "Natural keys for uploaded transactions and upsert imports", [
+        # transaction_key column or row hash, see transaction_import (NULL for rows imported before)
+        "ALTER TABLE transactions ADD COLUMN external_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_external_key ON transactions (external_key)",
+        "ALTER TABLE import_jobs ADD COLUMN mode TEXT NOT NULL DEFAULT 'replace'", # replace or upsert
+        "ALTER TABLE import_jobs ADD COLUMN rows_updated INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE import_jobs ADD COLUMN rows_unchanged INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+def _table_exists(db, name):
+    row = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+def get_schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def apply_migrations(db):
+    """Applies every pending migration; returns the number applied.
+
+    Each migration runs in its own BEGIN IMMEDIATE transaction and re-checks
+    the version after taking the write lock, so several gunicorn workers
+    starting at once apply each step exactly once.
+    """
+    if not _table_exists(db, 'locations'):
+        # Base schema not created yet; `flask init-db` will run the migrations
+        return 0
+
+    applied = 0
+    for version, description, statements in MIGRATIONS:
+        if version <= get_schema_version(db):
+            continue
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            if version <= get_schema_version(db):
+                db.rollback() # Another worker got here first
+                continue
+            for statement in statements:
+                db.execute(statement)
+            db.execute(f'PRAGMA user_version = {int(version)}')
+            db.commit()
+            applied += 1
+            print(f"Applied migration {version}: {description}")
+        except sqlite3.Error:
+            db.rollback()
+            raise
+    return applied
@@ -0,0 +1,401 @@
+"""Single-pass aggregation over a Boulevard order set.
+
+The sales by-category, over-time and summary endpoints and calculate_kpis used
+to each walk the nested lineGroups -> lines structure with their own loops,
+category lookups and cents-to-dollars conversions. aggregate_orders() walks an
+order set once and collects everything those views need; each endpoint then
+takes a projection of the result.
+
+The order set is first flattened into NumPy columns (OrderColumns), so the
+aggregations are vectorized group-bys over compact arrays rather than
+per-line dict lookups, and the nested dict trees can be dropped right after.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from dateutil.parser import isoparse
+
+_EPOCH_DATE = date(1970, 1, 1)
+
+def _epoch_seconds(closed_at):
+    """closedAt as epoch seconds, or None if it is absent or unparseable."""
+    if not closed_at:
+        return None
+    try:
+        return int(isoparse(closed_at).timestamp())
+    except (ValueError, OverflowError):
+        return None
+
+class OrderColumns:
+    """A fetched order set flattened into NumPy columns.
+
+    Order columns (one entry per order with a closedAt; see flatten_orders):
+        order_closed_at     closedAt as epoch seconds
+        order_location      index into .locations
+        order_subtotal      currentSubtotal in cents (0 if missing)
+        order_has_total     whether currentSubtotal was numeric
+    Line columns (one entry per line, line groups flattened):
+        line_order          index of the owning order
+        line_item           index into .items (item names; None for unnamed lines)
+        line_is_service     OrderServiceLine vs. product line
+        line_quantity       quantity (missing -> 1, null -> 0)
+        line_subtotal       currentSubtotal in cents
+        line_discount       currentDiscountAmount in cents
+    """
+
+    def __init__(self, locations, items, order_cols, line_cols):
+        self.locations = locations
+        self.items = items
+        (self.order_closed_at, self.order_location,
+         self.order_subtotal, self.order_has_total) = order_cols
+        (self.line_order, self.line_item, self.line_is_service,
+         self.line_quantity, self.line_subtotal, self.line_discount) = line_cols
+
+    @property
+    def order_count(self):
+        return len(self.order_subtotal)
+
+    @property
+    def line_count(self):
+        return len(self.line_order)
+
+def _cents(value):
+    return int(value) if isinstance(value, (int, float)) else 0
+
+def flatten_orders(orders_by_location):
+    """Flattens {location_id: [orders]} (ORDER_DETAILS_QUERY nodes) into OrderColumns.
+
+    Orders without a (parseable) closedAt are skipped, as the order store does
+    when it syncs them, so live and rollup aggregates count the same orders.
+    """
+    locations = []
+    items = []
+    item_codes = {}
+
+    closed_at, order_location, order_subtotal, order_has_total = [], [], [], []
+    line_order, line_item, line_is_service, line_quantity, line_subtotal, line_discount = [], [], [], [], [], []
+
+    for location_id, orders in orders_by_location.items():
+        location_code = len(locations)
+        locations.append(location_id)
+        for order in orders or []:
+            epoch = _epoch_seconds(order.get('closedAt'))
+            if epoch is None:
+                continue
+            order_index = len(order_subtotal)
+            subtotal_cents = (order.get('summary') or {}).get('currentSubtotal')
+            has_total = isinstance(subtotal_cents, (int, float))
+            closed_at.append(epoch)
+            order_location.append(location_code)
+            order_subtotal.append(subtotal_cents if has_total else 0)
+            order_has_total.append(has_total)
+
+            for group in order.get('lineGroups') or []:
+                for line in (group or {}).get('lines') or []:
+                    name = line.get('name') or None
+                    code = item_codes.get(name)
+                    if code is None:
+                        code = item_codes[name] = len(items)
+                        items.append(name)
+                    quantity = line.get('quantity', 1)
+                    line_order.append(order_index)
+                    line_item.append(code)
+                    line_is_service.append(line.get('__typename') == 'OrderServiceLine')
+                    line_quantity.append(int(quantity) if quantity else 0)
+                    line_subtotal.append(_cents(line.get('currentSubtotal')))
+                    line_discount.append(_cents(line.get('currentDiscountAmount')))
+
+    return OrderColumns(
+        locations,
+        items,
+        (
+            np.array(closed_at, dtype=np.int64),
+            np.array(order_location, dtype=np.int32),
+            np.array(order_subtotal, dtype=np.int64),
+            np.array(order_has_total, dtype=bool),
+        ),
+        (
+            np.array(line_order, dtype=np.int32),
+            np.array(line_item, dtype=np.int32),
+            np.array(line_is_service, dtype=bool),
+            np.array(line_quantity, dtype=np.int64),
+            np.array(line_subtotal, dtype=np.int64),
+            np.array(line_discount, dtype=np.int64),
+        ),
+    )
+
+def _line_costs(columns, line_amount, unit_cost):
+    """Per-line cost in dollars; unit_cost is resolved once per distinct (item, type)."""
+    if unit_cost is None or not columns.line_count:
+        return np.zeros(columns.line_count)
+
+    pair = columns.line_item.astype(np.int64) * 2 + columns.line_is_service
+    pairs, inverse = np.unique(pair, return_inverse=True)
+    fixed = np.empty(len(pairs))
+    ratio = np.empty(len(pairs))
+    for i, key in enumerate(pairs.tolist()):
+        name = columns.items[key // 2]
+        item_type = 'service' if key % 2 else 'product'
+        fixed_cost, cost_ratio = unit_cost(name if name is not None else 'Unknown Item', item_type)
+        fixed[i] = np.nan if fixed_cost is None else fixed_cost
+        ratio[i] = cost_ratio
+    fixed = fixed[inverse]
+    unit = np.where(np.isnan(fixed), line_amount * ratio[inverse], fixed)
+    return unit * columns.line_quantity
+
+def aggregate_columns(columns, categorize, unit_cost=None):
+    """Vectorized aggregation of OrderColumns; returns the dict documented on aggregate_orders."""
+    n_orders = columns.order_count
+    n_items = len(columns.items)
+    has_total = columns.order_has_total
+
+    line_amount = columns.line_subtotal / 100.0
+    line_cost = _line_costs(columns, line_amount, unit_cost)
+    order_total = columns.order_subtotal / 100.0
+    order_cost = np.bincount(columns.line_order, weights=line_cost, minlength=n_orders)
+
+    # Sales by location / type
+    location_sales = np.bincount(
+        columns.order_location[has_total], weights=order_total[has_total], minlength=len(columns.locations)
+    )
+    service_sales = float(line_amount[columns.line_is_service].sum())
+    product_sales = float(line_amount.sum()) - service_sales
+
+    # Hourly timeline (the finest bucket time_buckets.resample needs) and
+    # daily sales / profit / transactions keyed by UTC closedAt date
+    timeline = {
+        "epoch": np.zeros(0, dtype=np.int64),
+        "sales": np.zeros(0),
+        "profit": np.zeros(0),
+        "transactions": np.zeros(0),
+    }
+    daily = {}
+    if has_total.any():
+        hours, hour_index = np.unique(columns.order_closed_at[has_total] // 3600, return_inverse=True)
+        hour_sales = np.bincount(hour_index, weights=order_total[has_total])
+        timeline = {
+            "epoch": hours * 3600,
+            "sales": hour_sales,
+            "profit": hour_sales - np.bincount(hour_index, weights=order_cost[has_total]),
+            "transactions": np.bincount(hour_index).astype(float),
+        }
+        days, day_index = np.unique(hours // 24, return_inverse=True)
+        day_sales = np.bincount(day_index, weights=timeline["sales"])
+        day_profit = np.bincount(day_index, weights=timeline["profit"])
+        day_transactions = np.bincount(day_index, weights=timeline["transactions"])
+        for day, sales, profit, transactions in zip(days.tolist(), day_sales.tolist(), day_profit.tolist(), day_transactions.tolist()):
+            daily[_EPOCH_DATE + timedelta(days=day)] = {"sales": sales, "profit": profit, "transactions": int(transactions)}
+
+    # Per-item totals; each distinct name is categorized once
+    item_quantity = np.bincount(columns.line_item, weights=columns.line_quantity, minlength=n_items)
+    item_sales = np.bincount(columns.line_item, weights=line_amount, minlength=n_items)
+    item_cost = np.bincount(columns.line_item, weights=line_cost, minlength=n_items)
+    item_last_line = np.full(n_items, -1, dtype=np.int64)
+    np.maximum.at(item_last_line, columns.line_item, np.arange(columns.line_count))
+
+    category_sales = {}
+    items = {}
+    for code, name in enumerate(columns.items):
+        category = categorize(name) if name is not None else None
+        if category is not None:
+            category_sales[category] = category_sales.get(category, 0.0) + float(item_sales[code])
+        display_name = name if name is not None else 'Unknown Item'
+        item = items.get(display_name)
+        if item is None:
+            item = items[display_name] = {
+                "name": display_name,
+                "type": None,
+                "category": category,
+                "quantity": 0,
+                "total_sales": 0.0,
+                "total_cost": 0.0,
+            }
+        if item_last_line[code] >= 0:
+            item["type"] = 'service' if columns.line_is_service[item_last_line[code]] else 'product'
+        item["quantity"] += int(item_quantity[code])
+        item["total_sales"] += float(item_sales[code])
+        item["total_cost"] += float(item_cost[code])
+
+    # Discounts (assumed to reduce profit directly)
+    discounted = columns.line_discount != 0
+    discount_amount = columns.line_discount[discounted] / 100.0
+    discount_is_service = columns.line_is_service[discounted]
+    discounts = {
+        "total_amount": float(discount_amount.sum()),
+        "usage_count": int(discounted.sum()),
+        "profit_impact": 0.0 - float((discount_amount * np.where(discount_is_service, 0.7, 0.6)).sum()),
+        "type": ('service' if discount_is_service[-1] else 'product') if len(discount_is_service) else "",
+    }
+
+    return {
+        "order_count": n_orders,
+        "total_transactions": int(has_total.sum()),
+        "total_sales": float(order_total[has_total].sum()),
+        "total_cost": float(order_cost[has_total].sum()),
+        "sales_by_location": {
+            location_id: float(location_sales[code])
+            for code, location_id in enumerate(columns.locations) if location_sales[code]
+        },
+        "daily": daily,
+        "timeline": timeline,
+        "category_sales": category_sales,
+        "sales_by_type": {"services": service_sales, "products": product_sales},
+        "items": items,
+        "discounts": discounts,
+    }
+
+def aggregate_orders(orders_by_location, categorize, unit_cost=None):
+    """Aggregates {location_id: [orders]} in a single traversal.
+
+    categorize(name) -> category name for a line item.
+    unit_cost(name, item_type) -> (fixed_unit_cost, cost_ratio): a line costs
+    fixed_unit_cost * quantity, or line_amount * cost_ratio * quantity when
+    fixed_unit_cost is None. If omitted, costs (and therefore profit) are zero.
+
+    Returns a plain dict:
+        order_count          orders with a closedAt (the others are skipped)
+        total_transactions   orders with a numeric subtotal
+        total_sales          sum of order subtotals (dollars)
+        total_cost           sum of line costs (dollars)
+        sales_by_location    {location_id: sales}
+        daily                {date: {'sales', 'profit', 'transactions'}} keyed by UTC closedAt date
+        timeline             {'epoch', 'sales', 'profit', 'transactions'} arrays per UTC hour with sales
+        category_sales       {category: line sales}
+        sales_by_type        {'services': ..., 'products': ...}
+        items                {name: {'name', 'type', 'category', 'quantity', 'total_sales', 'total_cost'}}
+        discounts            {'total_amount', 'usage_count', 'profit_impact', 'type'}
+    """
+    return aggregate_columns(flatten_orders(orders_by_location), categorize, unit_cost)
+
+def merge_aggregates(aggregates):
+    """Combines aggregates of disjoint order sets (e.g. rollup-backed and live) into one."""
+    aggregates = list(aggregates)
+    if len(aggregates) == 1:
+        return aggregates[0]
+
+    merged = {
+        "order_count": 0,
+        "total_transactions": 0,
+        "total_sales": 0.0,
+        "total_cost": 0.0,
+        "sales_by_location": {},
+        "daily": {},
+        "category_sales": {},
+        "sales_by_type": {"services": 0.0, "products": 0.0},
+        "items": {},
+        "discounts": {"total_amount": 0.0, "usage_count": 0, "profit_impact": 0.0, "type": ""},
+    }
+    for agg in aggregates:
+        for key in ("order_count", "total_transactions", "total_sales", "total_cost"):
+            merged[key] += agg[key]
+        for key in ("sales_by_location", "category_sales", "sales_by_type"):
+            for name, amount in agg[key].items():
+                merged[key][name] = merged[key].get(name, 0.0) + amount
+        for day, metrics in agg["daily"].items():
+            target = merged["daily"].setdefault(day, {"sales": 0.0, "profit": 0.0, "transactions": 0})
+            for metric, value in metrics.items():
+                target[metric] += value
+        for name, item in agg["items"].items():
+            target = merged["items"].get(name)
+            if target is None:
+                merged["items"][name] = dict(item)
+                continue
+            target["type"] = item["type"]
+            for metric in ("quantity", "total_sales", "total_cost"):
+                target[metric] += item[metric]
+        for metric in ("total_amount", "usage_count", "profit_impact"):
+            merged["discounts"][metric] += agg["discounts"][metric]
+        merged["discounts"]["type"] = agg["discounts"]["type"] or merged["discounts"]["type"]
+
+    # Timelines may share timestamps; time_buckets.resample sums duplicates
+    merged["timeline"] = {
+        metric: np.concatenate([agg["timeline"][metric] for agg in aggregates])
+        for metric in ("epoch", "sales", "profit", "transactions")
+    }
+    return merged
+
+# --- Projections ---
+# Each returns new objects; the aggregate itself may be cached and shared.
+
+def project_category_sales(agg, all_categories):
+    """[{'name', 'value'}] for every category (including those with 0 sales), sorted by name."""
+    category_sales = agg["category_sales"]
+    return [
+        {"name": category, "value": round(category_sales.get(category, 0.0), 2)}
+        for category in sorted(all_categories)
+    ]
+
+def project_summary(agg, location_labels=None, top_n=10):
+    """Totals, type split, per-location sales and top items for /api/v1/sales/summary."""
+    location_labels = location_labels or {}
+    total_sales = agg["total_sales"]
+    total_transactions = agg["total_transactions"]
+
+    top_items = sorted(agg["items"].values(), key=lambda x: x["total_sales"], reverse=True)[:top_n]
+
+    return {
+        'total_sales': round(total_sales, 2),
+        'total_transactions': total_transactions,
+        'avg_transaction_value': round(total_sales / total_transactions, 2) if total_transactions > 0 else 0.0,
+        'sales_by_type': {
+            'services': round(agg["sales_by_type"]["services"], 2),
+            'products': round(agg["sales_by_type"]["products"], 2),
+            'other': 0.0
+        },
+        'sales_by_location': {
+            location_labels.get(loc_id, f"Location {loc_id}"): round(amount, 2)
+            for loc_id, amount in agg["sales_by_location"].items() if amount > 0
+        },
+        'top_items': [
+            {
+                'name': item["name"],
+                'type': item["type"],
+                'total_sales': round(item["total_sales"], 2),
+                'quantity': item["quantity"]
+            }
+            for item in top_items
+        ]
+    }
+
+def project_kpis(agg, trends):
+    """KPI payload for /api/v1/kpis; trends is the pre-built daily trend list."""
+    total_sales = agg["total_sales"]
+    total_profit = total_sales - agg["total_cost"]
+    total_transactions = agg["order_count"]
+
+    items = []
+    for item in agg["items"].values():
+        item_profit = item["total_sales"] - item["total_cost"]
+        items.append({
+            "name": item["name"],
+            "type": item["type"],
+            "quantity": item["quantity"],
+            "total_sales": round(item["total_sales"], 2),
+            "total_cost": round(item["total_cost"], 2),
+            "total_profit": round(item_profit, 2),
+            "profit_margin": round((item_profit / item["total_sales"] * 100) if item["total_sales"] > 0 else 0, 2)
+        })
+    items.sort(key=lambda x: x["total_profit"], reverse=True)
+
+    discounts = []
+    discount = agg["discounts"]
+    if discount["usage_count"] > 0:
+        discounts.append({
+            "name": "Line Item Discount", # Generic name since we don't have specific discount info
+            "type": discount["type"],
+            "total_amount": round(discount["total_amount"], 2),
+            "usage_count": discount["usage_count"],
+            "profit_impact": round(discount["profit_impact"], 2),
+            "average_discount": round(discount["total_amount"] / discount["usage_count"], 2)
+        })
+
+    return {
+        "total_sales": round(total_sales, 2),
+        "total_transactions": total_transactions,
+        "avg_transaction_value": round(total_sales / total_transactions if total_transactions > 0 else 0, 2),
+        "total_profit": round(total_profit, 2),
+        "profit_margin": round((total_profit / total_sales * 100) if total_sales > 0 else 0, 2),
+        "trends": trends,
+        "discounts": discounts,
+        "items": items
+    }
@@ -0,0 +1,248 @@
+"""Local warehouse of Boulevard orders.
+
+Orders are synced incrementally into the instance database (`orders`,
+`order_lines`, `order_sync_state`) so analytics endpoints can answer from
+SQLite instead of paging through the GraphQL API on every request.
+
+Each location keeps a `closedAt` high-water mark; a sync asks Boulevard only
+for orders closed at or after it. Upserts are idempotent, so re-reading the
+boundary orders (or resuming an interrupted sync) is harmless.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+from dateutil.parser import isoparse
+
+import boulevard_client
+
+# How far back the first sync of a location reaches (days)
+ORDER_SYNC_INITIAL_DAYS = int(os.getenv('ORDER_SYNC_INITIAL_DAYS', '365'))
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def normalize_timestamp(value):
+    """Converts a Boulevard ISO timestamp to a sortable UTC 'YYYY-MM-DDTHH:MM:SSZ' string."""
+    dt = isoparse(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+def _cents(value):
+    return int(value) if isinstance(value, (int, float)) else 0
+
+def _line_item_id(line):
+    return line.get('productId') or line.get('serviceId')
+
+# --- Sync State ---
+
+def get_high_water_mark(db, location_id):
+    row = db.execute(
+        'SELECT high_water_closed_at FROM order_sync_state WHERE location_id = ?', (location_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+def _synced_location_ids_query(location_ids):
+    placeholders = ', '.join('?' for _ in location_ids)
+    sql = f'SELECT location_id FROM order_sync_state WHERE location_id IN ({placeholders}) AND last_synced_at IS NOT NULL'
+    return sql, list(location_ids)
+
+def synced_location_ids(db, location_ids):
+    """Returns the subset of location_ids that have completed at least one sync."""
+    location_ids = list(location_ids)
+    if not location_ids:
+        return set()
+    rows = db.execute(*_synced_location_ids_query(location_ids)).fetchall()
+    return {row[0] for row in rows}
+
+# --- Writing ---
+
+def upsert_orders(db, location_id, orders):
+    """Inserts or replaces orders (and their lines). Returns (count, max closed_at) of stored orders."""
+    order_rows = []
+    line_rows = []
+    max_closed_at = None
+    for order in orders:
+        if not order or not order.get('id') or not order.get('closedAt'):
+            continue
+        try:
+            closed_at = normalize_timestamp(order['closedAt'])
+        except (ValueError, OverflowError):
+            continue # Skipped like orders without a closedAt (see order_aggregation.flatten_orders)
+        if max_closed_at is None or closed_at > max_closed_at:
+            max_closed_at = closed_at
+        summary = order.get('summary') or {}
+        order_rows.append((order['id'], location_id, closed_at, _cents(summary.get('currentSubtotal'))))
+
+        line_index = 0
+        for group in order.get('lineGroups') or []:
+            for line in (group or {}).get('lines') or []:
+                line_rows.append((
+                    order['id'],
+                    line_index,
+                    line.get('id'),
+                    line.get('__typename') or 'OrderLine',
+                    _line_item_id(line),
+                    line.get('name'),
+                    int(line.get('quantity') or 0),
+                    _cents(line.get('currentSubtotal')),
+                    _cents(line.get('currentDiscountAmount')),
+                ))
+                line_index += 1
+
+    if not order_rows:
+        return 0, None
+
+    db.executemany(
+        """
+        INSERT INTO orders (order_id, location_id, closed_at, subtotal_cents, synced_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(order_id) DO UPDATE SET
+            location_id = excluded.location_id,
+            closed_at = excluded.closed_at,
+            subtotal_cents = excluded.subtotal_cents,
+            synced_at = excluded.synced_at
+        """,
+        order_rows
+    )
+    db.executemany('DELETE FROM order_lines WHERE order_id = ?', [(row[0],) for row in order_rows])
+    db.executemany(
+        """
+        INSERT INTO order_lines (order_id, line_index, line_id, line_type, item_id, name, quantity, subtotal_cents, discount_cents)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        line_rows
+    )
+    return len(order_rows), max_closed_at
+
+def _stored_day_range(db, order_ids):
+    """Returns (first, last) 'YYYY-MM-DD' days currently stored for these orders, or (None, None)."""
+    if not order_ids:
+        return None, None
+    placeholders = ', '.join('?' for _ in order_ids)
+    first, last = db.execute(
+        f'SELECT MIN(closed_at), MAX(closed_at) FROM orders WHERE order_id IN ({placeholders})', order_ids
+    ).fetchone()
+    return (first[:10], last[:10]) if first else (None, None)
+
+def sync_location(db, location_id, full=False, initial_days=ORDER_SYNC_INITIAL_DAYS, on_orders_changed=None):
+    """Pulls new/changed orders for one location from Boulevard into the store.
+
+    Each page is committed as it arrives; the high-water mark only advances
+    once every page has been read, so an interrupted sync simply resumes from
+    the previous mark next time. Returns the number of orders stored.
+
+    on_orders_changed(db, location_id, first_day, last_day) is called for each
+    page, before its commit, with the days whose orders changed (both the old
+    and new closedAt of updated orders) so derived tables commit atomically
+    with the orders.
+    """
+    high_water = None if full else get_high_water_mark(db, location_id)
+    if high_water is None:
+        start = datetime.now(timezone.utc) - timedelta(days=initial_days)
+        high_water = start.strftime('%Y-%m-%dT00:00:00Z')
+    query_string = f"closedAt >= '{high_water}'"
+
+    stored = 0
+    new_high_water = high_water
+    for page in boulevard_client.iter_order_pages(location_id, query_string):
+        page_ids = [order['id'] for order in page if order and order.get('id')]
+        old_first, old_last = _stored_day_range(db, page_ids)
+        count, page_max = upsert_orders(db, location_id, page)
+        if count and on_orders_changed:
+            new_first, new_last = _stored_day_range(db, page_ids)
+            first_day = min(day for day in (old_first, new_first) if day)
+            last_day = max(day for day in (old_last, new_last) if day)
+            on_orders_changed(db, location_id, first_day, last_day)
+        db.commit()
+        stored += count
+        if page_max and page_max > new_high_water:
+            new_high_water = page_max
+
+    db.execute(
+        """
+        INSERT INTO order_sync_state (location_id, high_water_closed_at, last_synced_at, orders_synced)
+        VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+        ON CONFLICT(location_id) DO UPDATE SET
+            high_water_closed_at = excluded.high_water_closed_at,
+            last_synced_at = excluded.last_synced_at,
+            orders_synced = order_sync_state.orders_synced + excluded.orders_synced
+        """,
+        (location_id, new_high_water, stored)
+    )
+    db.commit()
+    return stored
+
+# --- Reading ---
+
+def _range_bounds(start_date, end_date):
+    """Turns inclusive 'YYYY-MM-DD' dates into a half-open [lower, upper) closed_at range."""
+    lower = f"{start_date}T00:00:00Z" if start_date else None
+    upper = None
+    if end_date:
+        upper = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00Z')
+    return lower, upper
+
+def _load_orders_query(location_ids, start_date=None, end_date=None):
+    """(sql, params) reading the orders and lines of the locations in the range (see load_orders)."""
+    placeholders = ', '.join('?' for _ in location_ids)
+    where = [f'o.location_id IN ({placeholders})']
+    params = list(location_ids)
+    lower, upper = _range_bounds(start_date, end_date)
+    if lower:
+        where.append('o.closed_at >= ?')
+        params.append(lower)
+    if upper:
+        where.append('o.closed_at < ?')
+        params.append(upper)
+
+    sql = f"""
+        SELECT o.order_id, o.location_id, o.closed_at, o.subtotal_cents,
+               l.line_id, l.line_type, l.item_id, l.name, l.quantity, l.subtotal_cents AS line_subtotal_cents,
+               l.discount_cents
+        FROM orders o
+        LEFT JOIN order_lines l ON l.order_id = o.order_id
+        WHERE {' AND '.join(where)}
+        ORDER BY o.closed_at, o.order_id, l.line_index
+        """
+    return sql, params
+
+def load_orders(db, location_ids, start_date=None, end_date=None):
+    """Returns {location_id: [order]} for the range, shaped like ORDER_DETAILS_QUERY nodes.
+
+    start_date / end_date are inclusive 'YYYY-MM-DD' strings (either may be None).
+    """
+    location_ids = list(location_ids)
+    orders_by_location = {loc_id: [] for loc_id in location_ids}
+    if not location_ids:
+        return orders_by_location
+
+    rows = db.execute(*_load_orders_query(location_ids, start_date, end_date))
+
+    current = None
+    for row in rows:
+        if current is None or current['id'] != row['order_id']:
+            current = {
+                'id': row['order_id'],
+                'locationId': row['location_id'],
+                'closedAt': row['closed_at'],
+                'summary': {'currentSubtotal': row['subtotal_cents']},
+                'lineGroups': [{'lines': []}],
+            }
+            orders_by_location[row['location_id']].append(current)
+        if row['line_type'] is None:
+            continue # Order without lines
+        line = {
+            '__typename': row['line_type'],
+            'id': row['line_id'],
+            'name': row['name'],
+            'quantity': row['quantity'],
+            'currentSubtotal': row['line_subtotal_cents'],
+            'currentDiscountAmount': row['discount_cents'],
+        }
+        if row['line_type'] == 'OrderProductLine':
+            line['productId'] = row['item_id']
+        elif row['line_type'] == 'OrderServiceLine':
+            line['serviceId'] = row['item_id']
+        current['lineGroups'][0]['lines'].append(line)
+
+    return orders_by_location
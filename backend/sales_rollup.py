@@ -0,0 +1,432 @@
+"""Materialized daily sales rollups.
+
+`daily_sales_rollup` holds one row per (source, location, day, category,
+item, type) with sales, quantity, discount, cost and transaction counts;
+`daily_order_totals` holds the per-day order totals for each location (order
+subtotals and order counts can't be re-derived by summing item rows).
+
+Two sources feed the rollups:
+    'orders'        Boulevard orders from the local order store, keyed by
+                    Boulevard location ID; refreshed for the days a sync touched
+    'transactions'  rows imported through the transaction upload, keyed by
+                    locations.location_id; refreshed after each import
+
+Refreshing a day range deletes and rebuilds just those days, so a year of
+history reads back as a small range scan instead of a walk over raw lines.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import order_store
+
+SOURCE_ORDERS = 'orders'
+SOURCE_TRANSACTIONS = 'transactions'
+
+_EPOCH_DATE = date(1970, 1, 1)
+
+def _next_day(day):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+def _line_cost(unit_cost, cost_cache, name, item_type, quantity, sales_times_quantity):
+    key = (name, item_type)
+    resolved = cost_cache.get(key)
+    if resolved is None:
+        resolved = cost_cache[key] = unit_cost(name, item_type) if unit_cost else (0.0, 0.0)
+    fixed_cost, cost_ratio = resolved
+    if fixed_cost is not None:
+        return fixed_cost * quantity
+    return sales_times_quantity * cost_ratio
+
+def _delete_range(db, source, location_key=None, first_day=None, last_day=None):
+    where = ['source = ?']
+    params = [source]
+    if location_key is not None:
+        where.append('location_key = ?')
+        params.append(location_key)
+    if first_day:
+        where.append('day >= ?')
+        params.append(first_day)
+    if last_day:
+        where.append('day <= ?')
+        params.append(last_day)
+    for table in ('daily_sales_rollup', 'daily_order_totals'):
+        db.execute(f"DELETE FROM {table} WHERE {' AND '.join(where)}", params)
+
+def _insert(db, source, item_rows, total_rows):
+    db.executemany(
+        """
+        INSERT INTO daily_sales_rollup
+            (source, location_key, day, category, item_name, item_type,
+             sales, quantity, discount, discount_count, cost, transactions)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(source,) + key + tuple(values) for key, values in item_rows.items()]
+    )
+    db.executemany(
+        """
+        INSERT INTO daily_order_totals (source, location_key, day, sales, cost, transactions)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [(source,) + row for row in total_rows]
+    )
+
+# --- Maintenance ---
+
+def refresh_orders(db, location_id, first_day, last_day, categorize, unit_cost=None):
+    """Rebuilds the 'orders' rollups of one Boulevard location for [first_day, last_day].
+
+    categorize(name) -> category; unit_cost(name, item_type) ->
+    (fixed_unit_cost, cost_ratio) as in order_aggregation.aggregate_orders.
+    Does not commit; call inside the transaction that changed the orders.
+    """
+    _delete_range(db, SOURCE_ORDERS, location_id, first_day, last_day)
+    lower = f"{first_day}T00:00:00Z"
+    upper = f"{_next_day(last_day)}T00:00:00Z"
+
+    rows = db.execute(
+        """
+        SELECT substr(o.closed_at, 1, 10) AS day, l.name, l.line_type,
+               SUM(l.subtotal_cents) AS sales_cents,
+               SUM(l.quantity) AS quantity,
+               SUM(l.discount_cents) AS discount_cents,
+               SUM(l.discount_cents != 0) AS discount_count,
+               SUM(l.subtotal_cents * l.quantity) AS sales_quantity_cents,
+               COUNT(DISTINCT o.order_id) AS transactions
+        FROM orders o
+        JOIN order_lines l ON l.order_id = o.order_id
+        WHERE o.location_id = ? AND o.closed_at >= ? AND o.closed_at < ?
+        GROUP BY day, l.name, l.line_type
+        """,
+        (location_id, lower, upper)
+    ).fetchall()
+
+    item_rows = {}
+    day_cost = defaultdict(float)
+    categories = {}
+    cost_cache = {}
+    for row in rows:
+        item_type = 'service' if row['line_type'] == 'OrderServiceLine' else 'product'
+        name = row['name'] or 'Unknown Item'
+        category = ''
+        if row['name']:
+            category = categories.get(name)
+            if category is None:
+                category = categories[name] = categorize(name)
+        cost = _line_cost(unit_cost, cost_cache, name, item_type, row['quantity'], row['sales_quantity_cents'] / 100.0)
+        day_cost[row['day']] += cost
+
+        key = (location_id, row['day'], category, name, item_type)
+        values = item_rows.setdefault(key, [0.0, 0, 0.0, 0, 0.0, 0])
+        values[0] += row['sales_cents'] / 100.0
+        values[1] += row['quantity']
+        values[2] += row['discount_cents'] / 100.0
+        values[3] += row['discount_count']
+        values[4] += cost
+        values[5] += row['transactions']
+
+    totals = db.execute(
+        """
+        SELECT substr(closed_at, 1, 10) AS day, SUM(subtotal_cents) AS sales_cents, COUNT(*) AS transactions
+        FROM orders
+        WHERE location_id = ? AND closed_at >= ? AND closed_at < ?
+        GROUP BY day
+        """,
+        (location_id, lower, upper)
+    ).fetchall()
+    total_rows = [
+        (location_id, row['day'], row['sales_cents'] / 100.0, day_cost.get(row['day'], 0.0), row['transactions'])
+        for row in totals
+    ]
+    _insert(db, SOURCE_ORDERS, item_rows, total_rows)
+    return len(item_rows)
+
+def rebuild_orders(db, location_id, categorize, unit_cost=None):
+    """Rebuilds every 'orders' rollup day of one location from the order store."""
+    first, last = db.execute(
+        'SELECT MIN(closed_at), MAX(closed_at) FROM orders WHERE location_id = ?', (location_id,)
+    ).fetchone()
+    _delete_range(db, SOURCE_ORDERS, location_id)
+    if first is None:
+        return 0
+    return refresh_orders(db, location_id, first[:10], last[:10], categorize, unit_cost)
+
+_TRANSACTION_ITEMS_SQL = """
+    SELECT substr(t.transaction_time, 1, 10) AS day, t.location_id, ti.item_type,
+           COALESCE(s.name, p.name) AS item_name, tc.name AS category_name,
+           SUM(ti.net_price) AS sales,
+           SUM(ti.quantity) AS quantity,
+           SUM(ti.quantity * COALESCE(ic.unit_cost, 0)) AS cost,
+           COUNT(DISTINCT t.transaction_id) AS transactions
+    FROM transactions t
+    JOIN transaction_items ti ON ti.transaction_id = t.transaction_id
+    LEFT JOIN services s ON ti.service_id = s.service_id AND ti.item_type = 'service'
+    LEFT JOIN products p ON ti.product_id = p.product_id AND ti.item_type = 'product'
+    LEFT JOIN treatment_categories tc ON tc.category_id = COALESCE(s.category_id, p.category_id)
+    LEFT JOIN item_cost_index ic
+           ON ic.item_type = ti.item_type AND ic.item_id = COALESCE(ti.service_id, ti.product_id)
+    WHERE {where}
+    GROUP BY day, t.location_id, ti.item_type, item_name, category_name
+"""
+
+_TRANSACTION_TOTALS_SQL = """
+    SELECT substr(t.transaction_time, 1, 10) AS day, t.location_id,
+           SUM(t.total_amount) AS sales, COUNT(*) AS transactions
+    FROM transactions t
+    WHERE {where}
+    GROUP BY day, t.location_id
+"""
+
+def _transaction_range(first_day, last_day):
+    """Half-open transaction_time range for [first_day, last_day], usable by idx_transactions_time_location.
+
+    transaction_time is stored as 'YYYY-MM-DD HH:MM:SS', so comparing it with
+    bare dates keeps the predicate sargable (unlike DATE(transaction_time)).
+    """
+    where = ['1=1']
+    params = []
+    if first_day:
+        where.append('t.transaction_time >= ?')
+        params.append(first_day)
+    if last_day:
+        where.append('t.transaction_time < ?')
+        params.append(_next_day(last_day))
+    return ' AND '.join(where), params
+
+def refresh_transactions(db, first_day=None, last_day=None):
+    """Rebuilds the 'transactions' rollups for [first_day, last_day] (all days when omitted).
+
+    Categories come from treatment_categories (items without one are stored
+    with an empty category) and unit costs from item_cost_index (see
+    cost_index.py; unmatched items cost 0). Does not commit.
+    """
+    _delete_range(db, SOURCE_TRANSACTIONS, None, first_day, last_day)
+    where_sql, params = _transaction_range(first_day, last_day)
+    rows = db.execute(_TRANSACTION_ITEMS_SQL.format(where=where_sql), params).fetchall()
+
+    item_rows = {}
+    day_cost = defaultdict(float)
+    for row in rows:
+        name = row['item_name'] or 'Unknown Item'
+        quantity = row['quantity'] or 0
+        cost = row['cost'] or 0.0
+        location_key = str(row['location_id'])
+        day_cost[(location_key, row['day'])] += cost
+
+        key = (location_key, row['day'], row['category_name'] or '', name, row['item_type'])
+        values = item_rows.setdefault(key, [0.0, 0, 0.0, 0, 0.0, 0])
+        values[0] += row['sales'] or 0.0
+        values[1] += quantity
+        values[4] += cost
+        values[5] += row['transactions']
+
+    totals = db.execute(_TRANSACTION_TOTALS_SQL.format(where=where_sql), params).fetchall()
+    total_rows = [
+        (str(row['location_id']), row['day'], row['sales'] or 0.0,
+         day_cost.get((str(row['location_id']), row['day']), 0.0), row['transactions'])
+        for row in totals
+    ]
+    _insert(db, SOURCE_TRANSACTIONS, item_rows, total_rows)
+    return len(item_rows)
+
+def refresh_transaction_days(db, days):
+    """Rebuilds the 'transactions' rollups of just the given 'YYYY-MM-DD' days.
+
+    Consecutive days are refreshed as one range. Does not commit; returns
+    the number of rollup rows written.
+    """
+    count = 0
+    days = sorted(days)
+    start = 0
+    for i in range(1, len(days) + 1):
+        if i == len(days) or days[i] != _next_day(days[i - 1]):
+            count += refresh_transactions(db, days[start], days[i - 1])
+            start = i
+    return count
+
+# --- Reading ---
+
+def _filters(source, location_keys, start_date, end_date):
+    where = ['source = ?']
+    params = [source]
+    if location_keys is not None:
+        location_keys = [str(key) for key in location_keys]
+        where.append(f"location_key IN ({', '.join('?' for _ in location_keys)})")
+        params.extend(location_keys)
+    if start_date:
+        where.append('day >= ?')
+        params.append(start_date)
+    if end_date:
+        where.append('day <= ?')
+        params.append(end_date)
+    return ' AND '.join(where), params
+
+_CATEGORY_PROFIT_SQL = """
+    SELECT tc.name AS category, COALESCE(SUM(r.sales), 0) AS sales, COALESCE(SUM(r.cost), 0) AS cost
+    FROM treatment_categories tc
+    LEFT JOIN daily_sales_rollup r ON r.category = tc.name AND {where}
+    GROUP BY tc.name
+    ORDER BY tc.name
+"""
+
+def category_profit(db, source, location_keys=None, start_date=None, end_date=None):
+    """Returns [(category, sales, cost)] for every treatment category, in name order.
+
+    One grouped query: categories without sales in the range come back with
+    zeros, and only one row per category ever leaves SQLite.
+    """
+    where_sql, params = _filters(source, location_keys, start_date, end_date)
+    rows = db.execute(_CATEGORY_PROFIT_SQL.format(where=where_sql), params).fetchall()
+    return [(row['category'], row['sales'], row['cost']) for row in rows]
+
+def load_aggregate(db, location_keys, start_date=None, end_date=None, source=SOURCE_ORDERS, categorize=None):
+    """Reads the rollups back as an aggregate shaped like order_aggregation.aggregate_orders().
+
+    The timeline has daily resolution (one point per UTC day at midnight).
+    categorize(name) -> category, when given, re-derives the category of
+    every named item as it is read, so rollups written before the
+    categorization rules changed report the current categories.
+    """
+    where_sql, params = _filters(source, location_keys, start_date, end_date)
+
+    totals = db.execute(
+        f"""
+        SELECT day, location_key, sales, cost, transactions
+        FROM daily_order_totals
+        WHERE {where_sql}
+        ORDER BY day
+        """,
+        params
+    ).fetchall()
+
+    sales_by_location = defaultdict(float)
+    daily = {}
+    for row in totals:
+        sales_by_location[row['location_key']] += row['sales']
+        day = datetime.strptime(row['day'], '%Y-%m-%d').date()
+        metrics = daily.setdefault(day, {"sales": 0.0, "profit": 0.0, "transactions": 0})
+        metrics["sales"] += row['sales']
+        metrics["profit"] += row['sales'] - row['cost']
+        metrics["transactions"] += row['transactions']
+
+    days = sorted(daily)
+    timeline = {
+        "epoch": np.array([(day - _EPOCH_DATE).days * 86400 for day in days], dtype=np.int64),
+        "sales": np.array([daily[day]["sales"] for day in days], dtype=float),
+        "profit": np.array([daily[day]["profit"] for day in days], dtype=float),
+        "transactions": np.array([daily[day]["transactions"] for day in days], dtype=float),
+    }
+
+    rows = db.execute(
+        f"""
+        SELECT item_name, item_type, category,
+               SUM(sales) AS sales, SUM(quantity) AS quantity, SUM(cost) AS cost,
+               SUM(discount) AS discount, SUM(discount_count) AS discount_count
+        FROM daily_sales_rollup
+        WHERE {where_sql}
+        GROUP BY item_name, item_type, category
+        """,
+        params
+    ).fetchall()
+
+    category_sales = defaultdict(float)
+    sales_by_type = {"services": 0.0, "products": 0.0}
+    items = {}
+    discount_by_type = {"service": [0.0, 0], "product": [0.0, 0]}
+    categories = {}
+    for row in rows:
+        item_type = row['item_type']
+        sales = row['sales'] or 0.0
+        sales_by_type[item_type + 's'] += sales
+        category = row['category'] # '' for lines without a name
+        if category and categorize is not None:
+            category = categories.get(row['item_name'])
+            if category is None:
+                category = categories[row['item_name']] = categorize(row['item_name'])
+        if category:
+            category_sales[category] += sales
+
+        item = items.setdefault(row['item_name'], {
+            "name": row['item_name'],
+            "type": item_type,
+            "category": category or None,
+            "quantity": 0,
+            "total_sales": 0.0,
+            "total_cost": 0.0,
+        })
+        item["quantity"] += row['quantity'] or 0
+        item["total_sales"] += sales
+        item["total_cost"] += row['cost'] or 0.0
+
+        discount_by_type[item_type][0] += row['discount'] or 0.0
+        discount_by_type[item_type][1] += row['discount_count'] or 0
+
+    service_discount, product_discount = discount_by_type["service"], discount_by_type["product"]
+    discounts = {
+        "total_amount": service_discount[0] + product_discount[0],
+        "usage_count": service_discount[1] + product_discount[1],
+        # Estimate profit impact (assuming discount directly reduces profit)
+        "profit_impact": 0.0 - (service_discount[0] * 0.7 + product_discount[0] * 0.6),
+        "type": "",
+    }
+    if discounts["usage_count"]:
+        discounts["type"] = 'service' if service_discount[1] >= product_discount[1] else 'product'
+
+    transactions = sum(row['transactions'] for row in totals)
+    return {
+        "order_count": transactions,
+        "total_transactions": transactions,
+        "total_sales": sum(row['sales'] for row in totals),
+        "total_cost": sum(row['cost'] for row in totals),
+        "sales_by_location": dict(sales_by_location),
+        "daily": daily,
+        "timeline": timeline,
+        "category_sales": dict(category_sales),
+        "sales_by_type": sales_by_type,
+        "items": items,
+        "discounts": discounts,
+    }
+
+# --- Query plans ---
+
+# Tables the date-range queries below must reach through an index, never a full scan
+INDEXED_TABLES = (
+    'transactions', 'transaction_items', 'daily_sales_rollup', 'daily_order_totals',
+    'orders', 'order_lines', 'order_sync_state',
+)
+_INDEXED_NAMES = INDEXED_TABLES + ('t', 'ti', 'r', 'o', 'l') # Plus their aliases in the SQL
+
+def _range_queries(first_day, last_day, location_keys):
+    transaction_where, transaction_params = _transaction_range(first_day, last_day)
+    rollup_where, rollup_params = _filters(SOURCE_TRANSACTIONS, location_keys, first_day, last_day)
+    return {
+        'refresh_transactions (items)': (_TRANSACTION_ITEMS_SQL.format(where=transaction_where), transaction_params),
+        'refresh_transactions (totals)': (_TRANSACTION_TOTALS_SQL.format(where=transaction_where), transaction_params),
+        'category_profit': (_CATEGORY_PROFIT_SQL.format(where=rollup_where), rollup_params),
+        'load_aggregate (totals)': (
+            f"SELECT day, location_key, sales, cost, transactions FROM daily_order_totals WHERE {rollup_where} ORDER BY day",
+            rollup_params
+        ),
+        'load_aggregate (items)': (
+            f"SELECT item_name, item_type, category, SUM(sales) FROM daily_sales_rollup WHERE {rollup_where} "
+            "GROUP BY item_name, item_type, category",
+            rollup_params
+        ),
+        # Order store reads behind the Boulevard endpoints and refresh_orders
+        'order_store.synced_location_ids': order_store._synced_location_ids_query(location_keys),
+        'order_store.load_orders': order_store._load_orders_query(location_keys, first_day, last_day),
+    }
+
+def full_scans(db, first_day='2025-01-01', last_day='2025-01-31', location_keys=('1',)):
+    """EXPLAINs the date-range queries; returns {query: [plan lines]} for those that fully scan an indexed table.
+
+    Empty means every query reads INDEXED_TABLES through an index or primary key.
+    """
+    problems = {}
+    for name, (sql, params) in _range_queries(first_day, last_day, list(location_keys)).items():
+        plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        scans = [line for line in plan if line.startswith('SCAN ') and line.split()[1] in _INDEXED_NAMES]
+        if scans:
+            problems[name] = plan
+    return problems
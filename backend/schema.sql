@@ -1,4 +1,14 @@
 -- Drop tables if they exist to ensure a clean state
+-- (tables added by migrations.py are dropped too; init-db re-runs the migrations)
+DROP TABLE IF EXISTS import_job_errors;
+DROP TABLE IF EXISTS import_jobs;
+DROP TABLE IF EXISTS item_cost_index;
+DROP TABLE IF EXISTS cost_index_state;
+DROP TABLE IF EXISTS daily_sales_rollup;
+DROP TABLE IF EXISTS daily_order_totals;
+DROP TABLE IF EXISTS order_lines;
+DROP TABLE IF EXISTS orders;
+DROP TABLE IF EXISTS order_sync_state;
 DROP TABLE IF EXISTS transaction_items;
 DROP TABLE IF EXISTS transactions;
 DROP TABLE IF EXISTS employees;
@@ -0,0 +1,310 @@
+"""Flask-Caching backend shared by every worker through a SQLite file.
+
+SimpleCache lives inside one process, so each gunicorn worker kept its own
+cold copy of every cached response and Boulevard fetch. SQLiteCache stores
+pickled values in one SQLite database (WAL mode, in the instance folder by
+default) that all workers on the host read and write:
+
+- TTLs: every entry has an absolute expiry; expired entries read as missing
+  and are purged when the cache needs room
+- size bound: at most CACHE_THRESHOLD entries and CACHE_SQLITE_MAX_BYTES of
+  pickled values; the least recently used entries are evicted first
+- get_or_set(): on a miss one worker computes the value under a short-lived
+  per-key lock while the others wait for it instead of fetching it again
+- stats(): hits, misses, evictions and expirations, per process and summed
+  across workers (process counters are flushed to the database periodically)
+
+Enable it with CACHE_TYPE = 'shared_cache.SQLiteCache'.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask_caching.backends.base import BaseCache
+
+# Cache database (default: <instance folder>/shared_cache.sqlite)
+CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH')
+# Total pickled bytes kept before least recently used entries are evicted
+CACHE_SQLITE_MAX_BYTES = int(os.getenv('CACHE_SQLITE_MAX_BYTES', str(256 * 1024 * 1024)))
+# Seconds a get_or_set() producer may hold its key before another worker takes over
+CACHE_LOCK_TIMEOUT = float(os.getenv('CACHE_LOCK_TIMEOUT', '60'))
+
+# An entry's last access is written at most this often (keeps hits mostly read-only)
+_TOUCH_INTERVAL = 1.0
+# Process counters are added to the shared totals at most this often
+_STATS_FLUSH_INTERVAL = 5.0
+_LOCK_POLL_INTERVAL = 0.05
+_COUNTERS = ('hits', 'misses', 'sets', 'evictions', 'expirations')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries (expires_at);
+CREATE TABLE IF NOT EXISTS cache_locks (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_NO_EXPIRY = float('inf')
+
+class SQLiteCache(BaseCache):
+    """Size-bounded LRU cache with TTLs in a SQLite file shared across processes."""
+
+    def __init__(self, path, threshold=2000, max_bytes=CACHE_SQLITE_MAX_BYTES, default_timeout=300,
+                 ignore_delete_many_errors=False, lock_timeout=CACHE_LOCK_TIMEOUT):
+        super().__init__(default_timeout=default_timeout, ignore_delete_many_errors=ignore_delete_many_errors)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._counters = dict.fromkeys(_COUNTERS, 0) # this process, since start
+        self._unflushed = dict.fromkeys(_COUNTERS, 0)
+        self._flushed_at = time.monotonic()
+        db = self._db()
+        db.executescript(_SCHEMA)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        path = config.get('CACHE_SQLITE_PATH') or CACHE_SQLITE_PATH or os.path.join(app.instance_path, 'shared_cache.sqlite')
+        kwargs.update(threshold=config.get('CACHE_THRESHOLD', 2000))
+        kwargs.setdefault('max_bytes', config.get('CACHE_SQLITE_MAX_BYTES', CACHE_SQLITE_MAX_BYTES))
+        return cls(path, *args, **kwargs)
+
+    # --- Connections ---
+
+    def _db(self):
+        """One connection per thread (and per process: forked workers reconnect)."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _expires_at(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else _NO_EXPIRY
+
+    # --- Stats ---
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._counters[name] += amount
+            self._unflushed[name] += amount
+            due = time.monotonic() - self._flushed_at >= _STATS_FLUSH_INTERVAL
+        if due:
+            self._flush_stats()
+
+    def _flush_stats(self):
+        with self._stats_lock:
+            deltas = [(name, count) for name, count in self._unflushed.items() if count]
+            self._unflushed = dict.fromkeys(_COUNTERS, 0)
+            self._flushed_at = time.monotonic()
+        if not deltas:
+            return
+        try:
+            self._db().executemany(
+                'INSERT INTO cache_stats (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                deltas
+            )
+        except sqlite3.Error as e:
+            print(f"[Cache] Could not flush cache stats: {e}")
+
+    def stats(self):
+        """Entry count/bytes, this process's counters and the totals across all workers."""
+        self._flush_stats()
+        db = self._db()
+        entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        shared = dict.fromkeys(_COUNTERS, 0)
+        shared.update(db.execute('SELECT name, value FROM cache_stats').fetchall())
+        with self._stats_lock:
+            process = dict(self._counters)
+
+        def with_ratio(counters):
+            lookups = counters['hits'] + counters['misses']
+            return dict(counters, hit_ratio=round(counters['hits'] / lookups, 4) if lookups else None)
+
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "threshold": self.threshold,
+            "max_bytes": self.max_bytes,
+            "process": with_ratio(process),
+            "all_workers": with_ratio(shared),
+        }
+
+    # --- Reading ---
+
+    def _lookup(self, key, count_miss=True):
+        """(found, value) without falling back to None, so cached falsy values are hits."""
+        db = self._db()
+        row = db.execute('SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        found = False
+        value = None
+        if row is not None and row[1] <= now:
+            db.execute('DELETE FROM cache_entries WHERE key = ? AND expires_at <= ?', (key, now))
+            self._count('expirations')
+        elif row is not None:
+            if now - row[2] >= _TOUCH_INTERVAL:
+                db.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (now, key))
+            try:
+                found, value = True, pickle.loads(row[0])
+            except Exception as e:
+                print(f"[Cache] Dropping unreadable entry {key}: {e}")
+                db.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        if found:
+            self._count('hits')
+        elif count_miss:
+            self._count('misses')
+        return found, value
+
+    def get(self, key):
+        return self._lookup(key)[1]
+
+    def has(self, key):
+        row = self._db().execute('SELECT 1 FROM cache_entries WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+        return row is not None
+
+    # --- Writing ---
+
+    def _write(self, key, value, timeout, only_if_missing):
+        try:
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            print(f"[Cache] Value for {key} is not cacheable: {e}")
+            return False
+        now = time.time()
+        sql = (
+            'INSERT INTO cache_entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+            'expires_at = excluded.expires_at, accessed_at = excluded.accessed_at'
+        )
+        params = [key, payload, len(payload), self._expires_at(timeout), now]
+        if only_if_missing:
+            sql += ' WHERE cache_entries.expires_at <= ?'
+            params.append(now)
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            written = db.execute(sql, params).rowcount > 0
+            if written:
+                self._evict(db, now)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        if written:
+            self._count('sets')
+        return written
+
+    def _evict(self, db, now):
+        """Purges expired entries, then least recently used ones, until both bounds hold."""
+        entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        if entries <= self.threshold and size <= self.max_bytes:
+            return
+        expired = db.execute('DELETE FROM cache_entries WHERE expires_at <= ?', (now,)).rowcount
+        if expired:
+            self._count('expirations', expired)
+            entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        victims = []
+        for key, entry_size in db.execute('SELECT key, size FROM cache_entries ORDER BY accessed_at'):
+            if entries <= self.threshold and size <= self.max_bytes:
+                break
+            victims.append((key,))
+            entries -= 1
+            size -= entry_size
+        if victims:
+            db.executemany('DELETE FROM cache_entries WHERE key = ?', victims)
+            self._count('evictions', len(victims))
+
+    def set(self, key, value, timeout=None):
+        return self._write(key, value, timeout, only_if_missing=False)
+
+    def add(self, key, value, timeout=None):
+        return self._write(key, value, timeout, only_if_missing=True)
+
+    def get_or_set(self, key, producer, timeout=None):
+        """Returns the cached value, or stores and returns producer().
+
+        Only one caller (in any worker) runs the producer for a key at a time;
+        the others wait for its result. If the producer takes longer than
+        lock_timeout, a waiting caller takes the key over. None results are
+        returned but not cached.
+        """
+        found, value = self._lookup(key)
+        if found:
+            return value
+        owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + self.lock_timeout
+        while not self._acquire(key, owner):
+            time.sleep(_LOCK_POLL_INTERVAL)
+            found, value = self._lookup(key, count_miss=False)
+            if found:
+                return value
+            if time.monotonic() >= deadline:
+                print(f"[Cache] Gave up waiting for {key}; computing it here")
+                value = producer()
+                if value is not None:
+                    self.set(key, value, timeout)
+                return value
+        try:
+            # Another worker may have stored it between our miss and taking the lock
+            found, value = self._lookup(key, count_miss=False)
+            if found:
+                return value
+            value = producer()
+            if value is not None:
+                self.set(key, value, timeout)
+            return value
+        finally:
+            self._db().execute('DELETE FROM cache_locks WHERE key = ? AND owner = ?', (key, owner))
+
+    def _acquire(self, key, owner):
+        now = time.time()
+        cursor = self._db().execute(
+            'INSERT INTO cache_locks (key, owner, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+            'WHERE cache_locks.expires_at <= ?',
+            (key, owner, now + self.lock_timeout, now)
+        )
+        return cursor.rowcount > 0
+
+    # --- Deleting ---
+
+    def delete(self, key):
+        return self._db().execute('DELETE FROM cache_entries WHERE key = ?', (key,)).rowcount > 0
+
+    def delete_prefix(self, prefix):
+        """Deletes every key starting with prefix; returns how many were removed."""
+        return self._db().execute('DELETE FROM cache_entries WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)).rowcount
+
+    def clear(self):
+        db = self._db()
+        db.execute('DELETE FROM cache_entries')
+        db.execute('DELETE FROM cache_locks')
+        return True
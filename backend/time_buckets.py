@@ -0,0 +1,103 @@
+"""Vectorized time bucketing with zero-filled gaps.
+
+Timestamps (epoch seconds, UTC) are mapped to integer bucket indexes with
+NumPy arithmetic and summed with bincount over the whole bucket range, so a
+multi-year series is bucketed and gap-filled in one linear pass.
+
+Buckets are labelled by their first instant:
+    hour     'YYYY-MM-DDTHH:00:00'
+    day      'YYYY-MM-DD'
+    week     'YYYY-MM-DD' of the Monday
+    month    'YYYY-MM-01'
+    quarter  'YYYY-MM-01' of the quarter's first month
+"""
+from datetime import date, datetime
+
+import numpy as np
+
+INTERVALS = ('hour', 'day', 'week', 'month', 'quarter')
+
+_SECONDS_PER_DAY = 86400
+# 1970-01-01 was a Thursday; shifting by 3 days makes weeks start on Monday
+_WEEK_OFFSET_DAYS = 3
+
+def bucket_index(epoch_seconds, interval):
+    """Maps epoch seconds to integer bucket indexes for the interval."""
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+    if interval == 'hour':
+        return epoch_seconds // 3600
+    days = epoch_seconds // _SECONDS_PER_DAY
+    if interval == 'day':
+        return days
+    if interval == 'week':
+        return (days + _WEEK_OFFSET_DAYS) // 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if interval == 'month':
+        return months
+    if interval == 'quarter':
+        return months // 3
+    raise ValueError(f"Invalid interval '{interval}'. Must be one of: {', '.join(INTERVALS)}")
+
+def bucket_labels(indexes, interval):
+    """Formats bucket indexes (see bucket_index) as label strings."""
+    indexes = np.asarray(indexes, dtype=np.int64)
+    if interval == 'hour':
+        return np.datetime_as_string(indexes.astype('datetime64[h]'), unit='s').tolist()
+    if interval == 'day':
+        starts = indexes.astype('datetime64[D]')
+    elif interval == 'week':
+        starts = (indexes * 7 - _WEEK_OFFSET_DAYS).astype('datetime64[D]')
+    elif interval == 'month':
+        starts = indexes.astype('datetime64[M]').astype('datetime64[D]')
+    elif interval == 'quarter':
+        starts = (indexes * 3).astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        raise ValueError(f"Invalid interval '{interval}'. Must be one of: {', '.join(INTERVALS)}")
+    return np.datetime_as_string(starts, unit='D').tolist()
+
+def _epoch(value, end_of_day=False):
+    """Converts a 'YYYY-MM-DD' string / date / datetime to the epoch seconds of its (UTC) day."""
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], '%Y-%m-%d').date()
+    elif isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        seconds = int(np.datetime64(value, 'D').astype(np.int64)) * _SECONDS_PER_DAY
+        return seconds + _SECONDS_PER_DAY - 1 if end_of_day else seconds
+    raise TypeError(f"Unsupported date value: {value!r}")
+
+def resample(epoch_seconds, values, interval, start=None, end=None):
+    """Sums each value series into interval buckets, zero-filling empty buckets.
+
+    epoch_seconds: timestamps of the observations
+    values: {name: array of the same length}
+    start / end: inclusive bounds (dates or 'YYYY-MM-DD'); default to the data's span
+
+    Returns (labels, {name: array}) with one entry per bucket from start to end.
+    """
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+    indexes = bucket_index(epoch_seconds, interval)
+
+    if start is not None:
+        first = int(bucket_index(_epoch(start), interval))
+    elif len(indexes):
+        first = int(indexes.min())
+    else:
+        return [], {name: np.zeros(0) for name in values}
+    if end is not None:
+        last = int(bucket_index(_epoch(end, end_of_day=True), interval))
+    elif len(indexes):
+        last = int(indexes.max())
+    else:
+        last = first
+    if last < first:
+        return [], {name: np.zeros(0) for name in values}
+
+    size = last - first + 1
+    in_range = (indexes >= first) & (indexes <= last)
+    positions = indexes[in_range] - first
+    sums = {
+        name: np.bincount(positions, weights=np.asarray(series, dtype=float)[in_range], minlength=size)
+        for name, series in values.items()
+    }
+    return bucket_labels(np.arange(first, last + 1), interval), sums
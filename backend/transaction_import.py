@@ -0,0 +1,389 @@
+"""Vectorized import of uploaded transaction CSVs.
+
+Each CSV row is one line item and becomes its own transaction (the export
+has no transaction identifier). Rows are validated and mapped column-wise:
+
+- location_name is joined against locations.name
+- product rows are joined on products.sku, service rows on services.name
+  (exact, then case-insensitive)
+- transaction_time, quantity and net_price are parsed as whole columns
+
+Failed checks become boolean masks; each bad row reports its first failure
+in the same order the old row-by-row import checked them. Valid rows are
+written with executemany() calls inside the caller's transaction.
+
+Every imported row is stored under a natural key (transactions.external_key):
+the transaction_key column (e.g. the Sale id of "Detailed Line Item.csv" or
+the Order ID of "Transaction Details.csv") or, in replace imports without
+one, a hash of the row's mapped values. Repeats of a key within a file are
+numbered ('#1', '#2', ...), so a sale with several lines or two identical
+purchases keep distinct keys. Import modes:
+
+    replace  delete every transaction, then insert the file
+    upsert   insert rows with new keys, update rows whose key exists but whose
+             values changed, skip the rest; work is proportional to the delta.
+             Requires transaction_key on every row: a hash changes with the
+             values, so an edited row would be inserted again, not updated
+"""
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = [
+    'transaction_time',
+    'location_name',
+    'item_type',
+    'item_identifier',
+    'quantity',
+    'net_price'
+]
+# Natural key of the sale/order a row belongs to (required by upsert imports)
+KEY_COLUMN = 'transaction_key'
+
+MODE_REPLACE = 'replace'
+MODE_UPSERT = 'upsert'
+IMPORT_MODES = (MODE_REPLACE, MODE_UPSERT)
+
+# Rows a CSV's first data row is reported as (row 1 is the header)
+FIRST_DATA_ROW = 2
+# Data rows validate_upload() parses for its type and format checks
+VALIDATION_SAMPLE_ROWS = int(os.getenv('VALIDATION_SAMPLE_ROWS', '1000'))
+
+def missing_columns(columns, mode=MODE_REPLACE):
+    """Required columns (plus KEY_COLUMN for upsert imports) that are not in `columns`."""
+    required = REQUIRED_COLUMNS + [KEY_COLUMN] if mode == MODE_UPSERT else REQUIRED_COLUMNS
+    return [column for column in required if column not in columns]
+
+class Lookups:
+    """Name/SKU -> id maps used to resolve CSV rows, loaded once per import."""
+
+    def __init__(self, db):
+        self.locations = {row['name']: row['location_id'] for row in db.execute('SELECT location_id, name FROM locations')}
+        products = db.execute('SELECT product_id, sku, retail_price FROM products WHERE sku IS NOT NULL').fetchall()
+        self.product_ids = {row['sku']: row['product_id'] for row in products}
+        self.product_prices = {row['product_id']: row['retail_price'] for row in products}
+        services = db.execute('SELECT service_id, name, standard_price FROM services').fetchall()
+        self.service_ids = {row['name']: row['service_id'] for row in services}
+        self.service_prices = {row['service_id']: row['standard_price'] for row in services}
+        # Case-insensitive fallback; the first service wins when names differ only by case
+        self.service_ids_casefold = {}
+        for row in services:
+            self.service_ids_casefold.setdefault(row['name'].lower(), row['service_id'])
+
+def parse_times(values):
+    """Parses a column of timestamps; unparseable values become NaT.
+
+    The column is parsed in one call; values that don't fit the format
+    inferred for it (mixed formats in one file) are retried one distinct
+    value at a time.
+    """
+    times = pd.to_datetime(values, errors='coerce')
+    retry = times.isna() & values.notna()
+    if retry.any():
+        parsed = {}
+        for value in values[retry].unique():
+            try:
+                parsed[value] = pd.to_datetime(value)
+            except (ValueError, TypeError, OverflowError):
+                parsed[value] = pd.NaT
+        times = times.astype(object)
+        times[retry] = values[retry].map(parsed)
+        times = pd.to_datetime(times, errors='coerce')
+    return times
+
+def _natural_keys(df, rows, valid, seen):
+    """external_key for each valid row; `seen` ({base key: count}) carries repeat numbering across chunks."""
+    base = pd.Series(index=rows.index, dtype=object)
+    if KEY_COLUMN in df.columns:
+        given = df[KEY_COLUMN][valid]
+        given = given.where(given.notna(), None)
+        given.index = rows.index
+        present = given.notna() & (given.astype(str).str.strip() != '')
+        base[present] = 'k:' + given[present].astype(str).str.strip()
+    missing = base.isna()
+    if missing.any():
+        hashed = pd.util.hash_pandas_object(
+            rows.loc[missing, ['location_id', 'transaction_time', 'item_type', 'product_id', 'service_id', 'quantity', 'net_price']],
+            index=False
+        )
+        base[missing] = 'h:' + hashed.map('{:016x}'.format)
+
+    previous = base.map(seen).fillna(0).astype(np.int64)
+    occurrence = previous + base.groupby(base).cumcount() + 1
+    for key, count in base.value_counts().items():
+        seen[key] = seen.get(key, 0) + int(count)
+    return base + '#' + occurrence.astype(str)
+
+class _Mapped:
+    """A frame's columns parsed and resolved against the lookups."""
+
+    def __init__(self, df, lookups):
+        self.location_ids = df['location_name'].map(lookups.locations)
+        self.times = parse_times(df['transaction_time'])
+        self.item_types = df['item_type'].astype(str).str.lower()
+        self.identifiers = df['item_identifier'].astype(str)
+
+        self.is_product = self.item_types == 'product'
+        self.is_service = self.item_types == 'service'
+        self.product_ids = self.identifiers.where(self.is_product).map(lookups.product_ids)
+        service_ids = self.identifiers.where(self.is_service).map(lookups.service_ids)
+        self.service_ids = service_ids.fillna(self.identifiers.where(self.is_service).str.lower().map(lookups.service_ids_casefold))
+
+        self.quantities = pd.to_numeric(df['quantity'], errors='coerce')
+        self.net_prices = pd.to_numeric(df['net_price'], errors='coerce')
+
+def _missing_keys(df):
+    keys = df[KEY_COLUMN] if KEY_COLUMN in df.columns else pd.Series(None, index=df.index, dtype=object)
+    return keys.isna() | (keys.astype(str).str.strip() == '')
+
+def _checks(df, mapped, require_key=False):
+    """[(column, failed mask, message(i))] in the order rows are checked (df has a 0..n-1 index)."""
+    quantity_or_price = lambda i: f"Invalid quantity or net_price ('{df.at[i, 'quantity']}', '{df.at[i, 'net_price']}')"
+    key_checks = [(KEY_COLUMN, _missing_keys(df), lambda i: f"Missing {KEY_COLUMN} (required by upsert imports)")] if require_key else []
+    return key_checks + [
+        ('location_name', mapped.location_ids.isna(), lambda i: f"Unknown location_name '{df.at[i, 'location_name']}'"),
+        ('transaction_time', mapped.times.isna(), lambda i: f"Invalid transaction_time format '{df.at[i, 'transaction_time']}'"),
+        ('item_identifier', mapped.is_product & mapped.product_ids.isna(), lambda i: f"Unknown product SKU '{mapped.identifiers[i]}'"),
+        ('item_identifier', mapped.is_service & mapped.service_ids.isna(), lambda i: f"Unknown service name '{mapped.identifiers[i]}'"),
+        ('item_type', ~(mapped.is_product | mapped.is_service), lambda i: f"Invalid item_type '{mapped.item_types[i]}'"),
+        ('quantity', mapped.quantities.isna() | np.isinf(mapped.quantities), quantity_or_price),
+        ('net_price', mapped.net_prices.isna(), quantity_or_price),
+    ]
+
+def prepare(df, lookups, first_row=FIRST_DATA_ROW, seen=None, mode=MODE_REPLACE):
+    """Validates and maps a frame of CSV rows.
+
+    Returns (rows, errors): rows is a frame with external_key, location_id,
+    transaction_time ('YYYY-MM-DD HH:MM:SS'), item_type, product_id,
+    service_id, quantity, unit_price and net_price for every valid row,
+    indexed by CSV row number; errors is a list of (row_number, message) in
+    row order. Pass the same `seen` dict for every chunk of one file so
+    repeated keys are numbered across chunks. In upsert mode a row without a
+    transaction_key is an error instead of getting a hash key.
+    """
+    row_numbers = np.arange(first_row, first_row + len(df))
+    df = df.reset_index(drop=True)
+    mapped = _Mapped(df, lookups)
+
+    # First failing check per row, in the order they are listed
+    failed = pd.Series(False, index=df.index)
+    errors = []
+    for _, mask, message in _checks(df, mapped, require_key=mode == MODE_UPSERT):
+        new_failures = mask & ~failed
+        for i in np.flatnonzero(new_failures.to_numpy()):
+            errors.append((int(row_numbers[i]), message(i)))
+        failed |= new_failures
+    errors.sort(key=lambda error: error[0])
+
+    valid = ~failed
+    product_ids = mapped.product_ids[valid]
+    service_ids = mapped.service_ids[valid]
+    unit_prices = product_ids.map(lookups.product_prices).fillna(service_ids.map(lookups.service_prices))
+    rows = pd.DataFrame({
+        'location_id': mapped.location_ids[valid].astype(np.int64),
+        'transaction_time': mapped.times[valid].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'item_type': mapped.item_types[valid],
+        'product_id': product_ids.astype('Int64'),
+        'service_id': service_ids.astype('Int64'),
+        'quantity': mapped.quantities[valid].astype(np.int64),
+        'unit_price': unit_prices.fillna(0.0).astype(float).round(2),
+        'net_price': mapped.net_prices[valid].astype(float).round(2),
+    })
+    rows.index = row_numbers[valid.to_numpy()]
+    rows.insert(0, 'external_key', _natural_keys(df, rows, valid, {} if seen is None else seen))
+    return rows, errors
+
+def _next_transaction_id(db):
+    """First unused transaction_id (never reuses AUTOINCREMENT ids of deleted rows)."""
+    sequence = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'").fetchone()
+    highest = db.execute('SELECT MAX(transaction_id) FROM transactions').fetchone()[0]
+    return max(sequence[0] if sequence else 0, highest or 0) + 1
+
+def _nullable(values):
+    return [None if pd.isna(value) else int(value) for value in values]
+
+def insert(db, rows):
+    """Bulk-inserts prepared rows, one transaction per row. Does not commit; returns the row count."""
+    if rows.empty:
+        return 0
+    first_id = _next_transaction_id(db)
+    transaction_ids = list(range(first_id, first_id + len(rows)))
+    location_ids = rows['location_id'].tolist()
+    times = rows['transaction_time'].tolist()
+    net_prices = rows['net_price'].tolist()
+    db.executemany(
+        """
+        INSERT INTO transactions (transaction_id, external_key, customer_id, employee_id, location_id, transaction_time, total_amount)
+        VALUES (?, ?, NULL, NULL, ?, ?, ?)
+        """,
+        zip(transaction_ids, rows['external_key'].tolist(), location_ids, times, net_prices) # One line item per transaction
+    )
+    db.executemany(
+        """
+        INSERT INTO transaction_items (transaction_id, item_type, product_id, service_id, quantity, unit_price, net_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        zip(
+            transaction_ids,
+            rows['item_type'].tolist(),
+            _nullable(rows['product_id']),
+            _nullable(rows['service_id']),
+            rows['quantity'].tolist(),
+            rows['unit_price'].tolist(),
+            net_prices,
+        )
+    )
+    return len(rows)
+
+# Columns compared to decide whether an existing row changed
+_COMPARED_COLUMNS = ['location_id', 'transaction_time', 'item_type', 'product_id', 'service_id', 'quantity', 'unit_price', 'net_price']
+
+def _existing(db, keys):
+    """Stored rows for the given external keys, as a frame indexed by key."""
+    rows = db.execute(
+        """
+        SELECT t.external_key, t.transaction_id, t.location_id, t.transaction_time,
+               ti.item_type, ti.product_id, ti.service_id, ti.quantity, ti.unit_price, ti.net_price
+        FROM transactions t
+        JOIN transaction_items ti ON ti.transaction_id = t.transaction_id
+        WHERE t.external_key IN (SELECT value FROM json_each(?))
+        """,
+        (json.dumps(keys),)
+    ).fetchall()
+    columns = ['external_key', 'transaction_id'] + _COMPARED_COLUMNS
+    existing = pd.DataFrame([tuple(row) for row in rows], columns=columns)
+    existing['transaction_time'] = existing['transaction_time'].astype(str)
+    return existing.set_index('external_key')
+
+def upsert(db, rows):
+    """Inserts new keys and updates changed rows. Does not commit.
+
+    Returns (inserted, updated, unchanged, days, locations) where days is the
+    set of 'YYYY-MM-DD' days whose rollups are affected (old and new day of
+    updates) and locations the location ids they belong to.
+    """
+    if rows.empty:
+        return 0, 0, 0, set(), set()
+    existing = _existing(db, rows['external_key'].tolist())
+    known = rows['external_key'].isin(existing.index)
+    new_rows = rows[~known]
+
+    current = rows[known].set_index('external_key')
+    stored = existing.loc[current.index]
+    changed = np.zeros(len(current), dtype=bool)
+    for column in _COMPARED_COLUMNS:
+        left, right = current[column], stored[column]
+        if column in ('unit_price', 'net_price'):
+            changed |= ~np.isclose(left.to_numpy(dtype=float), right.to_numpy(dtype=float))
+        elif column in ('product_id', 'service_id'):
+            changed |= (left.astype('Int64').fillna(-1) != right.astype('Int64').fillna(-1)).to_numpy()
+        else:
+            changed |= (left.astype(str) != right.astype(str)).to_numpy()
+    updates = current[changed]
+    transaction_ids = [int(value) for value in stored.loc[changed, 'transaction_id']]
+
+    if len(updates):
+        db.executemany(
+            'UPDATE transactions SET location_id = ?, transaction_time = ?, total_amount = ? WHERE transaction_id = ?',
+            zip(updates['location_id'].tolist(), updates['transaction_time'].tolist(), updates['net_price'].tolist(), transaction_ids)
+        )
+        db.executemany(
+            """
+            UPDATE transaction_items
+            SET item_type = ?, product_id = ?, service_id = ?, quantity = ?, unit_price = ?, net_price = ?
+            WHERE transaction_id = ?
+            """,
+            zip(
+                updates['item_type'].tolist(),
+                _nullable(updates['product_id']),
+                _nullable(updates['service_id']),
+                updates['quantity'].tolist(),
+                updates['unit_price'].tolist(),
+                updates['net_price'].tolist(),
+                transaction_ids,
+            )
+        )
+    inserted = insert(db, new_rows)
+
+    days = set(new_rows['transaction_time'].str[:10])
+    days |= set(updates['transaction_time'].str[:10])
+    days |= set(stored.loc[changed, 'transaction_time'].str[:10])
+    locations = set(new_rows['location_id'].tolist()) | set(updates['location_id'].tolist())
+    locations |= set(stored.loc[changed, 'location_id'].tolist())
+    return inserted, len(updates), int((~changed).sum()), days, locations
+
+# --- Upload validation ---
+
+def read_header(stream):
+    """Column names from the first line of a binary CSV stream (UTF-8, optional BOM)."""
+    stream.seek(0)
+    line = stream.readline().decode('utf-8-sig')
+    return next(csv.reader([line]), [])
+
+def count_rows(stream, block_size=1 << 20):
+    """Data rows in a binary CSV stream, counted by scanning for newlines block by block.
+
+    Quoted fields containing line breaks are counted once per line.
+    """
+    stream.seek(0)
+    lines = 0
+    last = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines += block.count(b'\n')
+        last = block[-1:]
+    if last and last != b'\n':
+        lines += 1 # Last line without a trailing newline
+    return max(lines - 1, 0)
+
+def column_diagnostics(df, lookups, max_examples=5):
+    """{column: {'invalid': n, 'examples': [...]}} for each required column over the rows of df.
+
+    Unlike prepare(), every check is counted on its own (a row can fail
+    several), and examples are distinct offending values.
+    """
+    df = df.reset_index(drop=True)
+    mapped = _Mapped(df, lookups)
+    diagnostics = {column: {"invalid": 0, "examples": []} for column in REQUIRED_COLUMNS}
+    for column, mask, _ in _checks(df, mapped):
+        if not mask.any():
+            continue
+        diagnostic = diagnostics[column]
+        diagnostic["invalid"] += int(mask.sum())
+        for value in df.loc[mask, column].astype(str).unique():
+            if len(diagnostic["examples"]) >= max_examples:
+                break
+            if value not in diagnostic["examples"]:
+                diagnostic["examples"].append(value)
+    return diagnostics
+
+def validate_upload(stream, lookups, sample_rows=VALIDATION_SAMPLE_ROWS, mode=MODE_REPLACE):
+    """Checks an uploaded CSV without loading it: header, row count and the first `sample_rows` rows.
+
+    Returns {'columns', 'missing_columns', 'row_count', 'sample_rows',
+    'diagnostics'}; diagnostics is None when columns are missing. Raises
+    UnicodeDecodeError for files that are not UTF-8 and pd.errors.ParserError
+    for malformed CSV.
+    """
+    columns = read_header(stream)
+    missing = missing_columns(columns, mode)
+    result = {
+        "columns": columns,
+        "missing_columns": missing,
+        "row_count": count_rows(stream),
+        "sample_rows": 0,
+        "diagnostics": None,
+    }
+    if missing:
+        return result
+    stream.seek(0)
+    sample = pd.read_csv(stream, nrows=sample_rows) # Parses only as much of the stream as the sample needs
+    result["sample_rows"] = len(sample)
+    result["diagnostics"] = column_diagnostics(sample, lookups)
+    return result
+
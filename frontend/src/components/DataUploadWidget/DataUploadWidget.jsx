@@ -24,21 +24,46 @@ const validateUpload = async (file) => {
   }
 };
 
-const processDataAPI = async (file) => {
+const JOB_POLL_INTERVAL_MS = 1000;
+
+// Polls an import job until it finishes; onProgress receives each job snapshot
+const waitForImportJob = async (statusUrl, onProgress) => {
+  for (;;) {
+    const response = await fetch(statusUrl);
+    const job = await response.json();
+    if (!response.ok) {
+        throw new Error(job.error || `HTTP error! status: ${response.status}`);
+    }
+    if (job.finished) {
+        if (job.status !== 'succeeded') {
+            const rowErrors = (job.errors || []).slice(0, 20).map((e) => `Row ${e.row}: ${e.message}`);
+            throw new Error([job.message, ...rowErrors].join('\n'));
+        }
+        return job; // { status: 'succeeded', message: '...', rows_imported, ... }
+    }
+    if (onProgress) {
+        onProgress(job);
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+};
+
+const processDataAPI = async (file, mode, onProgress) => {
   const formData = new FormData();
   formData.append('file', file);
+  formData.append('mode', mode); // 'replace' or 'upsert'
 
   try {
-    // **IMPORTANT**: Use a new endpoint for processing
+    // The upload is queued as a background job (202 + job_id); poll it until done
     const response = await fetch('/api/v1/data/upload/process_transactions', {
       method: 'POST',
       body: formData,
     });
     const data = await response.json();
     if (!response.ok) {
-        throw new Error(data.message || `HTTP error! status: ${response.status}`);
+        throw new Error(data.message || data.error || `HTTP error! status: ${response.status}`);
     }
-    return data; // { status: 'success', message: '...' }
+    return await waitForImportJob(data.status_url, onProgress);
   } catch (error) {
     console.error("Data processing failed:", error);
     throw new Error(`Processing failed: ${error.message}`);
@@ -52,6 +77,7 @@ const DataUploadWidget = ({ onProcessSuccess }) => {
   const [processStatus, setProcessStatus] = useState(''); // '', 'processing', 'success', 'error'
   const [message, setMessage] = useState('');
   const [processMessage, setProcessMessage] = useState('');
+  const [upsertMode, setUpsertMode] = useState(false); // Only add new/changed rows instead of replacing everything
 
   // Reset validated file if selection changes
   useEffect(() => {
@@ -106,8 +132,8 @@ const DataUploadWidget = ({ onProcessSuccess }) => {
           return;
       }
       
-      // Confirmation dialog
-      const isConfirmed = window.confirm(
+      // Confirmation dialog (replacing deletes existing data)
+      const isConfirmed = upsertMode || window.confirm(
           'WARNING: Processing this file will PERMANENTLY DELETE existing transaction data and replace it with the contents of the uploaded file. Are you absolutely sure you want to proceed?'
       );
 
@@ -121,7 +147,9 @@ const DataUploadWidget = ({ onProcessSuccess }) => {
       setProcessMessage('Processing file and updating database... This may take a moment.');
 
       try {
-          const result = await processDataAPI(validatedFile);
+          const result = await processDataAPI(validatedFile, upsertMode ? 'upsert' : 'replace', (job) => {
+              setProcessMessage(`Processing file (${job.status})... ${job.rows_validated.toLocaleString()} rows checked.`);
+          });
           setProcessStatus('success');
           setProcessMessage(result.message);
           setValidatedFile(null); // Clear validated file after processing
@@ -160,8 +188,12 @@ const DataUploadWidget = ({ onProcessSuccess }) => {
         <div className="upload-step process-step">
           <h5>Step 2: Process Validated Data</h5>
           <p>File <strong>{validatedFile.name}</strong> passed validation.</p>
+          <label>
+            <input type="checkbox" checked={upsertMode} onChange={(e) => setUpsertMode(e.target.checked)} />
+            Keep existing data and only add new or changed rows
+          </label>
           <button onClick={handleProcess} disabled={processStatus === 'processing'}>
-            {processStatus === 'processing' ? 'Processing...' : 'Process & Replace Data'}
+            {processStatus === 'processing' ? 'Processing...' : (upsertMode ? 'Process & Update Data' : 'Process & Replace Data')}
           </button>
           {processMessage && (
             <div className={`message-area status-${processStatus}`}>
@@ -174,6 +206,7 @@ const DataUploadWidget = ({ onProcessSuccess }) => {
        <div className="upload-instructions">
         <p>Required columns:</p>
         <code>transaction_time, location_name, item_type, item_identifier, quantity, net_price</code>
+        <p>Required when updating: <code>transaction_key</code> (Sale id / Order ID) to match rows; optional when replacing.</p>
       </div>
     </div>
   );